@@ -39,8 +39,8 @@ class Cache(object):
         self.cache_dir = os.path.join(wsdir, ".rosrepo", "cache")
         self.preloaded = {}
 
-    def get_object(self, name, version, default=None):
-        if name in self.preloaded:
+    def get_object(self, name, version, default=None, reload=False):
+        if name in self.preloaded and not reload:
             if self.preloaded[name].version == version:
                 return self.preloaded[name].obj
             return default
@@ -21,17 +21,26 @@
 #
 #
 import os
-from .workspace import find_ros_root, get_workspace_location, get_workspace_state, resolve_this, WSFL_WS_PACKAGES
+from .workspace import find_ros_root, get_workspace_location, get_workspace_state, get_workspace_fingerprint, resolve_this, \
+                       Package, WSFL_WS_PACKAGES
 from .cmd_git import clone_packages
 from .resolver import find_dependees, resolve_system_depends
+from .depgraph import get_build_schedule, DEPEND_PROFILES
 from .config import Config
 from .cache import Cache
 from .ui import msg, warning, error, fatal, show_conflicts, show_missing_system_depends
 from .util import call_process, find_program, iteritems, getmtime, PIPE, env_path_list_contains, \
-                run_multiprocess_workers
+                run_multiprocess_workers, NamedTuple
 from functools import reduce
 
 
+BUILD_PLAN_CACHE_VERSION = 1
+
+
+class BuildPlan(NamedTuple):
+    __slots__ = ("fingerprint", "build_packages", "system_depends", "missing", "clean_packages")
+
+
 def run(args):
     wsdir = get_workspace_location(args.workspace)
     config = Config(wsdir)
@@ -59,7 +68,9 @@ def run(args):
         )
         fatal("need to clean workspace")
 
-    ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline)
+    ws_state = None
+    if args.this or args.all or args.rebuild:
+        ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline)
     if args.last:
         args.packages = config["last_build"]
     if args.this:
@@ -102,15 +113,28 @@ def run(args):
         msg(", ".join(sorted(list(pinned_set - build_set))) + "\n\n", indent=4)
     config["last_build"] = list(build_set)
     clean_set = build_set.copy()
+    profile = args.profile or config.get("depend_profile", "full")
     build_set |= pinned_set
     if not build_set:
         fatal("no packages to build\n")
-    build_packages, system_depends, conflicts = find_dependees(build_set, ws_state)
-    show_conflicts(conflicts)
-    if conflicts:
-        fatal("cannot resolve dependencies\n")
-    clean_packages, _, _ = find_dependees(clean_set, ws_state, auto_resolve=True, ignore_missing=True)
-    clean_packages = set(clean_packages.keys()) & set(ws_state.ws_packages.keys())
+    # If nothing has changed since the last build, we can skip loading the
+    # workspace state and resolving dependencies altogether
+    plan_key = (sorted(build_set), sorted(clean_set), profile)
+    build_plan = cache.get_object("build_plan", BUILD_PLAN_CACHE_VERSION)
+    if build_plan is not None and build_plan.fingerprint != get_workspace_fingerprint(wsdir, config, cache, ros_rootdir, plan_key):
+        build_plan = None
+    if build_plan is not None:
+        build_packages, system_depends, missing, clean_packages = build_plan.build_packages, build_plan.system_depends, build_plan.missing, build_plan.clean_packages
+    else:
+        if ws_state is None:
+            ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline)
+        build_packages, system_depends, conflicts = find_dependees(build_set, ws_state, profile=profile)
+        show_conflicts(conflicts)
+        if conflicts:
+            fatal("cannot resolve dependencies\n")
+        clean_packages, _, _ = find_dependees(clean_set, ws_state, auto_resolve=True, ignore_missing=True, profile=profile)
+        clean_packages = set(clean_packages.keys()) & set(ws_state.ws_packages.keys())
+        missing = resolve_system_depends(ws_state, system_depends, missing_only=True)
     if not args.dry_run:
         config.write()
 
@@ -122,22 +146,28 @@ def run(args):
     if system_depends:
         msg("@{cf}The following system packages are needed to satisfy dependencies@|:\n")
         msg(", ".join(sorted(system_depends)) + "\n\n", indent=4)
-    missing = resolve_system_depends(ws_state, system_depends, missing_only=True)
     show_missing_system_depends(missing)
     if missing and not args.ignore_missing_depends:
         fatal("missing system packages (use -m/--ignore-missing-depends) to build anyway)\n")
 
-    if args.clone:
-        clone_packages(srcdir, build_packages, ws_state, config, protocol=args.protocol or config.get("git_default_transport", "ssh"), offline_mode=args.offline, dry_run=args.dry_run)
-        ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline, ws_state=ws_state, flags=WSFL_WS_PACKAGES)
-    build_packages, _, conflicts = find_dependees(build_set, ws_state)
-    show_conflicts(conflicts)
-    assert not conflicts
-    missing_ws = [n for n in build_packages if n not in ws_state.ws_packages]
-    if missing_ws and not args.dry_run:
-        msg("@{cf}The following packages are missing from your workspace@|:\n")
-        msg(", ".join(sorted(missing_ws)) + "\n\n", indent=4)
-        fatal("missing build dependencies\n")
+    if build_plan is None:
+        if args.clone:
+            clone_packages(srcdir, build_packages, ws_state, config, protocol=args.protocol or config.get("git_default_transport", "ssh"), offline_mode=args.offline, dry_run=args.dry_run)
+            ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline, ws_state=ws_state, flags=WSFL_WS_PACKAGES)
+        build_packages, _, conflicts = find_dependees(build_set, ws_state, profile=profile)
+        show_conflicts(conflicts)
+        assert not conflicts
+        missing_ws = [n for n in build_packages if n not in ws_state.ws_packages]
+        if missing_ws and not args.dry_run:
+            msg("@{cf}The following packages are missing from your workspace@|:\n")
+            msg(", ".join(sorted(missing_ws)) + "\n\n", indent=4)
+            fatal("missing build dependencies\n")
+        if not missing_ws:
+            cache.set_object("build_plan", BUILD_PLAN_CACHE_VERSION, BuildPlan(
+                fingerprint=get_workspace_fingerprint(wsdir, config, cache, ros_rootdir, plan_key),
+                build_packages=dict((name, Package(manifest=pkg.manifest, workspace_path=pkg.workspace_path)) for name, pkg in iteritems(build_packages)),
+                system_depends=system_depends, missing=missing, clean_packages=clean_packages
+            ))
 
     if config["last_ros_root"] != ros_rootdir and not args.dry_run:
         invoke = ["catkin", "config", "--extend", ros_rootdir]
@@ -204,7 +234,7 @@ def run(args):
     else:
         jobs = None
 
-    catkin_build += build_packages.keys()
+    catkin_build += get_build_schedule(build_packages, dep_types=DEPEND_PROFILES[profile]).order
 
     if args.verbose:
         catkin_build += ["--make-args", "VERBOSE=ON"]
@@ -25,7 +25,7 @@ from .config import Config
 from .cache import Cache
 from .ui import msg, warning, fatal, show_conflicts
 from .util import call_process, PIPE
-from .resolver import find_dependees
+from .resolver import find_dependee_closures
 import os
 try:
     from os import scandir
@@ -59,11 +59,12 @@ def run(args):
             if d.is_dir() and d.name not in ws_state.ws_packages and not d.name == "catkin_tools_prebuild":
                 args.packages.append(d.name)
         if args.unused:
-            depends, _, conflicts = find_dependees(config["pinned_build"] + config["default_build"], ws_state, ignore_missing=True)
+            closures, _, conflicts = find_dependee_closures(config["pinned_build"] + config["default_build"], ws_state, ignore_missing=True)
             show_conflicts(conflicts)
             if conflicts:
                 fatal("cannot resolve dependencies\n")
-            unused_packages = set(ws_state.ws_packages) - set(depends.keys())
+            used_packages = closures.get_names(closures.closure(config["pinned_build"] + config["default_build"]))
+            unused_packages = set(ws_state.ws_packages) - used_packages
             args.packages += [p for p in unused_packages if os.path.isdir(os.path.join(wsdir, "build", p))]
         if not args.packages:
             msg("Nothing to clean\n")
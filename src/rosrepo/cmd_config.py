@@ -23,6 +23,7 @@
 import sys
 import requests
 import platform
+import os
 try:
     from urlparse import urljoin
 except ImportError:
@@ -32,6 +33,7 @@ from .gitlab import acquire_gitlab_private_token, get_gitlab_projects
 from .cache import Cache
 from .config import Config
 from .ui import TableView, msg, warning, fatal, escape
+from .gitlab import GITLAB_FILTER_KEYS, export_gitlab_index
 from .common import DEFAULT_CMAKE_ARGS, update_default_git_ignore, get_c_compiler, get_cxx_compiler
 from .util import call_process
 
@@ -42,6 +44,34 @@ except ImportError:
     from urllib.parse import urlsplit, urlunsplit
 
 
+def format_gitlab_filter(srv):
+    result = ["group:%s" % g for g in srv.get("groups", [])]
+    result += ["exclude-group:%s" % g for g in srv.get("exclude_groups", [])]
+    result += ["topic:%s" % t for t in srv.get("topics", [])]
+    if srv.get("membership", False):
+        result.append("membership")
+    if srv.get("exclude_archived", False):
+        result.append("no-archived")
+    return ", ".join(result)
+
+
+def add_gitlab_filter(srv, spec):
+    kind, _, value = spec.partition(":")
+    if kind in ["group", "exclude-group", "topic"]:
+        if not value:
+            fatal("filter '%s' needs a value\n" % kind)
+        key = {"group": "groups", "exclude-group": "exclude_groups", "topic": "topics"}[kind]
+        srv.setdefault(key, [])
+        if value not in srv[key]:
+            srv[key].append(value)
+    elif spec == "membership":
+        srv["membership"] = True
+    elif spec == "no-archived":
+        srv["exclude_archived"] = True
+    else:
+        fatal("invalid Gitlab filter '%s'\n" % spec)
+
+
 def show_config(config):
     table = TableView(expand=True)
     srv_list = []
@@ -56,11 +86,25 @@ def show_config(config):
         table.add_row("@{cf}Default Transport:", "@{yf}%s" % config["git_default_transport"])
     if "gitlab_crawl_depth" in config:
         table.add_row("@{cf}Crawl Depth:", "@{yf}%s" % config["gitlab_crawl_depth"])
+    if "gitlab_engine" in config:
+        table.add_row("@{cf}Gitlab Engine:", "@{yf}%s" % config["gitlab_engine"])
+    if "gitlab_connection_limit" in config:
+        table.add_row("@{cf}Connection Limit:", "@{yf}%s" % config["gitlab_connection_limit"])
+    if "gitlab_max_staleness" in config:
+        table.add_row("@{cf}Max. Staleness:", "@{yf}%ss" % config["gitlab_max_staleness"])
+    if "gitlab_network_budget" in config:
+        table.add_row("@{cf}Network Budget:", "@{yf}%gs" % config["gitlab_network_budget"])
+    if "gitlab_seed_index" in config:
+        table.add_row("@{cf}Seed Index:", "@{yf}" + escape(config["gitlab_seed_index"]))
+    if "gitlab_webhook_secret" in config:
+        table.add_row("@{cf}Webhook Secret:", "@{yf}Yes")
     table.add_separator()
     if "ros_root" in config:
         table.add_row("@{cf}Override ROS Path:", "@{yf}" + escape(config["ros_root"]))
     if "compiler" in config:
         table.add_row("@{cf}Compiler:", "@{yf}" + escape(config["compiler"]))
+    if "depend_profile" in config:
+        table.add_row("@{cf}Dependency Profile:", "@{yf}%s" % config["depend_profile"])
     jobs = config.get("job_limit", None)
     table.add_row("@{cf}Parallel Build Jobs:", "@{yf}" + ("%d" % jobs if jobs is not None else "Unlimited"))
     if "install" in config:
@@ -88,9 +132,9 @@ def run(args):
         if args.autocomplete:
             sys.stdout.write("\n".join([s.get("label", "") for s in servers]) + "\n")
             return 0
-        table = TableView("Label", "Gitlab URL", "Credentials")
+        table = TableView("Label", "Gitlab URL", "Credentials", "Webhooks", "Filters")
         for srv in servers:
-            table.add_row(escape(srv.get("label", "")), escape(srv.get("url", "")), "@{gf}yes" if srv.get("private_token", None) is not None else "@{rf}no")
+            table.add_row(escape(srv.get("label", "")), escape(srv.get("url", "")), "@{gf}yes" if srv.get("private_token", None) is not None else "@{rf}no", "@{gf}yes" if srv.get("webhooks", False) else "no", escape(format_gitlab_filter(srv)))
         table.write(fd=sys.stdout)
         return 0
 
@@ -201,6 +245,34 @@ def run(args):
                     private_token = acquire_gitlab_private_token(label, url)
                 srv["private_token"] = private_token
             config["gitlab_servers"].append(srv)
+    for label, enabled in [(args.gitlab_webhooks, True), (args.no_gitlab_webhooks, False)]:
+        if label is None:
+            continue
+        for srv in config.get("gitlab_servers", []):
+            if srv.get("label", None) == label:
+                if enabled:
+                    srv["webhooks"] = True
+                elif "webhooks" in srv:
+                    del srv["webhooks"]
+                break
+        else:
+            fatal("no such Gitlab server\n")
+    if args.clear_gitlab_filters:
+        for srv in config.get("gitlab_servers", []):
+            if srv.get("label", None) == args.clear_gitlab_filters:
+                for key in GITLAB_FILTER_KEYS:
+                    if key in srv:
+                        del srv[key]
+                break
+        else:
+            fatal("no such Gitlab server\n")
+    for label, spec in args.add_gitlab_filter or []:
+        for srv in config.get("gitlab_servers", []):
+            if srv.get("label", None) == label:
+                add_gitlab_filter(srv, spec)
+                break
+        else:
+            fatal("no such Gitlab server\n")
     if args.unset_gitlab_url:
         config.set_default("gitlab_servers", [])
         config["gitlab_servers"] = [srv for srv in config["gitlab_servers"] if srv["label"] != args.unset_gitlab_url]
@@ -246,6 +318,9 @@ def run(args):
             config["skip_catkin_lint"].remove(pkg)
     config["skip_catkin_lint"].sort()
 
+    if args.set_depend_profile is not None:
+        config["depend_profile"] = args.set_depend_profile
+
     config.set_default("use_env_cache", True)
     if args.env_cache is not None:
         config["use_env_cache"] = args.env_cache
@@ -256,6 +331,40 @@ def run(args):
             fatal("cannot reset crawl depth in offline mode")
         config["gitlab_crawl_depth"] = args.set_gitlab_crawl_depth
 
+    if args.set_gitlab_engine is not None:
+        if args.set_gitlab_engine == "asyncio" and sys.version_info[:2] < (3, 5):
+            fatal("the asyncio engine requires Python 3.5 or newer\n")
+        config["gitlab_engine"] = args.set_gitlab_engine
+
+    if args.set_gitlab_connection_limit is not None:
+        if args.set_gitlab_connection_limit < 1:
+            fatal("connection limit must be positive\n")
+        config["gitlab_connection_limit"] = args.set_gitlab_connection_limit
+
+    if args.set_gitlab_max_staleness is not None:
+        if args.set_gitlab_max_staleness < 0:
+            fatal("maximum staleness must not be negative\n")
+        config["gitlab_max_staleness"] = args.set_gitlab_max_staleness
+    if args.unset_gitlab_max_staleness:
+        del config["gitlab_max_staleness"]
+
+    if args.set_gitlab_network_budget is not None:
+        if args.set_gitlab_network_budget < 0:
+            fatal("network budget must not be negative\n")
+        config["gitlab_network_budget"] = args.set_gitlab_network_budget
+    if args.unset_gitlab_network_budget:
+        del config["gitlab_network_budget"]
+
+    if args.set_gitlab_seed_index is not None:
+        config["gitlab_seed_index"] = os.path.abspath(args.set_gitlab_seed_index)
+    if args.unset_gitlab_seed_index:
+        del config["gitlab_seed_index"]
+
+    if args.set_gitlab_webhook_secret is not None:
+        config["gitlab_webhook_secret"] = args.set_gitlab_webhook_secret
+    if args.unset_gitlab_webhook_secret:
+        del config["gitlab_webhook_secret"]
+
     config.set_default("git_default_transport", "ssh")
     if args.protocol:
         config["git_default_transport"] = args.protocol.lower()
@@ -269,6 +378,10 @@ def run(args):
         cache = Cache(wsdir)
         get_gitlab_projects(wsdir, config, cache, force_update=True, verbose=True)
 
+    if args.export_gitlab_index:
+        servers = export_gitlab_index(args.export_gitlab_index, config, Cache(wsdir))
+        msg("Exported %d projects from %d Gitlab servers\n" % (sum(len(srv.projects) for _, _, srv in servers), len(servers)))
+
     ros_rootdir = find_ros_root(config.get("ros_root"))
     if ros_rootdir is None:
         fatal("cannot detect ROS distribution. Please source setup.bash or use --ros-root option\n")
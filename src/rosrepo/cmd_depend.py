@@ -20,14 +20,59 @@
 # limitations under the License.
 #
 #
-from .workspace import get_workspace_location, get_workspace_state, resolve_this
+from .workspace import get_workspace_location, get_workspace_state, get_build_durations, resolve_this
 from .resolver import find_dependers, find_dependees
+from .depgraph import get_build_schedule, DEPEND_PROFILES
 from .config import Config
 from .cache import Cache
-from .ui import warning, error, TableView, escape
+from .ui import msg, warning, error, fatal, show_conflicts, TableView, escape
 import sys
 
 
+def format_duration(seconds):
+    if seconds < 60:
+        return "%.0fs" % seconds
+    return "%dm%02ds" % divmod(int(round(seconds)), 60)
+
+
+def show_plan(wsdir, config, ws_state, packages):
+    profile = config.get("depend_profile", "full")
+    depends, _, conflicts = find_dependees(packages, ws_state, profile=profile)
+    show_conflicts(conflicts)
+    if conflicts:
+        fatal("cannot resolve dependencies\n")
+    durations = get_build_durations(wsdir)
+    has_history = any(name in durations for name in depends)
+    schedule = get_build_schedule(depends, durations, DEPEND_PROFILES[profile])
+    table = TableView("Level", "Duration" if has_history else "Count", "Packages")
+    for level, names in enumerate(schedule.levels):
+        packages = []
+        for name in names:
+            color = "@{gf}" if name in ws_state.ws_packages else "@{yf}"
+            packages.append("%s%s@|" % (color, escape(name)) + (" (%s)" % format_duration(durations[name]) if name in durations else ""))
+        table.add_row("%d" % level, format_duration(max(schedule.durations[n] for n in names)) if has_history else "%d" % len(names), packages)
+    table.write(sys.stdout)
+    sys.stdout.write("\n")
+    if not schedule.order:
+        return
+    if not has_history:
+        msg("@{yf}No build history available, all packages are assumed to take equally long@|\n\n", fd=sys.stdout)
+    msg("@{cf}Critical path@|:\n", fd=sys.stdout)
+    msg(escape(" -> ".join(schedule.critical_path)) + "\n\n", indent=4, fd=sys.stdout)
+    table = TableView()
+    table.add_row("@{cf}Packages:", "%d" % len(schedule.order))
+    table.add_row("@{cf}Levels:", "%d" % len(schedule.levels))
+    table.add_row("@{cf}Widest Level:", "%d" % max(len(names) for names in schedule.levels))
+    if has_history:
+        table.add_row("@{cf}Total Build Time:", format_duration(schedule.total_time))
+        table.add_row("@{cf}Critical Path Time:", format_duration(schedule.critical_time))
+    else:
+        table.add_row("@{cf}Critical Path Length:", "%d" % len(schedule.critical_path))
+    # Packages that were built without measurable delay leave nothing to compare
+    table.add_row("@{cf}Average Parallelism:", "%.1f" % (schedule.total_time / schedule.critical_time) if schedule.critical_time > 0 else "n/a")
+    table.write(sys.stdout)
+
+
 def run(args):
     wsdir = get_workspace_location(args.workspace)
     config = Config(wsdir)
@@ -39,11 +84,14 @@ def run(args):
     ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline)
     if args.this:
         args.packages = resolve_this(wsdir, ws_state)
+    if args.plan:
+        show_plan(wsdir, config, ws_state, args.packages or config.get("default_build", []) + config.get("pinned_build", []))
+        return 0
 
-    table = TableView("Package", "Depends On", "Used By")
+    table = TableView("Package", "Depends On", "Affects" if args.affected else "Used By")
     for pkg in args.packages:
         if pkg not in ws_state.ws_packages and pkg not in ws_state.remote_packages and pkg not in ws_state.ros_root_packages:
-            rdepends, system_rdepends = find_dependers([pkg], ws_state)
+            rdepends, system_rdepends = find_dependers([pkg], ws_state, recursive=args.affected)
             dependers = []
             for dep in sorted(list(rdepends)):
                 if dep in ws_state.ws_packages:
@@ -54,7 +102,7 @@ def run(args):
                 dependers.append(escape(dep))
             table.add_row("@{rf}%s@|" % escape(pkg), "", dependers)
         else:
-            rdepends, system_rdepends = find_dependers([pkg], ws_state)
+            rdepends, system_rdepends = find_dependers([pkg], ws_state, recursive=args.affected)
             depends, system_depends, conflicts = find_dependees([pkg], ws_state, auto_resolve=True)
             dependers = []
             for dep in sorted(list(rdepends)):
@@ -75,7 +75,7 @@ def run(args):
     if not args.packages:
         args.packages = config.get("default_build", []) + config.get("pinned_build", [])
     protocol = args.protocol or config.get("git_default_transport", "ssh")
-    depends, _, conflicts = find_dependees(args.packages, ws_state)
+    depends, _, conflicts = find_dependees(args.packages, ws_state, profile=args.profile or config.get("depend_profile", "full"))
     show_conflicts(conflicts)
     if conflicts:
         fatal("cannot resolve dependencies\n")
@@ -0,0 +1,158 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+import hmac
+import json
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+from .workspace import get_workspace_location
+from .config import Config
+from .cache import Cache
+from .gitlab import gitlab_hook_lock, mark_gitlab_projects_dirty
+from .ui import msg, warning, fatal, escape
+
+
+# Push events for large pushes can be a few hundred kilobytes
+GITLAB_HOOK_MAX_BODY = 4 * 1024 * 1024
+
+
+def find_hook_server(servers, payload, headers):
+    # Gitlab 13.x and newer identify themselves, older versions only
+    # reveal their host name in the project URL
+    instance = headers.get("X-Gitlab-Instance", None)
+    if instance is None:
+        project = payload.get("project", None)
+        if isinstance(project, dict):
+            instance = project.get("web_url", None)
+    if instance is None:
+        return None
+    host = urlsplit(instance)[1]
+    for srv in servers:
+        if srv.get("url", None) is not None and urlsplit(srv["url"])[1] == host:
+            return srv
+    return None
+
+
+def is_valid_hook_token(token, secret):
+    if token is None:
+        return False
+    if not isinstance(token, bytes):
+        token = token.encode("UTF-8")
+    if not isinstance(secret, bytes):
+        secret = secret.encode("UTF-8")
+    # Constant time, so the secret cannot be guessed byte by byte
+    return hmac.compare_digest(token, secret)
+
+
+def find_hook_project_ids(payload):
+    result = set()
+    if "project_id" in payload:
+        result.add(payload["project_id"])
+    project = payload.get("project", None)
+    if isinstance(project, dict) and "id" in project:
+        result.add(project["id"])
+    return result
+
+
+class GitlabHookRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        hook = self.server
+        if hook.secret is not None and not is_valid_hook_token(self.headers.get("X-Gitlab-Token", None), hook.secret):
+            self.reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.reply(400)
+            return
+        if length < 0 or length > GITLAB_HOOK_MAX_BODY:
+            self.reply(413)
+            return
+        body = self.rfile.read(length)
+        try:
+            payload = json.loads(body.decode("UTF-8"))
+        except ValueError:
+            self.reply(400)
+            return
+        if not isinstance(payload, dict):
+            self.reply(400)
+            return
+        srv = find_hook_server(hook.servers, payload, self.headers)
+        project_ids = find_hook_project_ids(payload)
+        if srv is None or not project_ids:
+            self.reply(202)
+            return
+        with hook.lock:
+            mark_gitlab_projects_dirty(Cache(hook.wsdir), srv.get("label", None), srv["url"], project_ids)
+        if hook.verbose:
+            msg("@{cf}Changed@|: %s [%s]\n" % (", ".join(str(i) for i in sorted(project_ids)), escape(srv.get("label", srv["url"]))))
+        self.reply(200)
+
+
+class GitlabHookServer(HTTPServer):
+    """Receive Gitlab webhooks and mark the affected projects for update"""
+
+    def __init__(self, wsdir, servers, address=("127.0.0.1", 0), secret=None, verbose=True):
+        HTTPServer.__init__(self, address, GitlabHookRequestHandler)
+        self.wsdir = wsdir
+        self.servers = servers
+        self.secret = secret
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+
+def run(args):
+    wsdir = get_workspace_location(args.workspace)
+    config = Config(wsdir, read_only=True)
+    servers = [srv for srv in config.get("gitlab_servers", []) if srv.get("url", None) is not None]
+    if not servers:
+        fatal("no Gitlab servers configured\n")
+    if not any(srv.get("webhooks", False) for srv in servers):
+        warning("webhooks are not enabled for any Gitlab server. Run 'rosrepo config --gitlab-webhooks LABEL' to enable\n")
+    with gitlab_hook_lock(Cache(wsdir)) as acquired:
+        if not acquired:
+            fatal("another webhook listener is already running for this workspace\n")
+        httpd = GitlabHookServer(wsdir, servers, address=(args.bind, args.port), secret=args.secret or config.get("gitlab_webhook_secret", None))
+        msg("@{cf}Listening for Gitlab webhooks on@| %s:%d\n" % (httpd.server_address[0], httpd.server_address[1]))
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+    return 0
@@ -26,7 +26,7 @@ from .workspace import get_workspace_location, get_workspace_state, resolve_this
 from .cache import Cache
 from .config import Config
 from .ui import msg, warning, fatal, escape, show_conflicts, show_missing_system_depends, reformat_paragraphs
-from .resolver import find_dependees, resolve_system_depends
+from .resolver import find_dependees, find_dependee_closures, resolve_system_depends
 from .util import iteritems, is_deprecated_package, deprecated_package_info
 from .cmd_git import clone_packages, get_origin
 from pygit2 import Repository, GIT_STATUS_IGNORED, GIT_STATUS_CURRENT, GIT_BRANCH_REMOTE, GIT_REF_OID
@@ -108,7 +108,8 @@ def run(args):
         msg("@{cf}No packages selected for the default build@|\n\n")
 
     if args.command == "include":
-        depends, system_depends, conflicts = find_dependees(config["pinned_build"] + config["default_build"], ws_state)
+        profile = args.profile or config.get("depend_profile", "full")
+        depends, system_depends, conflicts = find_dependees(config["pinned_build"] + config["default_build"], ws_state, profile=profile)
         show_conflicts(conflicts)
         if conflicts:
             fatal("cannot resolve dependencies\n")
@@ -134,13 +135,13 @@ def run(args):
                     msg("@{yf}" + reformat_paragraphs(escape(details)) + "\n\n", indent=4)
 
     if args.delete_unused:
-        depends, system_depends, conflicts = find_dependees(config["pinned_build"] + config["default_build"], ws_state)
+        closures, system_depends, conflicts = find_dependee_closures(config["pinned_build"] + config["default_build"], ws_state)
         show_conflicts(conflicts)
         if conflicts:
             fatal("cannot resolve dependencies\n")
             ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline, ws_state=ws_state, flags=WSFL_WS_PACKAGES)
         unused_projects = set(ws_state.ws_projects)
-        for name, pkg in iteritems(depends):
+        for name, pkg in iteritems(closures.get_packages(closures.closure(config["pinned_build"] + config["default_build"]))):
             if pkg.project is not None:
                 unused_projects.discard(pkg.project)
         for p in unused_projects:
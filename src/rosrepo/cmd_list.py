@@ -25,7 +25,7 @@ import sys
 import fnmatch
 from .config import Config
 from .cache import Cache
-from .resolver import find_dependees
+from .resolver import find_dependee_closures
 from .workspace import get_workspace_location, get_workspace_state
 from .ui import msg, warning, escape, TableView, show_conflicts
 from .util import iteritems, is_deprecated_package
@@ -42,12 +42,14 @@ def run(args):
     config.set_default("default_build", [])
     config.set_default("pinned_build", [])
     ws_state = get_workspace_state(wsdir, config, cache, offline_mode=args.offline)
-    default_depends, _, default_conflicts = find_dependees(config["default_build"], ws_state)
-    pinned_depends, _, pinned_conflicts = find_dependees(config["pinned_build"], ws_state)
-    z = default_conflicts.copy()
-    z.update(pinned_conflicts)
+    closures, _, z = find_dependee_closures(config["default_build"] + config["pinned_build"], ws_state)
     show_conflicts(z)
-    conflicts = set(default_conflicts.keys()) | set(pinned_conflicts.keys())
+    conflicts = set(z.keys())
+    default_mask = closures.closure(config["default_build"])
+    pinned_mask = closures.closure(config["pinned_build"])
+    default_depends = closures.get_names(default_mask)
+    pinned_depends = closures.get_names(pinned_mask)
+    dependee_depends = closures.get_names(default_mask | pinned_mask)
     names = set()
     table = TableView("Package", "Status", "Location")
 
@@ -56,7 +58,7 @@ def run(args):
         in_workspace = hasattr(pkg_list[0], "workspace_path")
         in_pinned_set = name in config["pinned_build"]
         in_default_set = name in config["default_build"]
-        in_dependee_set = name in default_depends or name in pinned_depends
+        in_dependee_set = name in dependee_depends
         in_conflict_set = name in conflicts
         show = len(args.filter) == 0
         for flt in args.filter:
@@ -0,0 +1,333 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from array import array
+from distutils.version import LooseVersion as ManifestVersion
+
+from .util import iteritems, NamedTuple
+
+
+P_REMOTE = 1
+P_WS = 2
+P_ROS_ROOT = 3
+
+DEPEND_TYPES = ("buildtool_depends", "build_depends", "run_depends", "test_depends")
+
+# The build_export and buildtool_export dependencies of a package are
+# needed to build anything against it. They are part of run_depends, but
+# the build profile must be able to follow them on their own.
+EXPORT_DEPENDS = "export_depends"
+ADJACENCY_TYPES = DEPEND_TYPES + (EXPORT_DEPENDS,)
+
+# Dependency types which are followed for each resolution profile. The
+# build profile follows the export dependencies of the selected packages
+# as well, so that each profile is one fixed set of edges.
+DEPEND_PROFILES = {
+    "build": ("buildtool_depends", "build_depends", EXPORT_DEPENDS),
+    "run": ("buildtool_depends", "build_depends", "run_depends"),
+    "full": DEPEND_TYPES,
+}
+
+
+def get_depend_names(manifest, dep_type):
+    if dep_type == EXPORT_DEPENDS:
+        names = [d.name for d in manifest.build_export_depends + manifest.buildtool_export_depends]
+        return [name for i, name in enumerate(names) if name not in names[:i]]
+    slots = getattr(manifest, "__slots__", ())
+    if dep_type == "run_depends" and "run_depends" not in slots and "exec_depends" in slots:
+        # catkin_pkg computes run_depends on every access and deep-copies
+        # each dependency, which is far too slow for thousands of packages
+        names = [d.name for d in manifest.exec_depends + manifest.build_export_depends]
+        return [name for i, name in enumerate(names) if name not in names[:i]]
+    return [d.name for d in getattr(manifest, dep_type)]
+
+
+class DependencyGraph(object):
+    # Integer-indexed snapshot of all known packages. Every package name is
+    # a node, and every package which can satisfy a name is a slot. The
+    # candidate slots of a node are sorted by preference, and the
+    # dependencies of a slot are stored as one array of node ids per
+    # dependency type. Both are filled in on first use, so a query only
+    # pays for the part of the graph it actually visits. The reverse index
+    # (node -> depender slots per dependency type) needs the whole graph
+    # and is built by the first reverse query.
+
+    def __init__(self, ws_state):
+        self.names = []
+        self.ids = {}
+        self.candidates = []
+        self.sorted = bytearray()
+        self.packages = []
+        self.sources = []
+        self.nodes = []
+        self.adjacency = []
+        self.reverse = None
+        self.clashes = {}
+        ws_packages = self.ws_packages = ws_state.ws_packages or {}
+        ros_root_packages = ws_state.ros_root_packages or {}
+        remote_packages = ws_state.remote_packages or {}
+        for name, pkg_list in iteritems(ws_packages):
+            # If the package is in the workspace, it will be used unconditionally
+            node = self.node(name)
+            self.candidates[node] = [self.add_package(node, pkg_list[0], P_WS)]
+        for name, pkg_list in iteritems(ros_root_packages):
+            if name not in ws_packages:
+                node = self.node(name)
+                self.candidates[node] = [self.add_package(node, pkg_list[0], P_ROS_ROOT)]
+        for name, pkg_list in iteritems(remote_packages):
+            if name not in ws_packages:
+                node = self.node(name)
+                self.candidates[node] += [self.add_package(node, pkg, P_REMOTE) for pkg in pkg_list]
+
+    def __len__(self):
+        return len(self.names)
+
+    def node(self, name):
+        node = self.ids.get(name)
+        if node is None:
+            node = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.candidates.append([])
+            self.sorted.append(0)
+        return node
+
+    def add_package(self, node, pkg, source):
+        self.packages.append(pkg)
+        self.sources.append(source)
+        self.nodes.append(node)
+        self.adjacency.append(None)
+        return len(self.packages) - 1
+
+    def get_candidates(self, node):
+        # Returns the slots which can satisfy the node, best candidate first
+        if not self.sorted[node]:
+            if len(self.candidates[node]) > 1:
+                self.candidates[node].sort(key=lambda slot: (ManifestVersion(self.packages[slot].manifest.version), self.sources[slot]), reverse=True)
+            self.sorted[node] = 1
+        return self.candidates[node]
+
+    def depends(self, slot, dep_types=DEPEND_TYPES):
+        adjacency = self.adjacency[slot]
+        if adjacency is None:
+            manifest = self.packages[slot].manifest
+            adjacency = self.adjacency[slot] = dict(
+                (t, array("i", [self.node(name) for name in get_depend_names(manifest, t)])) for t in ADJACENCY_TYPES
+            )
+        result = []
+        for t in dep_types:
+            result.extend(adjacency[t])
+        return result
+
+    def get_workspace_clash(self, project):
+        # Returns the first package of the project which is in the workspace already
+        key = id(project)
+        if key not in self.clashes:
+            self.clashes[key] = next((other.manifest.name for other in project.packages if other.manifest.name in self.ws_packages), None)
+        return self.clashes[key]
+
+    def get_dependers(self, node, dep_types=DEPEND_TYPES):
+        # Returns the slots which depend on the node
+        if self.reverse is None:
+            for slot in range(len(self.packages)):
+                self.depends(slot)
+            reverse = dict((t, [[] for _ in self.names]) for t in DEPEND_TYPES)
+            for slot, adjacency in enumerate(self.adjacency):
+                for t in DEPEND_TYPES:
+                    for n in adjacency[t]:
+                        reverse[t][n].append(slot)
+            self.reverse = dict((t, [array("i", slots) for slots in reverse[t]]) for t in DEPEND_TYPES)
+        result = []
+        for t in dep_types:
+            if node < len(self.reverse[t]):
+                result.extend(self.reverse[t][node])
+        return result
+
+
+def get_dependency_graph(ws_state):
+    if ws_state.dependency_graph is None:
+        ws_state.dependency_graph = DependencyGraph(ws_state)
+    return ws_state.dependency_graph
+
+
+def find_components(edges):
+    # Returns the strongly connected components of the graph given as
+    # adjacency lists, using an iterative version of Tarjan's algorithm.
+    # Components are completed in reverse topological order, so every
+    # component comes after all components it depends on.
+    count = len(edges)
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = bytearray(count)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(count):
+        if index[root] >= 0:
+            continue
+        work = [(root, 0)]
+        while work:
+            v, i = work.pop()
+            if i == 0:
+                index[v] = lowlink[v] = counter
+                counter += 1
+                stack.append(v)
+                on_stack[v] = 1
+            else:
+                w = edges[v][i - 1]
+                lowlink[v] = min(lowlink[v], lowlink[w])
+            while i < len(edges[v]):
+                w = edges[v][i]
+                i += 1
+                if index[w] < 0:
+                    work.append((v, i))
+                    work.append((w, 0))
+                    break
+                if on_stack[w]:
+                    lowlink[v] = min(lowlink[v], index[w])
+            else:
+                if lowlink[v] == index[v]:
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        members.append(w)
+                        if w == v:
+                            break
+                    components.append(sorted(members))
+    return components
+
+
+class ClosureEngine(object):
+    # Transitive closures over a resolved part of the dependency graph as
+    # integer bitsets. Every resolved package gets one bit, the strongly
+    # connected components are collapsed with Tarjan's algorithm, and the
+    # reachability set of each component is computed once. Closures of
+    # arbitrary seed sets, their unions and intersections are then plain
+    # bitwise operations.
+
+    def __init__(self, graph, depends, dep_types=DEPEND_TYPES):
+        self.graph = graph
+        self.depends = depends
+        self.names = sorted(depends)
+        self.bits = dict((name, i) for i, name in enumerate(self.names))
+        edges = []
+        for name in self.names:
+            candidates = graph.get_candidates(graph.ids[name])
+            slot = next((s for s in candidates if graph.packages[s] is depends[name]), candidates[0])
+            edges.append(sorted(set(
+                self.bits[graph.names[n]] for n in graph.depends(slot, dep_types) if graph.names[n] in self.bits
+            )))
+        self.reach = self._compute_reachability(edges)
+
+    @staticmethod
+    def _compute_reachability(edges):
+        reach = [0] * len(edges)
+        for members in find_components(edges):
+            mask = 0
+            for w in members:
+                mask |= 1 << w
+            for w in members:
+                for x in edges[w]:
+                    mask |= reach[x]
+            for w in members:
+                reach[w] = mask
+        return reach
+
+    def mask(self, names):
+        # Returns the bitset of the given package names
+        result = 0
+        for name in names:
+            if name in self.bits:
+                result |= 1 << self.bits[name]
+        return result
+
+    def closure(self, names):
+        # Returns the bitset of the given packages and all their dependees
+        result = 0
+        for name in names:
+            if name in self.bits:
+                result |= self.reach[self.bits[name]]
+        return result
+
+    def get_names(self, mask):
+        return set(self.names[i] for i, bit in enumerate(reversed(bin(mask)[2:])) if bit == "1")
+
+    def get_packages(self, mask):
+        return dict((name, self.depends[name]) for name in self.get_names(mask))
+
+
+class BuildSchedule(NamedTuple):
+    __slots__ = ("order", "levels", "critical_path", "durations", "total_time", "critical_time")
+
+
+def get_build_schedule(packages, durations=None, dep_types=DEPEND_TYPES):
+    """Compute build order, dependency levels and critical path of packages
+
+    The packages can be built in the returned order, and every package in
+    a level only depends on packages in lower levels. Packages are
+    weighted with their build durations; packages without a known
+    duration get the median of the known ones. Dependency cycles are
+    treated as one unit which is built in one go.
+    """
+    names = sorted(packages)
+    index = dict((name, i) for i, name in enumerate(names))
+    edges = []
+    for name in names:
+        manifest = packages[name].manifest
+        edges.append(sorted(set(
+            index[d] for t in dep_types for d in get_depend_names(manifest, t) if d in index and d != name
+        )))
+    known = sorted(durations[name] for name in names if durations and name in durations)
+    default = known[len(known) // 2] if known else 1.0
+    weight = [durations.get(name, default) if durations else default for name in names]
+    components = find_components(edges)
+    component_of = [0] * len(names)
+    for c, members in enumerate(components):
+        for w in members:
+            component_of[w] = c
+    level = [0] * len(components)
+    finish = [0.0] * len(components)
+    previous = [None] * len(components)
+    for c, members in enumerate(components):
+        for s in set(component_of[x] for w in members for x in edges[w]):
+            if s == c:
+                continue
+            level[c] = max(level[c], level[s] + 1)
+            if previous[c] is None or finish[s] > finish[previous[c]]:
+                previous[c] = s
+        finish[c] = sum(weight[w] for w in members) + (finish[previous[c]] if previous[c] is not None else 0.0)
+    levels = [[] for _ in range(max(level) + 1 if components else 0)]
+    for c, members in enumerate(components):
+        levels[level[c]] += [names[w] for w in members]
+    critical_path = []
+    c = max(range(len(components)), key=lambda c: finish[c]) if components else None
+    while c is not None:
+        critical_path = [names[w] for w in components[c]] + critical_path
+        c = previous[c]
+    return BuildSchedule(
+        order=[names[w] for members in components for w in members],
+        levels=[sorted(names_in_level) for names_in_level in levels],
+        critical_path=critical_path,
+        durations=dict(zip(names, weight)),
+        total_time=sum(weight),
+        critical_time=max(finish) if components else 0.0,
+    )
@@ -23,7 +23,15 @@
 import requests
 import sys
 import os
+import json
+import base64
+import binascii
+import struct
+import time
+import zlib
+import threading
 import concurrent.futures
+from collections import deque
 from pygit2 import Repository
 
 try:
@@ -44,21 +52,34 @@ except ImportError:
     from urllib.parse import urljoin, urlsplit
 
 from .ui import ask_personal_access_token, ask_username_and_password, msg, warning, error, fatal
-from .util import iteritems, NamedTuple, yaml_dump
+from .util import iteritems, NamedTuple, yaml_dump, makedirs, write_atomic
 
 
-GITLAB_PACKAGE_CACHE_VERSION = 4
+GITLAB_PACKAGE_CACHE_VERSION = 11
+GITLAB_MAX_RETRIES = 3
+GITLAB_RETRY_BACKOFF = 3600
+GITLAB_CHECKPOINT_INTERVAL = 30
+GITLAB_PAGE_SIZE = 100
+GITLAB_CONNECTION_LIMIT = 10
+GITLAB_ASYNC_LIMIT = 100
+GITLAB_BUDGET_POLL = 0.01
+GITLAB_TREE_WORKERS = 16
+GITLAB_TREE_CONCURRENCY = 4
+GITLAB_INDEX_MAGIC = b"RRGI"
+GITLAB_INDEX_VERSION = 2
+# The only fields of a project listing that new_gitlab_project() needs
+GITLAB_PROJECT_FIELDS = ("id", "name_with_namespace", "path_with_namespace", "web_url", "ssh_url_to_repo", "http_url_to_repo", "default_branch", "last_activity_at")
 
 
 class GitlabServer(NamedTuple):
-    __slots__ = ("projects", "last_modified")
+    __slots__ = ("projects", "last_modified", "failures")
 
 
 class GitlabProject(NamedTuple):
     __slots__ = (
         "server", "name", "id", "website", "url", "packages",
         "last_modified", "workspace_path", "master_branch",
-        "server_path"
+        "server_path", "crawl_tree", "crawl_commit"
     )
 
     def __cmp__(self, other):
@@ -72,9 +93,333 @@ class GitlabProject(NamedTuple):
 
 class GitlabPackage(NamedTuple):
     __slots__ = (
-        "manifest", "project", "project_path", "manifest_blob", "manifest_xml"
+        "manifest", "project", "project_path", "manifest_blob"
     )
 
+    @property
+    def manifest_xml(self):
+        return self.manifest.xml_data
+
+
+class GitlabProjectFailure(NamedTuple):
+    __slots__ = ("count", "last_attempt", "last_modified", "reason")
+
+
+def is_gitlab_project_blocked(failure, last_modified=None, now=None):
+    # Projects which keep failing are not retried on every refresh, but only
+    # after a backoff period, or as soon as somebody pushes to them
+    if failure is None or failure.count < GITLAB_MAX_RETRIES:
+        return False
+    if last_modified is not None and failure.last_modified is not None and last_modified != failure.last_modified:
+        return False
+    if now is None:
+        now = time.time()
+    return now - failure.last_attempt < GITLAB_RETRY_BACKOFF
+
+
+def needs_gitlab_retry(server_cache, now=None):
+    if not server_cache.failures:
+        return False
+    for failure in server_cache.failures.values():
+        if not is_gitlab_project_blocked(failure, now=now):
+            return True
+    return False
+
+
+class DeadlineExceeded(IOError):
+    pass
+
+
+class Deadline(object):
+    # A single network budget shared by all Gitlab servers. Every request
+    # gets at most the remaining time as timeout, so a slow server cannot
+    # stall a command beyond the budget, no matter how many requests it takes.
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.expires = time.time() + budget if budget is not None else None
+        self.lock = threading.Lock()
+        self.skipped = []
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def timeout(self, timeout=None):
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("network budget of %gs exhausted" % self.budget)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def wait_timeout(self, timeout=None):
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def skip(self, name):
+        with self.lock:
+            if name not in self.skipped:
+                self.skipped.append(name)
+
+
+class ConnectionBudget(object):
+    # A single connection limit shared by all Gitlab servers. Threads block
+    # until a connection becomes available; an event loop must not block,
+    # so the asyncio engine polls with try_acquire() instead.
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.semaphore.release()
+
+    def try_acquire(self):
+        return self.semaphore.acquire(False)
+
+    def release(self):
+        self.semaphore.release()
+
+
+class GitlabSession(requests.Session):
+
+    def __init__(self, connection_budget=None, deadline=None):
+        super(GitlabSession, self).__init__()
+        self.connection_budget = connection_budget
+        self.deadline = deadline
+
+    def _request(self, *args, **kwargs):
+        if self.deadline is not None:
+            kwargs["timeout"] = self.deadline.timeout(kwargs.get("timeout", None))
+        return super(GitlabSession, self).request(*args, **kwargs)
+
+    def request(self, *args, **kwargs):
+        if self.connection_budget is None:
+            return self._request(*args, **kwargs)
+        with self.connection_budget:
+            return self._request(*args, **kwargs)
+
+
+class GitlabTree(NamedTuple):
+    __slots__ = ("id", "depth", "packages", "subtrees")
+
+
+class GitlabDependency(NamedTuple):
+    __slots__ = ("name",)
+
+
+def _unique(names):
+    seen = set()
+    return tuple(n for n in names if not (n in seen or seen.add(n)))
+
+
+class LazyManifest(object):
+    # Remote packages are only ever resolved by name and dependency names,
+    # so that is all we pickle; everything else is delegated to a catkin_pkg
+    # Package. The Package from validating a new manifest is kept until the
+    # process exits; after unpickling, it is parsed from the (compressed)
+    # XML on first access
+    __slots__ = ("name", "version", "depends", "metapackage", "filename", "compressed_xml", "_package")
+
+    DEPEND_TYPES = ("buildtool_depends", "build_depends", "run_depends", "test_depends")
+
+    def __init__(self, name, version, depends, metapackage, filename, compressed_xml, package=None):
+        self.name = name
+        self.version = version
+        self.depends = depends
+        self.metapackage = metapackage
+        self.filename = filename
+        self.compressed_xml = compressed_xml
+        self._package = package
+
+    @staticmethod
+    def from_xml(xml_data, filename):
+        # The manifest is fully validated once when it is stored, so an
+        # invalid package cannot fail later on attribute access
+        if isinstance(xml_data, bytes):
+            xml_data = xml_data.decode("UTF-8")
+        package = parse_package_string(xml_data, filename)
+
+        def names(deps):
+            return _unique([d.name for d in deps])
+        depends = {
+            "buildtool_depends": names(package.buildtool_depends),
+            "build_depends": names(package.build_depends),
+            "run_depends": names(package.build_export_depends + package.exec_depends),
+            "test_depends": names(package.test_depends),
+            "build_export_depends": names(package.build_export_depends),
+            "buildtool_export_depends": names(package.buildtool_export_depends),
+        }
+        return LazyManifest(package.name, package.version, depends, package.is_metapackage(), filename, zlib.compress(xml_data.encode("UTF-8")), package=package)
+
+    @property
+    def xml_data(self):
+        return zlib.decompress(self.compressed_xml).decode("UTF-8")
+
+    @property
+    def package(self):
+        if self._package is None:
+            self._package = parse_package_string(self.xml_data, self.filename)
+        return self._package
+
+    @property
+    def buildtool_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["buildtool_depends"]]
+
+    @property
+    def build_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["build_depends"]]
+
+    @property
+    def run_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["run_depends"]]
+
+    @property
+    def test_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["test_depends"]]
+
+    @property
+    def build_export_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["build_export_depends"]]
+
+    @property
+    def buildtool_export_depends(self):
+        return [GitlabDependency(name=n) for n in self.depends["buildtool_export_depends"]]
+
+    def is_metapackage(self):
+        return self.metapackage
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") or attr in LazyManifest.__slots__:
+            raise AttributeError(attr)
+        return getattr(self.package, attr)
+
+    def __getstate__(self):
+        return (self.name, self.version, self.depends, self.metapackage, self.filename, self.compressed_xml)
+
+    def __setstate__(self, state):
+        self.name, self.version, self.depends, self.metapackage, self.filename, self.compressed_xml = state
+        self._package = None
+
+
+class ManifestBlobCache(object):
+    # Git blob ids are content hashes, so the same package.xml in a fork,
+    # a mirror or a project on another server has the same id everywhere
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.xml = {}
+        self.parsed = {}
+        self.downloaded = 0
+        self.reused = 0
+
+    def add_projects(self, projects):
+        with self.lock:
+            for prj in projects:
+                for pkg in prj.packages:
+                    if pkg.manifest_blob not in self.parsed:
+                        self.parsed[pkg.manifest_blob] = pkg.manifest
+
+    def lookup_xml(self, blob):
+        with self.lock:
+            if blob in self.xml:
+                self.reused += 1
+                return self.xml[blob]
+            if blob in self.parsed:
+                self.reused += 1
+                return self.parsed[blob].xml_data
+        return None
+
+    def store_xml(self, blob, xml_data):
+        with self.lock:
+            self.downloaded += 1
+            self.xml[blob] = xml_data
+
+    def get_xml(self, blob, download):
+        xml_data = self.lookup_xml(blob)
+        if xml_data is None:
+            xml_data = download()
+            self.store_xml(blob, xml_data)
+        return xml_data
+
+    def add(self, blob, manifest):
+        with self.lock:
+            return self.parsed.setdefault(blob, manifest)
+
+    def parse(self, blob, xml_data, filename):
+        with self.lock:
+            if blob in self.parsed:
+                return self.parsed[blob]
+        manifest = LazyManifest.from_xml(xml_data, filename)
+        with self.lock:
+            manifest = self.parsed.setdefault(blob, manifest)
+            self.xml.pop(blob, None)
+        return manifest
+
+
+GITLAB_FILTER_KEYS = ("groups", "exclude_groups", "topics", "membership", "exclude_archived")
+
+
+def get_gitlab_project_filter(gitlab_cfg):
+    project_filter = dict((k, gitlab_cfg[k]) for k in GITLAB_FILTER_KEYS if gitlab_cfg.get(k))
+    return project_filter or None
+
+
+def get_gitlab_project_queries(project_filter):
+    # Let the server do as much of the filtering as possible, so unwanted
+    # projects are not even listed. Group exclusion has no API equivalent
+    # and is handled by is_gitlab_project_wanted() before crawling.
+    if not project_filter:
+        return [("api/v4/projects/", {"pagination": "keyset", "order_by": "id", "sort": "desc"})]
+    params = {}
+    if project_filter.get("membership"):
+        params["membership"] = "true"
+    if project_filter.get("exclude_archived"):
+        params["archived"] = "false"
+    if project_filter.get("topics"):
+        params["topic"] = ",".join(project_filter["topics"])
+    if project_filter.get("groups"):
+        params["include_subgroups"] = "true"
+        return [("api/v4/groups/%s/projects" % urlquote(group.strip("/"), safe=""), params) for group in project_filter["groups"]]
+    params.update({"pagination": "keyset", "order_by": "id", "sort": "desc"})
+    return [("api/v4/projects/", params)]
+
+
+def is_gitlab_project_wanted(yaml_p, project_filter):
+    if not project_filter:
+        return True
+    path = yaml_p.get("path_with_namespace", "")
+
+    def in_group(group):
+        return path.startswith(group.strip("/") + "/")
+
+    if project_filter.get("groups") and not any(in_group(g) for g in project_filter["groups"]):
+        return False
+    if any(in_group(g) for g in project_filter.get("exclude_groups", [])):
+        return False
+    if project_filter.get("exclude_archived") and yaml_p.get("archived", False):
+        return False
+    if project_filter.get("topics"):
+        topics = yaml_p.get("topics", yaml_p.get("tag_list", None)) or []
+        if not all(t in topics for t in project_filter["topics"]):
+            return False
+    if project_filter.get("membership"):
+        permissions = yaml_p.get("permissions", None)
+        if permissions is not None and permissions.get("project_access", None) is None and permissions.get("group_access", None) is None:
+            return False
+    return True
+
 
 def url_to_cache_name(label, url):
     tmp = ["gitlab_projects"]
@@ -86,31 +431,247 @@ def url_to_cache_name(label, url):
     return "_".join(tmp)
 
 
-def crawl_project_for_packages(session, url, project_id, path, depth, timeout):
-    page_count = 1
-    page_no = 1
-    entries = []
-    while page_no <= page_count:
-        r = session.get(urljoin(url, "api/v4/projects/%s/repository/tree" % project_id), params={"path": path, "per_page": 100, "page": page_no})
-        if r.status_code == 200:
-            entries += r.json()
-            page_count = int(r.headers.get("X-Total-Pages", 0))
+class _CacheLock(object):
+
+    def __init__(self, cache, name, blocking=True):
+        self.path = os.path.join(cache.cache_dir, name)
+        self.blocking = blocking
+        self.f = None
+
+    def __enter__(self):
+        import fcntl
+        makedirs(os.path.dirname(self.path))
+        self.f = open(self.path, "a")
+        try:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+        except IOError:
+            self.f.close()
+            self.f = None
+        return self.f is not None
+
+    def __exit__(self, *args):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class _GitlabHookLock(_CacheLock):
+
+    def __enter__(self):
+        acquired = _CacheLock.__enter__(self)
+        if acquired:
+            # The start time tells the crawler which pushes the listener
+            # may have missed
+            self.f.truncate(0)
+            self.f.write("%f\n" % time.time())
+            self.f.flush()
+        return acquired
+
+
+def gitlab_hook_lock(cache):
+    return _GitlabHookLock(cache, "gitlab_hook.lock", blocking=False)
+
+
+def get_gitlab_hook_start_time(cache):
+    path = os.path.join(cache.cache_dir, "gitlab_hook.lock")
+    if not os.path.isfile(path):
+        return None
+    with _CacheLock(cache, "gitlab_hook.lock", blocking=False) as acquired:
+        if acquired:
+            return None
+    try:
+        with open(path, "r") as f:
+            return float(f.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def get_dirty_gitlab_projects(cache, label, url):
+    with _CacheLock(cache, "gitlab_dirty.lock"):
+        return cache.get_object(url_to_cache_name(label, url) + "_dirty", GITLAB_PACKAGE_CACHE_VERSION, set(), reload=True)
+
+
+def mark_gitlab_projects_dirty(cache, label, url, project_ids):
+    name = url_to_cache_name(label, url) + "_dirty"
+    with _CacheLock(cache, "gitlab_dirty.lock"):
+        dirty = cache.get_object(name, GITLAB_PACKAGE_CACHE_VERSION, set(), reload=True)
+        cache.set_object(name, GITLAB_PACKAGE_CACHE_VERSION, dirty | set(project_ids))
+
+
+def clear_dirty_gitlab_projects(cache, label, url, project_ids):
+    name = url_to_cache_name(label, url) + "_dirty"
+    with _CacheLock(cache, "gitlab_dirty.lock"):
+        dirty = cache.get_object(name, GITLAB_PACKAGE_CACHE_VERSION, set(), reload=True)
+        cache.set_object(name, GITLAB_PACKAGE_CACHE_VERSION, dirty - set(project_ids))
+
+
+def iter_gitlab_pages(session, url, params, timeout):
+    # Follow the Link header instead of computing page numbers: Gitlab omits
+    # X-Total-Pages for more than 10,000 results, and keyset pagination has
+    # no page numbers at all. Pages are handed on as they arrive.
+    base_params = dict(params, per_page=GITLAB_PAGE_SIZE)
+    next_url, next_params = url, base_params
+    while next_url is not None:
+        r = session.get(next_url, params=next_params, timeout=timeout)
+        r.raise_for_status()
+        yield r.json()
+        if "next" in r.links:
+            next_url, next_params = r.links["next"]["url"], None
+        elif r.headers.get("X-Next-Page", None):
+            next_url, next_params = url, dict(base_params, page=r.headers["X-Next-Page"])
         else:
-            return []
-        page_no += 1
+            next_url = None
+
+
+def scan_tree_entries(tree, path, entries, depth):
+    # Record the package in a listed directory, or return the
+    # subdirectories which still need to be crawled
     files = [e["name"] for e in entries if e["type"] == "blob"]
-    dirs = [e["name"] for e in entries if e["type"] == "tree" and not e["name"].startswith(".")]
     if "CATKIN_IGNORE" in files:
         return []
     for e in entries:
         if e["type"] == "blob" and e["name"] == PACKAGE_MANIFEST_FILENAME:
-            return [(path, e["id"])]
+            tree.packages = [(path, e["id"])]
+            return []
     if depth == 0:
         return []
-    result = []
-    for d in dirs:
-        result += crawl_project_for_packages(session, url, project_id, os.path.join(path, d), depth - 1, timeout)
-    return result
+    return [(e["name"], e["id"]) for e in entries if e["type"] == "tree" and not e["name"].startswith(".")]
+
+
+def list_project_tree(session, url, project_id, path, timeout):
+    entries = []
+    try:
+        for page in iter_gitlab_pages(session, urljoin(url, "api/v4/projects/%s/repository/tree" % project_id), {"path": path, "pagination": "keyset"}, timeout):
+            entries += page
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        return []  # Empty repository
+    return entries
+
+
+def crawl_project_tree(session, url, project_id, path, depth, timeout, tree_id=None, cached_tree=None, executor=None, max_parallel=GITLAB_TREE_CONCURRENCY):
+    # Git trees are content-addressed: if the object id of a directory has
+    # not changed, neither has anything below it, and we can reuse the
+    # crawl results from last time without asking the server again.
+    # The root tree id is not known in advance, so the root is always listed.
+    if tree_id is not None and cached_tree is not None and cached_tree.id == tree_id and cached_tree.depth == depth:
+        return cached_tree
+    root = GitlabTree(id=tree_id, depth=depth, packages=[], subtrees={})
+    # Directories are listed from a work queue, up to max_parallel at a time
+    # on the shared executor, so wide projects finish in time proportional
+    # to their depth. Only this thread waits, the workers never block on
+    # each other.
+    queue = deque([(root, path, depth, cached_tree)])
+    children = {}
+    in_flight = {}
+
+    def expand(item, entries):
+        tree, path, depth, cached_tree = item
+        children[id(tree)] = []
+        for d, d_id in scan_tree_entries(tree, path, entries, depth):
+            children[id(tree)].append(d)
+            cached_subtree = cached_tree.subtrees.get(d) if cached_tree is not None else None
+            if d_id is not None and cached_subtree is not None and cached_subtree.id == d_id and cached_subtree.depth == depth - 1:
+                tree.subtrees[d] = cached_subtree
+            else:
+                tree.subtrees[d] = GitlabTree(id=d_id, depth=depth - 1, packages=[], subtrees={})
+                queue.append((tree.subtrees[d], os.path.join(path, d), depth - 1, cached_subtree))
+
+    def collect(tree):
+        for d in children.get(id(tree), []):
+            subtree = tree.subtrees[d]
+            collect(subtree)
+            tree.packages += subtree.packages
+
+    try:
+        while queue or in_flight:
+            while queue and (executor is None or len(in_flight) < max_parallel):
+                item = queue.popleft()
+                if executor is None:
+                    expand(item, list_project_tree(session, url, project_id, item[1], timeout))
+                else:
+                    in_flight[executor.submit(list_project_tree, session, url, project_id, item[1], timeout)] = item
+            if in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    expand(in_flight.pop(future), future.result())
+    finally:
+        for future in in_flight:
+            future.cancel()
+    collect(root)
+    return root
+
+
+def probe_project_commit(session, url, project_id, ref, path, timeout):
+    # The metadata of a single file includes the commit id of the branch,
+    # which tells us if the last crawl is still accurate at the cost of one
+    # HEAD request. Last activity changes for many other reasons, such as
+    # issues, merge requests, or pushes to other branches.
+    filename = os.path.join(path, PACKAGE_MANIFEST_FILENAME)
+    r = session.head(urljoin(url, "api/v4/projects/%s/repository/files/%s" % (project_id, urlquote(filename, safe=""))), params={"ref": ref}, timeout=timeout)
+    if r.status_code != 200:
+        return None
+    return r.headers.get("X-Gitlab-Commit-Id", None)
+
+
+def is_gitlab_project_unchanged(p, cached_p, force_update=False, changed=False, probed=False):
+    """Tell if the last crawl of cached_p is still accurate for project p
+
+    Returns None if that depends on the current commit of the default branch,
+    which must then be probed at the first cached package and stored in
+    p.crawl_commit before asking again with probed=True.
+    """
+    if force_update or cached_p is None:
+        return False
+    if probed:
+        return p.crawl_commit is not None and p.crawl_commit == cached_p.crawl_commit
+    if not changed and cached_p.last_modified == p.last_modified:
+        return True
+    return None if cached_p.packages else False
+
+
+def new_gitlab_project(server_name, yaml_p):
+    return GitlabProject(
+        server=server_name,
+        name=yaml_p["name_with_namespace"],
+        id=yaml_p["id"],
+        website=yaml_p["web_url"],
+        url={"ssh": yaml_p["ssh_url_to_repo"], "http": yaml_p["http_url_to_repo"]},
+        master_branch=yaml_p.get("default_branch", "master"),
+        packages=None,
+        last_modified=date_parse(yaml_p["last_activity_at"]),
+        workspace_path=None,
+        server_path=yaml_p["path_with_namespace"],
+        crawl_tree=None,
+        crawl_commit=None
+    )
+
+
+def reuse_gitlab_project(p, cached_p):
+    p.packages = cached_p.packages
+    p.crawl_tree = cached_p.crawl_tree
+    p.crawl_commit = cached_p.crawl_commit
+    for prj in p.packages:
+        prj.project = p
+
+
+def load_gitlab_packages(p, get_xml, manifest_cache, verbose=True):
+    p.packages = []
+    for path, blob in p.crawl_tree.packages:
+        xml_data = get_xml(blob)
+        filename = os.path.join(path, PACKAGE_MANIFEST_FILENAME)
+        try:
+            manifest = manifest_cache.parse(blob, xml_data, filename)
+            if verbose:
+                msg("@{cf}Updated@|:  @{yf}%s@| [%s]\n" % (manifest.name, p.name))
+            p.packages.append(GitlabPackage(manifest=manifest, project=p, project_path=path, manifest_blob=blob))
+        except InvalidPackage as e:
+            warning("invalid package manifest '%s': %s\n" % (filename, str(e)))
+
+
+def crawl_project_for_packages(session, url, project_id, path, depth, timeout, cached_tree=None):
+    return crawl_project_tree(session, url, project_id, path, depth, timeout, cached_tree=cached_tree).packages
 
 
 _cached_tokens = {}
@@ -141,106 +702,291 @@ def acquire_gitlab_private_token(label, url, credentials_callback=ask_username_a
 
 
 _updated_urls = set()
+_network_budget = None
 
 
-def find_available_gitlab_projects(label, url, private_token=None, cache=None, timeout=None, crawl_depth=-1, cache_only=False, force_update=False, verbose=True):
+def set_network_budget(budget):
+    global _network_budget
+    _network_budget = budget
 
-    def update_project_list(page_no, s):
-        r = s.get(urljoin(url, "api/v4/projects/?per_page=100&page=%d" % page_no), timeout=timeout)
-        r.raise_for_status()
-        return r.json()
-
-    def update_single_project(yaml_p, s, server_cache):
-        cached_p = next((q for q in server_cache.projects if q.id == yaml_p["id"]), None)
-        p = GitlabProject(
-            server=server_name,
-            name=yaml_p["name_with_namespace"],
-            id=yaml_p["id"],
-            website=yaml_p["web_url"],
-            url={"ssh": yaml_p["ssh_url_to_repo"], "http": yaml_p["http_url_to_repo"]},
-            master_branch=yaml_p.get("default_branch", "master"),
-            packages=None,
-            last_modified=date_parse(yaml_p["last_activity_at"]),
-            workspace_path=None,
-            server_path=yaml_p["path_with_namespace"]
-        )
-        if not force_update and cached_p is not None and cached_p.last_modified == p.last_modified:
-            p.packages = cached_p.packages
-            for prj in p.packages:
-                prj.project = p
+
+def find_available_gitlab_projects(label, url, private_token=None, cache=None, timeout=None, crawl_depth=-1, cache_only=False, force_update=False, verbose=True, connection_budget=None, manifest_cache=None, use_webhooks=False, project_filter=None, seed_index=None, deadline=None, engine="threads"):
+
+    def update_single_project(yaml_p, s, cached_p, changed=False):
+        p = new_gitlab_project(server_name, yaml_p)
+        reuse = is_gitlab_project_unchanged(p, cached_p, force_update, changed)
+        if reuse is None:
+            p.crawl_commit = probe_project_commit(s, url, p.id, p.master_branch, cached_p.packages[0].project_path, timeout)
+            reuse = is_gitlab_project_unchanged(p, cached_p, force_update, changed, probed=True)
+        if reuse:
+            reuse_gitlab_project(p, cached_p)
         else:
             if verbose:
                 msg("@{cf}Updating@|: %s\n" % p.website)
-            manifests = crawl_project_for_packages(s, url, p.id, "", depth=crawl_depth, timeout=timeout)
-            old_manifests = {}
-            if cached_p is not None:
-                for old_p in cached_p.packages:
-                    old_manifests[old_p.manifest_blob] = old_p.manifest_xml
-            p.packages = []
-            for path, blob in manifests:
-                if blob not in old_manifests:
-                    r = s.get(urljoin(url, "api/v4/projects/%s/repository/blobs/%s/raw" % (p.id, blob)), timeout=timeout)
-                    r.raise_for_status()
-                    xml_data = r.content
-                else:
-                    xml_data = old_manifests[blob]
-                filename = os.path.join(path, PACKAGE_MANIFEST_FILENAME)
-                try:
-                    manifest = parse_package_string(xml_data, filename)
-                    if verbose:
-                        msg("@{cf}Updated@|:  @{yf}%s@| [%s]\n" % (manifest.name, p.name))
-                    p.packages.append(GitlabPackage(manifest=manifest, project=p, project_path=path, manifest_blob=blob, manifest_xml=xml_data))
-                except InvalidPackage as e:
-                    warning("invalid package manifest '%s': %s\n" % (filename, str(e)))
+            cached_tree = cached_p.crawl_tree if cached_p is not None and not force_update else None
+            p.crawl_tree = crawl_project_tree(s, url, p.id, "", depth=crawl_depth, timeout=timeout, cached_tree=cached_tree, executor=tree_executor)
+
+            def download_blob(blob):
+                r = s.get(urljoin(url, "api/v4/projects/%s/repository/blobs/%s/raw" % (p.id, blob)), timeout=timeout)
+                r.raise_for_status()
+                return r.content
+
+            blobs = sorted(set(blob for _, blob in p.crawl_tree.packages))
+            xml = dict(zip(blobs, tree_executor.map(lambda blob: manifest_cache.get_xml(blob, lambda: download_blob(blob)), blobs)))
+            load_gitlab_packages(p, xml.get, manifest_cache, verbose)
         return p
 
+    def update_dirty_project(project_id, s, server_cache):
+        r = s.get(urljoin(url, "api/v4/projects/%s" % project_id), timeout=timeout)
+        if r.status_code == 404:
+            return None  # Project has been deleted or is no longer visible
+        r.raise_for_status()
+        yaml_p = r.json()
+        if not is_gitlab_project_wanted(yaml_p, project_filter):
+            return None  # Project no longer matches the filter
+        cached_p = next((q for q in server_cache.projects if q.id == project_id), None)
+        return update_single_project(yaml_p, s, cached_p, changed=True)
+
+    def out_of_budget():
+        return deadline is not None and deadline.expired()
+
+    def record_failure(failures, project_id, last_modified, e):
+        failure = failures.get(project_id)
+        count = failure.count + 1 if failure is not None else 1
+        failures[project_id] = GitlabProjectFailure(count=count, last_attempt=time.time(), last_modified=last_modified, reason=str(e))
+        if count >= GITLAB_MAX_RETRIES:
+            warning("cannot update project #%s from '%s' (giving up for now): %s\n" % (project_id, url, e))
+        else:
+            warning("cannot update project #%s from '%s': %s\n" % (project_id, url, e))
+
+    def merge_projects(project_ids, results, cached_projects, listing_complete):
+        # Successfully crawled projects replace their cached counterpart;
+        # failed or pending projects keep their old state, so they differ
+        # from the server and will be crawled again next time
+        projects = []
+        seen = set()
+        for project_id in project_ids:
+            seen.add(project_id)
+            p = results.get(project_id, cached_projects.get(project_id))
+            if p is not None:
+                projects.append(p)
+        if not listing_complete:
+            projects += [q for q in server_cache.projects if q.id not in seen]
+        return projects
+
+    def handle_result(yaml_p, p, e, results, fresh, failures, cached_projects, project_ids):
+        # Returns True if the project remains pending for the next refresh
+        if e is not None:
+            if out_of_budget():
+                # Not the project's fault, so no retry is used up
+                return True
+            record_failure(failures, yaml_p["id"], date_parse(yaml_p["last_activity_at"]), e)
+            return failures[yaml_p["id"]].count < GITLAB_MAX_RETRIES
+        failures.pop(p.id, None)
+        results[p.id] = p
+        cached_p = cached_projects.get(p.id)
+        if force_update or cached_p is None or cached_p.last_modified != p.last_modified:
+            fresh.add(p.id)
+            # Every checkpoint writes the whole server cache, so they are
+            # spaced in time rather than by project count
+            if time.time() - last_checkpoint[0] >= GITLAB_CHECKPOINT_INTERVAL:
+                save_checkpoint(merge_projects(project_ids, results, cached_projects, False), failures)
+        return False
+
+    def save_checkpoint(projects, failures):
+        last_checkpoint[0] = time.time()
+        if cache is not None:
+            partial = GitlabServer(projects=projects, last_modified=server_cache.last_modified, failures=dict(failures))
+            cache.set_object(url_to_cache_name(label, url), GITLAB_PACKAGE_CACHE_VERSION, partial)
+
     global _updated_urls
     server_name = urlsplit(url)[1]
+    last_checkpoint = [time.time()]
     cache_update = False
     if cache is not None:
         server_cache = cache.get_object(url_to_cache_name(label, url), GITLAB_PACKAGE_CACHE_VERSION, GitlabServer())
     else:
         server_cache = GitlabServer()
+    if not server_cache.projects and seed_index is not None and url is not None:
+        seed = get_gitlab_index_seed(seed_index, url, manifest_cache)
+        if seed is not None:
+            server_cache = seed
+            if cache is not None:
+                cache.set_object(url_to_cache_name(label, url), GITLAB_PACKAGE_CACHE_VERSION, server_cache)
     if server_cache.projects is None:
         server_cache.projects = []
     if server_cache.last_modified is None:
         server_cache.last_modified = 0
+    if server_cache.failures is None:
+        server_cache.failures = {}
+    if manifest_cache is None:
+        manifest_cache = ManifestBlobCache()
+    manifest_cache.add_projects(server_cache.projects)
     if not cache_only and url is not None and private_token is not None and url not in _updated_urls:
         projects = []
         try:
-            with requests.Session() as s:
+            with GitlabSession(connection_budget, deadline) as s, concurrent.futures.ThreadPoolExecutor(max_workers=GITLAB_TREE_WORKERS) as tree_executor:
                 s.headers.update({"PRIVATE-TOKEN": private_token})
-                r = s.get(urljoin(url, "api/v4/projects/?per_page=1&page=1&order_by=last_activity_at&sort=desc"), timeout=timeout)
-                r.raise_for_status()
-                try:
-                    total_packages = int(r.headers.get("X-Total-Pages", 0))
-                    global_last_modified = r.json()[0]["last_activity_at"]
-                except (KeyError, IndexError):
-                    global_last_modified = 0
-                except Exception:
-                    raise IOError("unexpected reply from server: %s" % r.content)
-                if force_update or global_last_modified != server_cache.last_modified:
+                poll_start = time.time()
+                hook_started = get_gitlab_hook_start_time(cache) if use_webhooks and not force_update and cache is not None and server_cache.projects else None
+                last_polled = cache.get_object(url_to_cache_name(label, url) + "_polled", GITLAB_PACKAGE_CACHE_VERSION) if hook_started is not None else None
+                if hook_started is not None and last_polled is not None and last_polled >= hook_started:
+                    # The webhook listener tells us which projects have changed,
+                    # so neither the global probe nor the project list are needed.
+                    # Pushes from before the listener started are only covered
+                    # once a regular poll has run since then.
+                    dirty = get_dirty_gitlab_projects(cache, label, url)
+                    dirty = set(project_id for project_id in dirty if not is_gitlab_project_blocked(server_cache.failures.get(project_id)))
+                    projects = list(server_cache.projects)
+                    if dirty:
+                        msg("@{cf}Updating@|: %s\n" % url)
+                        cache_update = True
+                        failures = dict(server_cache.failures)
+                        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                            fs = [(project_id, executor.submit(update_dirty_project, project_id, s, server_cache)) for project_id in sorted(dirty)]
+                            for project_id, future in fs:
+                                try:
+                                    p = future.result()
+                                except (IOError, ValueError) as e:
+                                    # Stays dirty and will be retried next time
+                                    if out_of_budget():
+                                        deadline.skip(label or url)
+                                    else:
+                                        record_failure(failures, project_id, None, e)
+                                    dirty.discard(project_id)
+                                    continue
+                                failures.pop(project_id, None)
+                                index = next((i for i, q in enumerate(projects) if q.id == project_id), None)
+                                if index is None:
+                                    if p is not None:
+                                        projects.append(p)
+                                elif p is None:
+                                    del projects[index]
+                                else:
+                                    projects[index] = p
+                        clear_dirty_gitlab_projects(cache, label, url, dirty)
+                        server_cache.failures = failures
+                    cache.set_object(url_to_cache_name(label, url) + "_checked", GITLAB_PACKAGE_CACHE_VERSION, time.time())
+                    if cache_update:
+                        server_cache.projects = projects
+                        cache.set_object(url_to_cache_name(label, url), GITLAB_PACKAGE_CACHE_VERSION, server_cache)
+                    _updated_urls.add(url)
+                    return projects
+                # The bookmark is the most recent activity of each query,
+                # together with the filter, so a changed filter is noticed
+                queries = get_gitlab_project_queries(project_filter)
+                global_last_modified = [sorted(iteritems(project_filter)) if project_filter else None]
+                for path, params in queries:
+                    params = dict((k, v) for k, v in iteritems(params) if k != "pagination")
+                    r = s.get(urljoin(url, path), params=dict(params, per_page=1, page=1, order_by="last_activity_at", sort="desc"), timeout=timeout)
+                    r.raise_for_status()
+                    try:
+                        global_last_modified.append(r.json()[0]["last_activity_at"])
+                    except (KeyError, IndexError):
+                        global_last_modified.append(0)
+                    except Exception:
+                        raise IOError("unexpected reply from server: %s" % r.content)
+                global_last_modified = repr(global_last_modified)
+                if force_update or global_last_modified != server_cache.last_modified or needs_gitlab_retry(server_cache):
                     msg("@{cf}Updating@|: %s\n" % url)
                     cache_update = True
-                    server_cache.last_modified = global_last_modified
-                    project_list = []
+                    cached_projects = dict((q.id, q) for q in server_cache.projects)
+                    failures = dict(server_cache.failures)
+                    project_ids = []
+                    listing_complete = True
+                    pending = False
+                    results = {}
+                    fresh = set()
+                    jobs = []
                     with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                        total_pages = int((total_packages + 99) / 100)
-                        fs = []
-                        for page_no in range(1, total_pages + 1):
-                            fs.append(executor.submit(update_project_list, page_no, s))
-                        for future in concurrent.futures.as_completed(fs, timeout=timeout):
-                            project_list += future.result()
-                        fs = []
-                        for yaml_p in project_list:
-                            fs.append(executor.submit(update_single_project, yaml_p, s, server_cache))
-                        for future in concurrent.futures.as_completed(fs, timeout=timeout):
-                            projects.append(future.result())
+                        # Projects are crawled while the next page of the
+                        # list is still being fetched
+                        fs = {}
+                        listed = set()
+                        now = time.time()
+                        for path, params in queries:
+                            try:
+                                for page in iter_gitlab_pages(s, urljoin(url, path), params, timeout):
+                                    for yaml_p in page:
+                                        # Subgroups may be listed by more than one query
+                                        if yaml_p["id"] in listed:
+                                            continue
+                                        listed.add(yaml_p["id"])
+                                        if not is_gitlab_project_wanted(yaml_p, project_filter):
+                                            continue
+                                        # Listings are large, and only a few fields are needed
+                                        # until the project has been crawled
+                                        yaml_p = dict((k, yaml_p[k]) for k in GITLAB_PROJECT_FIELDS if k in yaml_p)
+                                        project_ids.append(yaml_p["id"])
+                                        if is_gitlab_project_blocked(failures.get(yaml_p["id"]), date_parse(yaml_p["last_activity_at"]), now):
+                                            continue
+                                        if engine == "asyncio":
+                                            jobs.append((yaml_p, cached_projects.get(yaml_p["id"])))
+                                        else:
+                                            fs[executor.submit(update_single_project, yaml_p, s, cached_projects.get(yaml_p["id"]))] = yaml_p
+                            except (IOError, ValueError) as e:
+                                if not out_of_budget():
+                                    warning("cannot fetch project list %s from '%s': %s\n" % (path, url, e))
+                                listing_complete = False
+                        if not project_ids and not listing_complete:
+                            raise IOError("cannot fetch project list")
+                        try:
+                            if engine == "asyncio":
+                                from .gitlab_async import crawl_gitlab_projects
+
+                                def on_done(yaml_p, p, exc):
+                                    return handle_result(yaml_p, p, exc, results, fresh, failures, cached_projects, project_ids)
+
+                                pending = crawl_gitlab_projects(
+                                    url, private_token, server_name, jobs, on_done, crawl_depth=crawl_depth, timeout=timeout,
+                                    force_update=force_update, manifest_cache=manifest_cache, verbose=verbose, deadline=deadline,
+                                    connection_budget=connection_budget
+                                )
+                            for future in concurrent.futures.as_completed(fs, timeout=deadline.wait_timeout(timeout) if deadline is not None else timeout):
+                                p = exc = None
+                                try:
+                                    p = future.result()
+                                except (IOError, ValueError) as e:
+                                    exc = e
+                                if handle_result(fs.pop(future), p, exc, results, fresh, failures, cached_projects, project_ids):
+                                    pending = True
+                        except concurrent.futures.TimeoutError:
+                            if not out_of_budget():
+                                warning("timeout while updating from '%s', will resume next time\n" % url)
+                            pending = True
+                        except KeyboardInterrupt:
+                            save_checkpoint(merge_projects(project_ids, results, cached_projects, False), failures)
+                            raise
+                        finally:
+                            for future in fs:
+                                future.cancel()
+                    # Keep the project order stable, so the package candidate
+                    # order of the resolver does not depend on network timing
+                    projects = merge_projects(project_ids, results, cached_projects, listing_complete)
+                    if listing_complete:
+                        listed = set(project_ids)
+                        failures = dict((k, v) for k, v in iteritems(failures) if k in listed)
+                    else:
+                        pending = True
+                    server_cache.failures = failures
+                    if pending and out_of_budget():
+                        deadline.skip(label or url)
+                    if not pending:
+                        # Only a finished update moves the bookmark, so an
+                        # interrupted one is resumed by the next refresh
+                        server_cache.last_modified = global_last_modified
                 else:
                     projects = server_cache.projects
                     cache_update = False
+                    pending = False
+            if cache is not None and not pending:
+                cache.set_object(url_to_cache_name(label, url) + "_checked", GITLAB_PACKAGE_CACHE_VERSION, time.time())
+                cache.set_object(url_to_cache_name(label, url) + "_polled", GITLAB_PACKAGE_CACHE_VERSION, poll_start)
         except (IOError, concurrent.futures.TimeoutError) as e:
-            error("cannot update from '%s': %s\n" % (url, e))
+            if out_of_budget():
+                deadline.skip(label or url)
+            else:
+                error("cannot update from '%s': %s\n" % (url, e))
             projects = server_cache.projects
             cache_update = False
         if cache is not None:
@@ -299,19 +1045,89 @@ def find_cloned_gitlab_projects(projects, srcdir, subdir=None):
     return result, foreign
 
 
-def get_gitlab_projects(wsdir, config, cache=None, offline_mode=False, force_update=False, verbose=True):
+def get_gitlab_cache_age(label, url, cache):
+    last_checked = cache.get_object(url_to_cache_name(label, url) + "_checked", GITLAB_PACKAGE_CACHE_VERSION)
+    if last_checked is None:
+        return None
+    return time.time() - last_checked
+
+
+def refresh_gitlab_cache(wsdir):
+    # Entry point for the detached process started by start_background_refresh()
+    from .config import Config
+    from .cache import Cache
+    cache = Cache(wsdir)
+    with _CacheLock(cache, "gitlab_refresh.lock", blocking=False) as acquired:
+        if not acquired:
+            return  # Another refresh is already running
+        config = Config(wsdir, read_only=True)
+        get_gitlab_projects(wsdir, config, cache, verbose=False, allow_stale=False)
+
+
+def start_background_refresh(wsdir):
+    import subprocess
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    with open(os.devnull, "r+b") as devnull:
+        subprocess.Popen(
+            [sys.executable, "-c", "import sys; from rosrepo.gitlab import refresh_gitlab_cache; refresh_gitlab_cache(sys.argv[1])", wsdir],
+            stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, env=env, preexec_fn=os.setsid
+        )
+
+
+def get_gitlab_projects(wsdir, config, cache=None, offline_mode=False, force_update=False, verbose=True, allow_stale=True):
     if "gitlab_servers" not in config:
         return []
-    gitlab_projects = []
-    for gitlab_cfg in config["gitlab_servers"]:
-        label = gitlab_cfg.get("label", None)
-        url = gitlab_cfg.get("url", None)
-        private_token = gitlab_cfg.get("private_token", None)
-        if url is not None and private_token is None and not offline_mode:
-            warning("not updating '%s': no personal access token configured\n" % url)
-            msg("Please visit @{cf}%s/profile/personal_access_tokens@| to create your token and configure it with\n\n    @!rosrepo config --gitlab-login %s --private-token TOKEN@|\n\n" % (url, label))
-            # private_token = ask_personal_access_token(url) or None
-        gitlab_projects += find_available_gitlab_projects(label, url, private_token=private_token, cache=cache, cache_only=offline_mode, crawl_depth=gitlab_cfg.get("crawl_depth", config.get("gitlab_crawl_depth", 1)), force_update=force_update, verbose=verbose)
+    manifest_cache = ManifestBlobCache()
+    max_staleness = config.get("gitlab_max_staleness", None) if allow_stale and not force_update and cache is not None else None
+    need_refresh = False
+    budget = _network_budget if _network_budget is not None else config.get("gitlab_network_budget", None)
+    deadline = Deadline(budget) if budget is not None and not offline_mode else None
+    engine = config.get("gitlab_engine", "threads")
+    if engine == "asyncio" and sys.version_info[:2] < (3, 5):
+        warning("the asyncio engine for Gitlab updates requires Python 3.5 or newer\n")
+        engine = "threads"
+    # The event loop is meant to keep far more requests in flight than the
+    # threads, so it gets a more generous default limit
+    connection_budget = ConnectionBudget(config.get("gitlab_connection_limit", GITLAB_ASYNC_LIMIT if engine == "asyncio" else GITLAB_CONNECTION_LIMIT))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(config["gitlab_servers"]))) as executor:
+        fs = []
+        for gitlab_cfg in config["gitlab_servers"]:
+            label = gitlab_cfg.get("label", None)
+            url = gitlab_cfg.get("url", None)
+            private_token = gitlab_cfg.get("private_token", None)
+            if url is not None and private_token is None and not offline_mode:
+                warning("not updating '%s': no personal access token configured\n" % url)
+                msg("Please visit @{cf}%s/profile/personal_access_tokens@| to create your token and configure it with\n\n    @!rosrepo config --gitlab-login %s --private-token TOKEN@|\n\n" % (url, label))
+                # private_token = ask_personal_access_token(url) or None
+            cache_only = offline_mode
+            if not offline_mode and max_staleness is not None and url is not None and private_token is not None:
+                # Answer from the cache if it is recent enough and let a
+                # background process fetch the updates for next time
+                age = get_gitlab_cache_age(label, url, cache)
+                if age is not None and age <= max_staleness:
+                    cache_only = True
+                    need_refresh = True
+            fs.append(executor.submit(
+                find_available_gitlab_projects, label, url, private_token=private_token, cache=cache, cache_only=cache_only,
+                crawl_depth=gitlab_cfg.get("crawl_depth", config.get("gitlab_crawl_depth", 1)), force_update=force_update, verbose=verbose,
+                connection_budget=connection_budget, manifest_cache=manifest_cache, use_webhooks=gitlab_cfg.get("webhooks", False),
+                project_filter=get_gitlab_project_filter(gitlab_cfg), seed_index=config.get("gitlab_seed_index", None), deadline=deadline,
+                engine=engine
+            ))
+        # Merge in configuration order, regardless of which server answered first
+        gitlab_projects = []
+        for future in fs:
+            gitlab_projects += future.result()
+    if deadline is not None and deadline.skipped:
+        warning("network budget of %gs exhausted, using cached data for %s\n" % (budget, ", ".join(deadline.skipped)))
+    if verbose and manifest_cache.reused > 0:
+        msg("@{cf}Reused@|: %d of %d package manifests without download\n" % (manifest_cache.reused, manifest_cache.reused + manifest_cache.downloaded))
+    if need_refresh:
+        try:
+            start_background_refresh(wsdir)
+        except OSError as e:
+            warning("cannot start background update of Gitlab projects: %s\n" % e)
     return gitlab_projects
 
 
@@ -338,3 +1154,124 @@ def make_gitlab_distfile(label, url, private_token=None, cache=None, timeout=Non
             "packages": packages,
         })
     return yaml_dump(result, default_flow_style=False)
+
+
+def write_gitlab_index(filename, servers):
+    # Compact seed for the project cache: manifests are stored once per blob,
+    # crawl trees are left out, and the payload is compressed JSON rather
+    # than a pickle, so an index can be shared without trusting its origin.
+    # The name and dependency names of each manifest are stored alongside
+    # the XML, so loading the index does not need to parse any manifest.
+    manifests = {}
+    index = {"servers": []}
+    for label, url, server_cache in servers:
+        projects = []
+        for prj in server_cache.projects or []:
+            packages = []
+            for pkg in prj.packages:
+                if pkg.manifest_blob not in manifests:
+                    m = pkg.manifest
+                    manifests[pkg.manifest_blob] = {
+                        "name": m.name,
+                        "version": m.version,
+                        "metapackage": m.metapackage,
+                        "depends": dict((k, list(v)) for k, v in iteritems(m.depends)),
+                        "xml": base64.b64encode(m.compressed_xml).decode("ascii"),
+                    }
+                packages.append([pkg.project_path, pkg.manifest_blob])
+            projects.append({
+                "id": prj.id,
+                "name": prj.name,
+                "website": prj.website,
+                "url": prj.url,
+                "master_branch": prj.master_branch,
+                "last_modified": prj.last_modified.isoformat(),
+                "server_path": prj.server_path,
+                "commit": prj.crawl_commit,
+                "packages": packages,
+            })
+        index["servers"].append({"label": label, "url": url, "server": urlsplit(url)[1], "last_modified": server_cache.last_modified, "projects": projects})
+    index["manifests"] = manifests
+    data = zlib.compress(json.dumps(index, separators=(",", ":"), sort_keys=True).encode("UTF-8"), 9)
+    write_atomic(filename, GITLAB_INDEX_MAGIC + struct.pack("!H", GITLAB_INDEX_VERSION) + data)
+
+
+def read_gitlab_index(filename, manifest_cache=None):
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(GITLAB_INDEX_MAGIC):
+        raise ValueError("not a rosrepo Gitlab index")
+    offset = len(GITLAB_INDEX_MAGIC)
+    version = struct.unpack("!H", data[offset:offset + 2])[0]
+    if version != GITLAB_INDEX_VERSION:
+        raise ValueError("unsupported Gitlab index version %d" % version)
+    try:
+        index = json.loads(zlib.decompress(data[offset + 2:]).decode("UTF-8"))
+    except zlib.error as e:
+        raise ValueError("corrupt Gitlab index: %s" % e)
+    if manifest_cache is None:
+        manifest_cache = ManifestBlobCache()
+
+    def load_manifest(blob, filename):
+        m = index["manifests"][blob]
+        try:
+            depends = dict((k, tuple(v)) for k, v in iteritems(m["depends"]))
+            compressed_xml = base64.b64decode(m["xml"].encode("ascii"))
+        except (AttributeError, TypeError, binascii.Error):
+            raise ValueError("corrupt Gitlab index: invalid manifest %s" % blob)
+        return manifest_cache.add(blob, LazyManifest(m["name"], m["version"], depends, m["metapackage"], filename, compressed_xml))
+
+    result = []
+    for srv in index["servers"]:
+        projects = []
+        for yaml_p in srv["projects"]:
+            p = GitlabProject(
+                server=srv["server"],
+                name=yaml_p["name"],
+                id=yaml_p["id"],
+                website=yaml_p["website"],
+                url=yaml_p["url"],
+                master_branch=yaml_p["master_branch"],
+                packages=[],
+                last_modified=date_parse(yaml_p["last_modified"]),
+                workspace_path=None,
+                server_path=yaml_p["server_path"],
+                crawl_tree=None,
+                crawl_commit=yaml_p["commit"]
+            )
+            for path, blob in yaml_p["packages"]:
+                manifest = load_manifest(blob, os.path.join(path, PACKAGE_MANIFEST_FILENAME))
+                p.packages.append(GitlabPackage(manifest=manifest, project=p, project_path=path, manifest_blob=blob))
+            projects.append(p)
+        result.append((srv["label"], srv["url"], GitlabServer(projects=projects, last_modified=srv["last_modified"], failures={})))
+    return result
+
+
+_seed_indexes = {}
+
+
+def get_gitlab_index_seed(filename, url, manifest_cache=None):
+    if filename not in _seed_indexes:
+        try:
+            _seed_indexes[filename] = read_gitlab_index(filename, manifest_cache)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            warning("cannot read Gitlab index '%s': %s\n" % (filename, e))
+            _seed_indexes[filename] = []
+    for _, seed_url, server_cache in _seed_indexes[filename]:
+        if seed_url.rstrip("/") == url.rstrip("/"):
+            return GitlabServer(projects=list(server_cache.projects), last_modified=server_cache.last_modified, failures={})
+    return None
+
+
+def export_gitlab_index(filename, config, cache):
+    servers = []
+    for gitlab_cfg in config.get("gitlab_servers", []):
+        label = gitlab_cfg.get("label", None)
+        url = gitlab_cfg.get("url", None)
+        if url is None:
+            continue
+        server_cache = cache.get_object(url_to_cache_name(label, url), GITLAB_PACKAGE_CACHE_VERSION, None)
+        if server_cache is not None:
+            servers.append((label, url, server_cache))
+    write_gitlab_index(filename, servers)
+    return servers
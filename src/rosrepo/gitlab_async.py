@@ -0,0 +1,327 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Alternative crawler engine for Python 3.5 and newer: instead of a handful
+# of threads blocking on requests, a single event loop keeps hundreds of
+# requests in flight over a minimal HTTP/1.1 client with keep-alive.
+#
+import asyncio
+import json
+import os
+import re
+import ssl
+from urllib.parse import urljoin, urlsplit, urlencode, quote as urlquote
+
+from catkin_pkg.package import PACKAGE_MANIFEST_FILENAME
+
+from .gitlab import GitlabTree, GITLAB_ASYNC_LIMIT, GITLAB_BUDGET_POLL, GITLAB_PAGE_SIZE, new_gitlab_project, reuse_gitlab_project, \
+    load_gitlab_packages, scan_tree_entries, is_gitlab_project_unchanged
+from .ui import msg
+from .util import NamedTuple
+
+
+class HttpError(IOError):
+
+    def __init__(self, status, reason, url):
+        super(HttpError, self).__init__("%d %s for url: %s" % (status, reason, url))
+        self.status = status
+
+
+class HttpResponse(NamedTuple):
+    __slots__ = ("url", "status", "reason", "headers", "content")
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def json(self):
+        return json.loads(self.content.decode("UTF-8"))
+
+    def next_link(self):
+        m = re.search(r'<([^>]*)>\s*;\s*rel="next"', self.header("Link", ""))
+        return m.group(1) if m else None
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HttpError(self.status, self.reason, self.url)
+
+
+class HttpClient(object):
+
+    def __init__(self, headers=None, limit=GITLAB_ASYNC_LIMIT, deadline=None, connection_budget=None):
+        self.headers = headers or {}
+        self.semaphore = asyncio.Semaphore(limit)
+        self.deadline = deadline
+        self.connection_budget = connection_budget
+        self.pool = {}
+        self.ssl_context = None
+
+    def close(self):
+        for conns in self.pool.values():
+            for _, writer in conns:
+                writer.close()
+        self.pool = {}
+
+    async def request(self, method, url, params=None, timeout=None):
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(sorted(params.items()))
+        async with self.semaphore:
+            if self.connection_budget is None:
+                return await self._timed_request(method, url, timeout)
+            # The budget is shared with the other Gitlab servers, which are
+            # updated in other threads, so it cannot be awaited directly
+            while not self.connection_budget.try_acquire():
+                await asyncio.sleep(GITLAB_BUDGET_POLL)
+            try:
+                return await self._timed_request(method, url, timeout)
+            finally:
+                self.connection_budget.release()
+
+    async def _timed_request(self, method, url, timeout):
+        if self.deadline is not None:
+            timeout = self.deadline.timeout(timeout)
+        try:
+            return await asyncio.wait_for(self._request(method, url), timeout)
+        except asyncio.TimeoutError:
+            raise IOError("timeout for url: %s" % url)
+
+    async def get(self, url, params=None, timeout=None):
+        return await self.request("GET", url, params=params, timeout=timeout)
+
+    async def head(self, url, params=None, timeout=None):
+        return await self.request("HEAD", url, params=params, timeout=timeout)
+
+    async def _connect(self, key):
+        conns = self.pool.get(key, [])
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        scheme, host, port = key
+        if scheme == "https" and self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(host, port, ssl=self.ssl_context if scheme == "https" else None)
+        return (reader, writer), False
+
+    async def _request(self, method, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        lines = ["%s %s HTTP/1.1" % (method, target), "Host: %s" % parts.netloc, "Accept-Encoding: identity", "User-Agent: rosrepo"]
+        lines += ["%s: %s" % (k, v) for k, v in sorted(self.headers.items())]
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        while True:
+            conn, reused = await self._connect(key)
+            reader, writer = conn
+            try:
+                writer.write(data)
+                await writer.drain()
+                status, reason, headers, content, keep_alive = await self._read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused:
+                    continue  # The server has closed an idle keep-alive connection
+                raise IOError("connection error for url %s: %s" % (url, e))
+            except BaseException:
+                # Cancelled or malformed: the connection is in an unknown state
+                writer.close()
+                raise
+            if keep_alive:
+                self.pool.setdefault(key, []).append(conn)
+            else:
+                writer.close()
+            return HttpResponse(url=url, status=status, reason=reason, headers=headers, content=content)
+
+    async def _read_response(self, reader, method):
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        try:
+            version, status, reason = (line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            status = int(status)
+        except ValueError:
+            raise IOError("malformed HTTP status line: %r" % line)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in [b"\r\n", b"\n", b""]:
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            k, v = k.strip().lower(), v.strip()
+            headers[k] = headers[k] + ", " + v if k in headers else v
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+        if method == "HEAD" or status in [204, 304] or 100 <= status < 200:
+            content = b""
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await reader.read()
+            keep_alive = False
+        return status, reason, headers, content, keep_alive
+
+
+async def gather_all(coros):
+    # Like asyncio.gather(), but wait for every task to finish before the
+    # first error is raised, so no orphaned tasks outlive the event loop
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+    return results
+
+
+async def get_all_pages(client, url, params, timeout):
+    entries = []
+    base_params = dict(params, per_page=GITLAB_PAGE_SIZE)
+    next_url, next_params = url, base_params
+    while next_url is not None:
+        r = await client.get(next_url, params=next_params, timeout=timeout)
+        r.raise_for_status()
+        entries += r.json()
+        if r.next_link():
+            next_url, next_params = r.next_link(), None
+        elif r.header("X-Next-Page"):
+            next_url, next_params = url, dict(base_params, page=r.header("X-Next-Page"))
+        else:
+            next_url = None
+    return entries
+
+
+async def crawl_project_tree(client, url, project_id, path, depth, timeout, tree_id=None, cached_tree=None):
+    if tree_id is not None and cached_tree is not None and cached_tree.id == tree_id and cached_tree.depth == depth:
+        return cached_tree
+    tree = GitlabTree(id=tree_id, depth=depth, packages=[], subtrees={})
+    try:
+        entries = await get_all_pages(client, urljoin(url, "api/v4/projects/%s/repository/tree" % project_id), {"path": path, "pagination": "keyset"}, timeout)
+    except HttpError as e:
+        if e.status != 404:
+            raise
+        return tree  # Empty repository
+    dirs = scan_tree_entries(tree, path, entries, depth)
+    subtrees = await gather_all([
+        crawl_project_tree(client, url, project_id, os.path.join(path, d), depth - 1, timeout, tree_id=d_id, cached_tree=cached_tree.subtrees.get(d) if cached_tree is not None else None)
+        for d, d_id in dirs
+    ])
+    for (d, _), subtree in zip(dirs, subtrees):
+        tree.subtrees[d] = subtree
+        tree.packages += subtree.packages
+    return tree
+
+
+async def probe_project_commit(client, url, project_id, ref, path, timeout):
+    filename = os.path.join(path, PACKAGE_MANIFEST_FILENAME)
+    r = await client.head(urljoin(url, "api/v4/projects/%s/repository/files/%s" % (project_id, urlquote(filename, safe=""))), params={"ref": ref}, timeout=timeout)
+    if r.status != 200:
+        return None
+    return r.header("X-Gitlab-Commit-Id")
+
+
+async def update_single_project(client, url, server_name, yaml_p, cached_p, crawl_depth, timeout, force_update, manifest_cache, verbose):
+    p = new_gitlab_project(server_name, yaml_p)
+    reuse = is_gitlab_project_unchanged(p, cached_p, force_update)
+    if reuse is None:
+        p.crawl_commit = await probe_project_commit(client, url, p.id, p.master_branch, cached_p.packages[0].project_path, timeout)
+        reuse = is_gitlab_project_unchanged(p, cached_p, force_update, probed=True)
+    if reuse:
+        reuse_gitlab_project(p, cached_p)
+        return p
+    if verbose:
+        msg("@{cf}Updating@|: %s\n" % p.website)
+    cached_tree = cached_p.crawl_tree if cached_p is not None and not force_update else None
+    p.crawl_tree = await crawl_project_tree(client, url, p.id, "", crawl_depth, timeout, cached_tree=cached_tree)
+    xml = {}
+
+    async def download_blob(blob):
+        xml_data = manifest_cache.lookup_xml(blob)
+        if xml_data is None:
+            r = await client.get(urljoin(url, "api/v4/projects/%s/repository/blobs/%s/raw" % (p.id, blob)), timeout=timeout)
+            r.raise_for_status()
+            xml_data = r.content
+            manifest_cache.store_xml(blob, xml_data)
+        xml[blob] = xml_data
+
+    await gather_all([download_blob(blob) for blob in set(blob for _, blob in p.crawl_tree.packages)])
+    load_gitlab_packages(p, xml.get, manifest_cache, verbose)
+    return p
+
+
+async def crawl_all(url, private_token, server_name, jobs, on_done, crawl_depth, timeout, force_update, manifest_cache, verbose, deadline, limit, connection_budget):
+    if connection_budget is not None:
+        # No point in more waiting requests than the budget will ever allow
+        limit = min(limit, connection_budget.limit)
+    client = HttpClient({"PRIVATE-TOKEN": private_token}, limit=limit, deadline=deadline, connection_budget=connection_budget)
+    pending = [False]
+
+    async def run(yaml_p, cached_p):
+        try:
+            p = await update_single_project(client, url, server_name, yaml_p, cached_p, crawl_depth, timeout, force_update, manifest_cache, verbose)
+        except (IOError, ValueError) as e:
+            pending[0] = on_done(yaml_p, None, e) or pending[0]
+            return
+        pending[0] = on_done(yaml_p, p, None) or pending[0]
+
+    try:
+        tasks = [asyncio.ensure_future(run(yaml_p, cached_p)) for yaml_p, cached_p in jobs]
+        # Each task holds on to its project only until it is done
+        del jobs[:]
+        if not tasks:
+            return False
+        wait = deadline.wait_timeout(timeout) if deadline is not None else timeout
+        done, not_done = await asyncio.wait(tasks, timeout=wait)
+        if not_done:
+            for task in not_done:
+                task.cancel()
+            await asyncio.wait(not_done)
+            pending[0] = True
+        for task in done:
+            task.result()
+    finally:
+        client.close()
+    return pending[0]
+
+
+def crawl_gitlab_projects(url, private_token, server_name, jobs, on_done, crawl_depth=-1, timeout=None, force_update=False, manifest_cache=None, verbose=True, deadline=None, limit=GITLAB_ASYNC_LIMIT, connection_budget=None):
+    """Crawl the (yaml_p, cached_p) jobs and report each result as on_done(yaml_p, p, exc)
+
+    Returns True if any project remains pending, either because on_done said so
+    or because the crawl ran out of time. The jobs list is consumed. A connection_budget is shared with
+    the crawls of all other Gitlab servers.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(crawl_all(url, private_token, server_name, jobs, on_done, crawl_depth, timeout, force_update, manifest_cache, verbose, deadline, limit, connection_budget))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -40,6 +40,7 @@ CMD_DEPEND = 9
 CMD_EXPORT = 10
 CMD_FIND = 11
 CMD_TEST = 12
+CMD_GITLAB_HOOK = 13
 
 
 def add_common_options(parser):
@@ -50,6 +51,7 @@ def add_common_options(parser):
     m = g.add_mutually_exclusive_group(required=False)
     m.add_argument("--offline", "--offline-mode", action="store_true", default=None, help="assume no network connection; do not contact Gitlab servers")
     m.add_argument("--no-offline", "--no-offline-mode", "--online", action="store_false", dest="offline", help="assume network connection; fetch updates from Gitlab servers (default)")
+    g.add_argument("--network-budget", metavar="SECONDS", type=float, help="limit the total time spent on Gitlab updates and fall back to cached data afterwards")
     g.add_argument("--dry-run", action="store_true", help="do nothing and just print what would be done")
 
 
@@ -83,7 +85,26 @@ def prepare_arguments(parser):
     g.add_argument("--gitlab-logout", metavar="LABEL", help="delete private token for the Gitlab server named LABEL")
     g.add_argument("--private-token", metavar="TOKEN", help="set private token for Gitlab server access explicitly (can be used with --set-gitlab-url and --gitlab-login)")
     g.add_argument("--set-gitlab-crawl-depth", metavar="DEPTH", type=int, help="set the tree depth limit for the Gitlab project crawler (default: 1)")
+    g.add_argument("--set-gitlab-engine", choices=["threads", "asyncio"], help="select the engine for Gitlab updates; asyncio keeps more requests in flight and requires Python 3.5 (default: threads)")
+    g.add_argument("--set-gitlab-connection-limit", metavar="LIMIT", type=int, help="set the maximum number of concurrent connections to all Gitlab servers (default: 10, or 100 with the asyncio engine)")
+    m = g.add_mutually_exclusive_group(required=False)
+    m.add_argument("--set-gitlab-max-staleness", metavar="SECONDS", type=int, help="use cached Gitlab data up to SECONDS old and update it in the background")
+    m.add_argument("--unset-gitlab-max-staleness", action="store_true", help="always wait for Gitlab updates (default)")
+    m = g.add_mutually_exclusive_group(required=False)
+    m.add_argument("--set-gitlab-network-budget", metavar="SECONDS", type=float, help="limit the total time spent on Gitlab updates per command")
+    m.add_argument("--unset-gitlab-network-budget", action="store_true", help="wait for Gitlab updates regardless of how long they take (default)")
+    g.add_argument("--gitlab-webhooks", metavar="LABEL", help="rely on 'rosrepo gitlab-hook' for updates from the Gitlab server named LABEL")
+    g.add_argument("--no-gitlab-webhooks", metavar="LABEL", help="poll the Gitlab server named LABEL for updates (default)")
+    m = g.add_mutually_exclusive_group(required=False)
+    m.add_argument("--set-gitlab-webhook-secret", metavar="TOKEN", help="make 'rosrepo gitlab-hook' accept only webhooks with this secret token")
+    m.add_argument("--unset-gitlab-webhook-secret", action="store_true", help="accept webhooks without a secret token (default)")
+    g.add_argument("--add-gitlab-filter", nargs=2, action="append", metavar=("LABEL", "FILTER"), help="only crawl matching projects of the Gitlab server named LABEL; FILTER is one of group:NAME, exclude-group:NAME, topic:NAME, membership, or no-archived")
+    g.add_argument("--clear-gitlab-filters", metavar="LABEL", help="crawl all visible projects of the Gitlab server named LABEL (default)")
     g.add_argument("--force-gitlab-update", action="store_true", help="search Gitlab servers for available packages")
+    g.add_argument("--export-gitlab-index", metavar="FILE", help="write the cached Gitlab projects and package manifests to FILE")
+    m = g.add_mutually_exclusive_group(required=False)
+    m.add_argument("--set-gitlab-seed-index", metavar="FILE", help="populate an empty Gitlab project cache from FILE instead of crawling")
+    m.add_argument("--unset-gitlab-seed-index", action="store_true", help="always crawl Gitlab servers to populate an empty cache (default)")
     g.add_argument("--protocol", help="set default protocol for accessing Git repositories")
     g = p.add_argument_group("credential storage options")
     m = g.add_mutually_exclusive_group(required=False)
@@ -97,6 +118,7 @@ def prepare_arguments(parser):
     m = g.add_mutually_exclusive_group(required=False)
     m.add_argument("--install", action="store_true", default=None, help="run installation routine for packages")
     m.add_argument("--no-install", action="store_false", dest="install", help="do not run installation routine for packages")
+    g.add_argument("--set-depend-profile", choices=["build", "run", "full"], help="set the default dependency profile for build, include and export (default: full)")
     m = g.add_mutually_exclusive_group(required=False)
     m.add_argument("--set-compiler", metavar="COMPILER", help="override compiler to build packages")
     m.add_argument("--unset-compiler", action="store_true", help="reset compiler override")
@@ -149,6 +171,7 @@ def prepare_arguments(parser):
     g.add_argument("-j", "--jobs", help="limit the number of simultaneous jobs")
     g.add_argument("--no-status", action="store_true", help="suppress status line")
     g.add_argument("-m", "--ignore-missing-depends", action="store_true", help="do not abort the build if system dependencies are missing")
+    g.add_argument("--profile", choices=["build", "run", "full"], help="build with only the dependencies needed to build, to build and run, or everything including tests (default: full)")
     m = g.add_mutually_exclusive_group(required=False)
     m.add_argument("--clone", action="store_true", default=True, help="clone missing dependencies (default)")
     m.add_argument("--no-clone", action="store_false", dest="clone", help="do not clone missing dependencies")
@@ -296,6 +319,7 @@ def prepare_arguments(parser):
     add_common_options(p)
     p.add_argument("-l", "--list", action="store_true", help="list packages but do not change anything")
     p.add_argument("-p", "--protocol", help="use PROTOCOL to clone missing packages from Gitlab")
+    p.add_argument("--profile", choices=["build", "run", "full"], help="clone only the dependencies needed to build, to build and run, or everything including tests (default: full)")
     p.add_argument("--replace", action="store_true", help="replace the whole set (instead of adding to it)")
     p.add_argument("--delete-unused", action="store_true", help="delete unused projects from workspace (DANGEROUS)")
     m = p.add_mutually_exclusive_group(required=False)
@@ -327,6 +351,8 @@ def prepare_arguments(parser):
     # depend
     p = cmds.add_parser("depend", help="show package dependencies")
     add_common_options(p)
+    p.add_argument("--affected", action="store_true", help="show all packages which depend on the selected packages, directly or indirectly")
+    p.add_argument("--plan", action="store_true", help="show build order, dependency levels and critical path for the selected packages (default: default and pinned build set)")
     m = p.add_mutually_exclusive_group(required=False)
     m.add_argument("--this", action="store_true", help="select packages in the current working directory")
     m.add_argument("packages", metavar="PACKAGE", default=[], nargs="*", help="select affected packages")
@@ -337,6 +363,7 @@ def prepare_arguments(parser):
     add_common_options(p)
     p.add_argument("-o", "--output", metavar="FILE", type=FileType("w"), default=sys.stdout, help="write rosinstall information to FILE")
     p.add_argument("-p", "--protocol", help="use PROTOCOL in the Git URLs (default: ssh)")
+    p.add_argument("--profile", choices=["build", "run", "full"], help="export only the dependencies needed to build, to build and run, or everything including tests (default: full)")
     m = p.add_mutually_exclusive_group(required=False)
     m.add_argument("-a", "--all", action="store_true", help="select all packages")
     m.add_argument("--this", action="store_true", help="select package in the current working directory")
@@ -375,11 +402,22 @@ def prepare_arguments(parser):
     m.add_argument("packages", metavar="PACKAGE", default=[], nargs="*", help="select packages to test")
     p.set_defaults(func=CMD_TEST)
 
+    # gitlab-hook
+    p = cmds.add_parser("gitlab-hook", help="receive Gitlab webhooks to update packages on demand")
+    add_common_options(p)
+    p.add_argument("--bind", metavar="ADDRESS", default="127.0.0.1", help="listen on ADDRESS (default: 127.0.0.1)")
+    p.add_argument("--port", type=int, default=8911, help="listen on PORT (default: 8911)")
+    p.add_argument("--secret", metavar="TOKEN", help="only accept webhooks with this secret token (default: set with 'rosrepo config --set-gitlab-webhook-secret')")
+    p.set_defaults(func=CMD_GITLAB_HOOK)
+
     return parser
 
 
 def run_rosrepo(args):  # pragma: no cover
     try:
+        if getattr(args, "network_budget", None) is not None:
+            from .gitlab import set_network_budget
+            set_network_budget(args.network_budget)
         if hasattr(args, "func"):
             if args.func == CMD_BASH:
                 import rosrepo.cmd_bash
@@ -417,6 +455,9 @@ def run_rosrepo(args):  # pragma: no cover
             if args.func == CMD_TEST:
                 import rosrepo.cmd_test
                 return rosrepo.cmd_test.run(args)
+            if args.func == CMD_GITLAB_HOOK:
+                import rosrepo.cmd_gitlab_hook
+                return rosrepo.cmd_gitlab_hook.run(args)
         error("no command\n")
     except UserError as e:
         if args.stacktrace:
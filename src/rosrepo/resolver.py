@@ -20,11 +20,23 @@
 # limitations under the License.
 #
 #
-from .ui import pick_dependency_resolution, warning, error, escape
-from .util import is_deprecated_package, call_process, PIPE, iteritems
-from distutils.version import LooseVersion as ManifestVersion
+from .ui import pick_dependency_resolution, msg, warning, error, escape
+from .util import is_deprecated_package, call_process, PIPE, makedirs, write_atomic
+from .depgraph import get_dependency_graph, ClosureEngine, DEPEND_PROFILES, P_REMOTE, P_WS
+import os
 import platform
 import gc
+import time
+import threading
+import zlib
+import concurrent.futures
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+SYSTEM_PACKAGE_DATABASES = ["/var/lib/dpkg/status", "/usr/local/Cellar", "/opt/homebrew/Cellar"]
 
 
 class DummyRospkg(object):
@@ -32,10 +44,93 @@ class DummyRospkg(object):
         return []
 
 
+class ResolutionError(Exception):
+    pass
+
+
+ROSDEP_INDEX_VERSION = 2
+ROSDEP_RESOLVE_WORKERS = 8
+
+
+def get_rosdep_sources_cache_dir():
+    ros_home = os.environ.get("ROS_HOME", os.path.join(os.path.expanduser("~"), ".ros"))
+    return os.path.join(ros_home, "rosdep", "sources.cache")
+
+
+def get_user_cache_file(name):
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "rosrepo", name)
+
+
+def load_user_cache(filename, key):
+    try:
+        with open(filename, "rb") as f:
+            cache_key, data = pickle.loads(zlib.decompress(f.read()))
+    except Exception:
+        return None
+    return data if cache_key == key else None
+
+
+def save_user_cache(filename, key, data):
+    makedirs(os.path.dirname(filename))
+    write_atomic(filename, zlib.compress(pickle.dumps((key, data), -1)), ignore_fail=True)
+
+
+def stat_key(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+
+def get_rosdep_index_file():
+    return get_user_cache_file("rosdep-%s.index" % os.environ.get("ROS_DISTRO", "default"))
+
+
+def get_rosdep_index_key():
+    # The compiled index is valid as long as the rosdep sources have not
+    # been updated and we are still on the same platform
+    return (
+        ROSDEP_INDEX_VERSION, stat_key(os.path.join(get_rosdep_sources_cache_dir(), "index")), stat_key("/etc/os-release"),
+        platform.system(), os.environ.get("ROS_DISTRO", None), os.environ.get("ROS_OS_OVERRIDE", None)
+    )
+
+
+def load_rosdep_index(key):
+    return load_user_cache(get_rosdep_index_file(), key)
+
+
+def save_rosdep_index(key, keys, rules):
+    save_user_cache(get_rosdep_index_file(), key, (keys, rules))
+
+
 class Rosdep(object):
+    # Loading the rosdep database takes seconds, so we keep an index of all
+    # rosdep keys and the rules resolved for this platform so far, and only
+    # fall back to rosdep itself for keys which have not been resolved yet.
+    # Rules are resolved on demand, because some installers shell out for
+    # every single key.
 
     def __init__(self):
         self.cached_installers = {}
+        self.installer_lock = threading.Lock()
+        self.timings = {}
+        self.lookup = None
+        self.view = None
+        self.keys = None
+        self.rules = {}
+        self.index_key = get_rosdep_index_key()
+        index = load_rosdep_index(self.index_key)
+        if index is not None:
+            self.keys, self.rules = index
+        else:
+            self.load_rosdep()
+            if self.view is not None:
+                self.keys = frozenset(self.view.keys())
+                save_rosdep_index(self.index_key, self.keys, self.rules)
+
+    def load_rosdep(self):
         gc.disable()
         try:
             import sys
@@ -54,31 +149,94 @@ class Rosdep(object):
             self.view = None
         gc.enable()
 
+    def compile_rules(self, keys):
+        # Some installers shell out to resolve their rules, so we
+        # resolve the keys concurrently
+        keys = sorted(keys)
+        self.timings = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(ROSDEP_RESOLVE_WORKERS, len(keys))) as executor:
+            return dict(zip(keys, executor.map(self.try_resolve_rule, keys)))
+
+    def try_resolve_rule(self, dep):
+        try:
+            return self.resolve_rule(dep)
+        except Exception:
+            # rosdep raises all kinds of errors for keys which have
+            # no rule for this platform
+            return None
+
+    def resolve_rule(self, dep):
+        d = self.view.lookup(dep)
+        rule_installer, rule = \
+            d.get_rule_for_platform(self.os_name, self.os_version, self.installer_keys, self.default_key)
+        with self.installer_lock:
+            if rule_installer in self.cached_installers:
+                installer = self.cached_installers[rule_installer]
+            else:
+                installer = self.installer_ctx.get_installer(rule_installer)
+                self.cached_installers[rule_installer] = installer
+        start = time.time()
+        resolved = installer.resolve(rule)
+        elapsed = time.time() - start
+        with self.installer_lock:
+            count, total = self.timings.get(rule_installer, (0, 0.0))
+            self.timings[rule_installer] = (count + 1, total + elapsed)
+        return rule_installer, tuple(d.package if hasattr(d, "package") else d for d in resolved)
+
     def __contains__(self, name):
-        return self.view is not None and name in self.view.keys()
+        return self.keys is not None and name in self.keys
 
     def ok(self):
-        return self.view is not None
+        return self.keys is not None
 
     def reverse_depends(self, dep):
+        if self.lookup is None:
+            self.load_rosdep()
         result = self.lookup.get_resources_that_need(dep)
         return set(result)
 
     def depends(self, dep):
+        if self.lookup is None:
+            self.load_rosdep()
         result = self.lookup.get_rosdeps(dep, implicit=False)
         return set(result)
 
     def resolve(self, dep):
-        d = self.view.lookup(dep)
-        rule_installer, rule = \
-            d.get_rule_for_platform(self.os_name, self.os_version, self.installer_keys, self.default_key)
-        if rule_installer in self.cached_installers:
-            installer = self.cached_installers[rule_installer]
-        else:
-            installer = self.installer_ctx.get_installer(rule_installer)
-            self.cached_installers[rule_installer] = installer
-        resolved = installer.resolve(rule)
-        return rule_installer, resolved
+        if dep not in self:
+            raise KeyError(dep)
+        resolved, _ = self.resolve_many([dep])
+        if dep not in resolved:
+            raise ResolutionError("no rule for rosdep key '%s' on this platform" % dep)
+        return resolved[dep]
+
+    def resolve_many(self, deps):
+        """Resolve a batch of rosdep keys
+
+        Returns a dictionary with the (installer, packages) rule for each
+        resolvable key, and the set of keys which cannot be resolved.
+        Keys which have not been resolved before are resolved concurrently
+        and added to the index for later commands.
+        """
+        deps = set(deps)
+        pending = set(dep for dep in deps if dep in self and dep not in self.rules)
+        if pending:
+            if self.view is None:
+                self.load_rosdep()
+            if self.view is not None:
+                start = time.time()
+                self.rules.update(self.compile_rules(pending))
+                save_rosdep_index(self.index_key, self.keys, self.rules)
+                msg("@{cf}Resolved@|: %d rosdep keys in %.2fs (%s)\n" % (len(pending), time.time() - start, ", ".join(
+                    "%s: %d in %.2fs" % (escape(installer), count, elapsed) for installer, (count, elapsed) in sorted(self.timings.items())
+                )))
+        resolved, unresolved = {}, set()
+        for dep in deps:
+            rule = self.rules.get(dep, None)
+            if rule is not None:
+                resolved[dep] = rule
+            else:
+                unresolved.add(dep)
+        return resolved, unresolved
 
 
 _rosdep_instance = None
@@ -91,124 +249,226 @@ def get_rosdep():
     return _rosdep_instance
 
 
-def find_dependers(packages, ws_state):
+def find_dependers(packages, ws_state, recursive=False):
+    graph = get_dependency_graph(ws_state)
     depends = set()
     system_depends = set()
-    query_set = set(packages)
     # rosdep = get_rosdep()
     # for pkg in packages:
     #     system_depends |= rosdep.reverse_depends(pkg)
-    for name, pkg_list in iteritems(ws_state.ws_packages):
-        for pkg in pkg_list:
-            manifest = pkg.manifest
-            pkg_depends = set([p.name for p in manifest.buildtool_depends + manifest.build_depends + manifest.run_depends + manifest.test_depends])
-            if query_set & pkg_depends:
-                depends.add(name)
-    for name, pkg_list in iteritems(ws_state.remote_packages):
-        for pkg in pkg_list:
-            manifest = pkg.manifest
-            pkg_depends = set([p.name for p in manifest.buildtool_depends + manifest.build_depends + manifest.run_depends + manifest.test_depends])
-            if query_set & pkg_depends:
-                depends.add(name)
+    queue = [graph.ids[name] for name in packages if name in graph.ids]
+    visited = set(queue)
+    while queue:
+        for slot in graph.get_dependers(queue.pop()):
+            if graph.sources[slot] not in [P_WS, P_REMOTE]:
+                continue
+            node = graph.nodes[slot]
+            depends.add(graph.names[node])
+            if recursive and node not in visited:
+                visited.add(node)
+                queue.append(node)
     system_depends -= depends
     return depends, system_depends
 
 
-def find_dependees(packages, ws_state, auto_resolve=False, ignore_missing=False, recursive=True, force_workspace=True):
-    P_REMOTE = 1
-    P_WS = 2
-    P_ROS_ROOT = 3
-
-    def find_package_candidates(name, ws_state, resolver_msgs):
-        # Returns a list of packages which satisfy the given dependency
-        if name in ws_state.ws_packages:
-            # If the package is in the workspace, it will be used unconditionally
-            return [(ws_state.ws_packages[name][0], P_WS)]
-        result = []
-        if name in ws_state.ros_root_packages:
-            result.append((ws_state.ros_root_packages[name][0], P_ROS_ROOT))
-        if name in ws_state.remote_packages:
-            remotes = ws_state.remote_packages[name]
-            if len(remotes) > 1 and not auto_resolve:
+class ResolutionCache(object):
+    # Memoized find_dependees() results for one WorkspaceState. The state
+    # fields an entry was resolved from are its generation: if only the
+    # workspace packages are replaced (e.g. after cloning), only the entries
+    # which looked at one of the changed package names are evicted. Any other
+    # change discards the whole cache.
+
+    def __init__(self, ws_state):
+        self.entries = {}
+        self.generation = self.get_generation(ws_state)
+
+    @staticmethod
+    def get_generation(ws_state):
+        return (ws_state.ws_packages, ws_state.ros_root_packages, ws_state.remote_packages, ws_state.ws_projects)
+
+    def update(self, ws_state):
+        generation = self.get_generation(ws_state)
+        if all(a is b for a, b in zip(generation, self.generation)):
+            return
+        if all(a is b for a, b in zip(generation[1:], self.generation[1:])):
+            old_packages, new_packages = self.generation[0] or {}, generation[0] or {}
+            changed = set(
+                name for name in set(old_packages) | set(new_packages)
+                if [p.workspace_path for p in old_packages.get(name, [])] != [p.workspace_path for p in new_packages.get(name, [])]
+            )
+            for key, (depends, _, _, touched) in list(self.entries.items()):
+                if touched & changed:
+                    del self.entries[key]
+                    continue
+                for name in depends:
+                    if name in new_packages:
+                        depends[name] = new_packages[name][0]
+        else:
+            self.entries = {}
+        self.generation = generation
+
+    def get(self, key):
+        return self.entries.get(key, None)
+
+    def put(self, key, result):
+        self.entries[key] = result
+
+
+def get_resolution_cache(ws_state):
+    if ws_state.resolution_cache is None:
+        ws_state.resolution_cache = ResolutionCache(ws_state)
+    else:
+        ws_state.resolution_cache.update(ws_state)
+    return ws_state.resolution_cache
+
+
+def find_dependees(packages, ws_state, auto_resolve=False, ignore_missing=False, recursive=True, force_workspace=True, profile="full"):
+    cache = get_resolution_cache(ws_state)
+    key = (frozenset(packages), auto_resolve, ignore_missing, recursive, force_workspace, profile)
+    result = cache.get(key)
+    if result is None:
+        result = resolve_dependees(packages, ws_state, auto_resolve, ignore_missing, recursive, force_workspace, DEPEND_PROFILES[profile])
+        cache.put(key, result)
+    depends, system_depends, conflicts, _ = result
+    return dict(depends), set(system_depends), dict(conflicts)
+
+
+def find_dependee_closures(packages, ws_state, auto_resolve=False, ignore_missing=False, profile="full"):
+    """Resolve the dependees of packages and return them as closure engine
+
+    The engine answers closure queries for any subset of the packages
+    without another traversal, using the candidates resolved for the
+    whole set. Returns the engine, the system dependencies, and the
+    conflicts.
+    """
+    depends, system_depends, conflicts = find_dependees(packages, ws_state, auto_resolve=auto_resolve, ignore_missing=ignore_missing, profile=profile)
+    return ClosureEngine(get_dependency_graph(ws_state), depends, DEPEND_PROFILES[profile]), system_depends, conflicts
+
+
+def resolve_dependees(packages, ws_state, auto_resolve, ignore_missing, recursive, force_workspace, dep_types):
+    # Returns the dependees, system dependencies and conflicts, and the
+    # set of all package names which had an influence on the outcome
+    graph = get_dependency_graph(ws_state)
+    names = graph.names
+
+    def find_package_candidates(node):
+        # Returns a list of (slot, source) pairs which satisfy the given dependency
+        candidates = graph.get_candidates(node)
+        if not auto_resolve and len(candidates) > 1:
+            remotes = [graph.packages[slot] for slot in candidates if graph.sources[slot] == P_REMOTE]
+            if len(remotes) > 1:
                 # If desired, let the user pick one
-                desired = pick_dependency_resolution(name, remotes)
+                desired = pick_dependency_resolution(names[node], remotes)
                 if desired is not None:
-                    remotes = [desired]
-            for pkg in remotes:
-                result.append((pkg, P_REMOTE))
-        return sorted(result, key=lambda x: (ManifestVersion(x[0].manifest.version), x[1]), reverse=True)
-
-    def try_resolve(queue, depends=None, system_depends=None, conflicts=None):
-        if depends is None:
-            depends = {}
-        if system_depends is None:
-            system_depends = set()
-        if conflicts is None:
-            conflicts = {}
+                    candidates = [slot for slot in candidates if graph.sources[slot] != P_REMOTE or graph.packages[slot] is desired]
+        return [(slot, graph.sources[slot]) for slot in candidates]
+
+    def try_resolve(queue):
+        depends = {}
+        system_depends = set()
+        conflicts = {}
+        touched = set()
+        visited = set()
         while len(queue) > 0:
-            root_depender, depender, name = queue.pop()
-            if name not in depends and name not in conflicts and name not in system_depends:
-                resolver_msgs = []
-                if root_depender is not None and root_depender != depender:
-                    resolver_msgs.append("is needed to resolve dependencies of package @{cf}%s@|" % escape(root_depender))
-                if depender is not None:
-                    resolver_msgs.append("is dependee of package @{cf}%s@|" % escape(depender))
-                if root_depender is None:
-                    root_depender = name
-                candidates = find_package_candidates(name, ws_state, resolver_msgs)
-                for pkg, source in candidates:
-                    if source not in [P_WS, P_REMOTE] and depender is None and force_workspace:
-                        continue  # Ignore other sources if primary depender should be a workspace package
-                    if source == P_REMOTE:
-                        if pkg.project in ws_state.ws_projects:
-                            resolver_msgs.append("missing from @{cf}%s/@| (maybe you need to @{cf}git pull@|?)" % escape(pkg.project.workspace_path))
-                            continue  # Fail, try next
-                        # Check all other packages in the same project for conflicts
-                        ok = True
-                        for other in pkg.project.packages:
-                            # Is the other package in the workspace already?
-                            if other.manifest.name in ws_state.ws_packages:
-                                resolver_msgs.append("cannot be cloned from @{cf}%s@| because package @{cf}%s@| is in the workspace already" % (escape(pkg.project.name), escape(other.manifest.name)))
+            root_depender, depender, node = queue.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            name = names[node]
+            touched.add(name)
+            resolver_msgs = []
+            candidates = find_package_candidates(node)
+            for slot, source in candidates:
+                if source not in [P_WS, P_REMOTE] and depender is None and force_workspace:
+                    continue  # Ignore other sources if primary depender should be a workspace package
+                pkg = graph.packages[slot]
+                if source == P_REMOTE:
+                    if pkg.project in ws_state.ws_projects:
+                        resolver_msgs.append("missing from @{cf}%s/@| (maybe you need to @{cf}git pull@|?)" % escape(pkg.project.workspace_path))
+                        continue  # Fail, try next
+                    # Check all other packages in the same project for conflicts
+                    touched.update(other.manifest.name for other in pkg.project.packages)
+                    # Is any other package in the workspace already?
+                    clash = graph.get_workspace_clash(pkg.project)
+                    if clash is not None:
+                        resolver_msgs.append("cannot be cloned from @{cf}%s@| because package @{cf}%s@| is in the workspace already" % (escape(pkg.project.name), escape(clash)))
+                        continue  # Fail, try next
+                    ok = True
+                    for other in pkg.project.packages:
+                        # If not, check if we already decided to download
+                        # the package from another project
+                        if other.manifest.name in depends:
+                            # Is it the same project?
+                            if other.project != pkg.project:
+                                resolver_msgs.append("cannot be cloned from @{cf}%s@| because it contains package @{cf}%s@| which will be cloned from @{cf}%s@|" % (escape(pkg.project.name), escape(other.manifest.name), escape(other.project.name)))
                                 ok = False
                                 break  # Fail
-                            # If not, check if we already decided to download
-                            # the package from another project
-                            if other.manifest.name in depends:
-                                # Is it the same project?
-                                if other.project != pkg.project:
-                                    resolver_msgs.append("cannot be cloned from @{cf}%s@| because it contains package @{cf}%s@| which will be cloned from @{cf}%s@|" % (escape(pkg.project.name), escape(other.manifest.name), escape(other.project.name)))
-                                    ok = False
-                                    break  # Fail
-                        if not ok:
-                            continue  # Fail, try next
-                    # If we got to this point, the package can be used to resolve the dependency
-                    if source in [P_WS, P_REMOTE]:
-                        depends[name] = pkg
-                        if recursive or depender is None:
-                            recursive_depends = pkg.manifest.buildtool_depends + pkg.manifest.build_depends + pkg.manifest.run_depends + pkg.manifest.test_depends
-                            queue += [(root_depender, name, p.name) for p in recursive_depends]
-                    else:
-                        system_depends.add(name)
-                    break  # Success, do not check more candidates
+                    if not ok:
+                        continue  # Fail, try next
+                # If we got to this point, the package can be used to resolve the dependency
+                if source in [P_WS, P_REMOTE]:
+                    depends[name] = pkg
+                    if recursive or depender is None:
+                        root = root_depender if root_depender is not None else node
+                        queue += [(root, node, d) for d in graph.depends(slot, dep_types)]
                 else:
-                    if not candidates:
-                        resolver_msgs.append("no such package available")
-                    else:
-                        resolver_msgs.append("not in workspace and cannot be cloned from Gitlab")
-                    # No candidate matched, but maybe we got lucky and it's a known system dependency
-                    # However, if it is requested explicitly, we won't use system dependencies
-                    if depender is not None and name in get_rosdep():
-                        system_depends.add(name)
-                    else:
-                        # We cannot resolve this
-                        # If the package is unknown, i.e. does not have any installation candidates,
-                        # we may choose to ignore it, if so instructed
-                        if candidates or not ignore_missing:
-                            conflicts[name] = resolver_msgs
-        return depends, system_depends, conflicts
-    queue = [(None, None, name) for name in packages]
-    depends, system_depends, conflicts = try_resolve(queue)
-    return depends, system_depends, conflicts
+                    system_depends.add(name)
+                break  # Success, do not check more candidates
+            else:
+                if not candidates:
+                    resolver_msgs.append("no such package available")
+                else:
+                    resolver_msgs.append("not in workspace and cannot be cloned from Gitlab")
+                # No candidate matched, but maybe we got lucky and it's a known system dependency
+                # However, if it is requested explicitly, we won't use system dependencies
+                if depender is not None and name in get_rosdep():
+                    system_depends.add(name)
+                else:
+                    # We cannot resolve this
+                    # If the package is unknown, i.e. does not have any installation candidates,
+                    # we may choose to ignore it, if so instructed
+                    if candidates or not ignore_missing:
+                        header = []
+                        if root_depender is not None and root_depender != depender:
+                            header.append("is needed to resolve dependencies of package @{cf}%s@|" % escape(names[root_depender]))
+                        if depender is not None:
+                            header.append("is dependee of package @{cf}%s@|" % escape(names[depender]))
+                        conflicts[name] = header + resolver_msgs
+        return depends, system_depends, conflicts, touched
+    queue = [(None, None, graph.node(name)) for name in packages]
+    return try_resolve(queue)
+
+
+DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+DPKG_CACHE_VERSION = 1
+
+
+def read_dpkg_status(filename):
+    # The status file is a sequence of RFC 822 style stanzas, and dpkg
+    # always writes the Package field before the Status field
+    installed = set()
+    pkg = None
+    with open(filename, "rb") as f:
+        for line in f:
+            if line.startswith(b"Package:"):
+                pkg = line[8:].strip().decode("UTF-8")
+            elif line.startswith(b"Status:"):
+                if pkg and line.rstrip().endswith(b" ok installed"):
+                    installed.add(pkg)
+                pkg = None
+    return installed
+
+
+def get_dpkg_installed_packages():
+    key = (DPKG_CACHE_VERSION, stat_key(DPKG_STATUS_FILE))
+    if key[1] is None:
+        raise IOError("cannot access %s" % DPKG_STATUS_FILE)
+    filename = get_user_cache_file("dpkg-status.cache")
+    installed = load_user_cache(filename, key)
+    if installed is None:
+        installed = read_dpkg_status(DPKG_STATUS_FILE)
+        save_user_cache(filename, key, installed)
+    return installed
 
 
 class SystemPackageManager(object):
@@ -243,6 +503,11 @@ class SystemPackageManager(object):
     def _populate_installed_packages(self):
         self._installed_packages = set()
         if self._system == "Linux":
+            try:
+                self._installed_packages = get_dpkg_installed_packages()
+                return
+            except (IOError, OSError):
+                pass
             try:
                 _, stdout, _ = call_process(["dpkg-query", "-f", "${Package}|${Status}\\n", "-W"], stdout=PIPE, stderr=PIPE)
                 for line in stdout.split("\n"):
@@ -282,31 +547,22 @@ def resolve_system_depends(ws_state, system_depends, missing_only=False):
             error("cannot resolve system dependencies for this system\n")
             _resolve_warn_once = True
         return set()
-    for dep in system_depends:
-        if dep not in ws_state.ros_root_packages:  # This deals with ROS source installs
-            rosdep = get_rosdep()
-            if not rosdep.ok():
-                if not _resolve_warn_once:
-                    error("cannot resolve system dependencies without rosdep\n")
-                    _resolve_warn_once = True
-                return set()
-            try:
-                from rosdep2.lookup import ResolutionError
-            except ImportError:
-                class ResolutionError(Exception):
-                    pass
-            try:
-                installer, resolved_deps = rosdep.resolve(dep)
-                for d in resolved_deps:
-                    if installer == get_system_package_manager().installer:
-                        if hasattr(d, "package"):
-                            resolved.add(d.package)
-                        else:
-                            resolved.add(d)
-                    else:
-                        warning("unsupported installer '%s': ignoring package '%s'\n" % (installer, dep))
-            except ResolutionError:
-                warning("cannot resolve system package: ignoring package '%s'\n" % dep)
+    deps = set(dep for dep in system_depends if dep not in ws_state.ros_root_packages)  # This deals with ROS source installs
+    if deps:
+        rosdep = get_rosdep()
+        if not rosdep.ok():
+            if not _resolve_warn_once:
+                error("cannot resolve system dependencies without rosdep\n")
+                _resolve_warn_once = True
+            return set()
+        rules, unresolved = rosdep.resolve_many(deps)
+        for dep in sorted(unresolved):
+            warning("cannot resolve system package: ignoring package '%s'\n" % dep)
+        for dep, (installer, resolved_deps) in sorted(rules.items()):
+            if installer == get_system_package_manager().installer:
+                resolved.update(resolved_deps)
+            elif resolved_deps:
+                warning("unsupported installer '%s': ignoring package '%s'\n" % (installer, dep))
     if missing_only:
         resolved -= get_system_package_manager().installed_packages
     return resolved
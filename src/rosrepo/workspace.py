@@ -21,10 +21,12 @@
 #
 #
 import os
+import hashlib
 from catkin_pkg.package import parse_package, InvalidPackage, PACKAGE_MANIFEST_FILENAME
 from .config import Config, ConfigError, Version
 from .cache import Cache
-from .gitlab import get_gitlab_projects, find_catkin_packages_from_gitlab_projects, find_cloned_gitlab_projects
+from .gitlab import get_gitlab_projects, find_catkin_packages_from_gitlab_projects, find_cloned_gitlab_projects, url_to_cache_name
+from .resolver import get_rosdep_sources_cache_dir, SYSTEM_PACKAGE_DATABASES
 from .util import path_has_prefix, iteritems, NamedTuple, is_deprecated_package
 from .ui import msg, warning, fatal, escape
 try:
@@ -41,7 +43,14 @@ class Package(NamedTuple):
 
 
 class WorkspaceState(NamedTuple):
-    __slots__ = ("ws_packages", "remote_packages", "ros_root_packages", "ws_projects", "remote_projects", "other_git")
+    __slots__ = ("ws_packages", "remote_packages", "ros_root_packages", "ws_projects", "remote_projects", "other_git", "dependency_graph", "resolution_cache")
+
+    def __setattr__(self, name, value):
+        NamedTuple.__setattr__(self, name, value)
+        if name not in ["dependency_graph", "resolution_cache"]:
+            # The dependency graph is rebuilt on demand after any change,
+            # the resolution cache checks for itself what is still valid
+            NamedTuple.__setattr__(self, "dependency_graph", None)
 
 
 def is_ros_root(path):
@@ -140,11 +149,7 @@ def find_workspace(override=None):
     return None
 
 
-def find_catkin_packages(srcdir, subdir=None, cache=None, cache_id="workspace_packages"):
-    cached_paths = {}
-    cache_update = False
-    if cache is not None:
-        cached_paths = cache.get_object(cache_id, WORKSPACE_PACKAGE_CACHE_VERSION, cached_paths)
+def find_package_paths(srcdir, subdir=None):
     package_paths = []
     base_path = srcdir if subdir is None else os.path.join(srcdir, subdir)
     for curdir, subdirs, files in os_walk(base_path, followlinks=True):
@@ -156,6 +161,15 @@ def find_catkin_packages(srcdir, subdir=None, cache=None, cache_id="workspace_pa
             del subdirs[:]
             continue
         subdirs = [d for d in subdirs if not d.startswith(".")]
+    return package_paths
+
+
+def find_catkin_packages(srcdir, subdir=None, cache=None, cache_id="workspace_packages"):
+    cached_paths = {}
+    cache_update = False
+    if cache is not None:
+        cached_paths = cache.get_object(cache_id, WORKSPACE_PACKAGE_CACHE_VERSION, cached_paths)
+    package_paths = find_package_paths(srcdir, subdir)
     result = {}
     discovered_paths = {}
     for path in package_paths:
@@ -186,6 +200,61 @@ def find_catkin_packages(srcdir, subdir=None, cache=None, cache_id="workspace_pa
     return result
 
 
+def get_workspace_fingerprint(wsdir, config, cache, ros_rootdir, *extra):
+    # Summary of everything package resolution depends on. Like the
+    # workspace package cache, it relies on file timestamps and sizes
+    # instead of hashing file contents
+    def stat(path):
+        try:
+            st = os.stat(path)
+            return (path, st.st_mtime, st.st_size)
+        except OSError:
+            return (path, None, None)
+    srcdir = os.path.join(wsdir, "src")
+    result = [stat(os.path.join(srcdir, path, PACKAGE_MANIFEST_FILENAME)) for path in sorted(find_package_paths(srcdir))]
+    if ros_rootdir is not None:
+        # New packages show up in the share directory, and changes to the
+        # known ones are found the same way the ROS root package cache does
+        result.append(stat(os.path.join(ros_rootdir, "share")))
+        ros_root_paths = cache.get_object("ros_root_packages", WORKSPACE_PACKAGE_CACHE_VERSION, {})
+        result += [stat(os.path.join(ros_rootdir, path, PACKAGE_MANIFEST_FILENAME)) for path in sorted(ros_root_paths)]
+    else:
+        result.append(None)
+    for gitlab_cfg in config.get("gitlab_servers", []):
+        label, url = gitlab_cfg.get("label", None), gitlab_cfg.get("url", None)
+        if url is not None:
+            result.append(stat(os.path.join(cache.cache_dir, url_to_cache_name(label, url))))
+    result.append(stat(os.path.join(get_rosdep_sources_cache_dir(), "index")))
+    result.append(os.environ.get("ROS_DISTRO", None))
+    result += [stat(path) for path in SYSTEM_PACKAGE_DATABASES]
+    result += extra
+    return hashlib.sha1(repr(result).encode("UTF-8")).hexdigest()
+
+
+def get_build_durations(wsdir):
+    # catkin_tools keeps one log file per build stage of each package in
+    # logs/<package>/build.<stage>.log, and each file is written when its
+    # stage is done. The time between the first and the last stage is a
+    # good estimate how long the package took to build the last time.
+    durations = {}
+    logdir = os.path.join(wsdir, "logs")
+    try:
+        pkg_names = os.listdir(logdir)
+    except OSError:
+        return durations
+    for name in pkg_names:
+        try:
+            mtimes = [
+                os.path.getmtime(os.path.join(logdir, name, filename)) for filename in os.listdir(os.path.join(logdir, name))
+                if filename.startswith("build.") and filename.endswith(".log") and filename.count(".") == 2
+            ]
+        except OSError:
+            continue
+        if len(mtimes) > 1:
+            durations[name] = max(mtimes) - min(mtimes)
+    return durations
+
+
 def get_workspace_location(override):
     from . import __version__
     wsdir = find_workspace(override)
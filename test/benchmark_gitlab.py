@@ -0,0 +1,107 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+#
+# Benchmark for the Gitlab crawler against the local stand-in server.
+# Run it from the source tree with
+#
+#     PYTHONPATH=src:. python test/benchmark_gitlab.py --projects 200 --latency 0.01
+#
+# Use --engine threads asyncio to compare the crawler engines.
+#
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+from tempfile import mkdtemp
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+import resource
+
+import rosrepo.gitlab as gl
+from rosrepo.cache import Cache
+from test.gitlab_server import FakeGitlabServer, make_fixture, PRIVATE_TOKEN
+
+
+def measure(server, wsdir, crawl_depth, engine, **kwargs):
+    # Go through the same entry point as the rosrepo commands, so the
+    # default connection limit of each engine applies
+    config = {"gitlab_servers": [{"label": "bench", "url": server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": crawl_depth}], "gitlab_engine": engine}
+    gl._updated_urls.clear()
+    server.reset_requests()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    projects = gl.get_gitlab_projects(wsdir, config, cache=Cache(wsdir), verbose=False, **kwargs)
+    elapsed = time.time() - start
+    if tracemalloc is not None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    packages = sum(len(p.packages) for p in projects)
+    return server.request_count(), elapsed, peak, len(projects), packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the Gitlab crawler with a local stand-in server")
+    parser.add_argument("--projects", type=int, default=100, help="number of projects")
+    parser.add_argument("--packages", type=int, default=3, help="packages per project")
+    parser.add_argument("--depth", type=int, default=2, help="directory depth of the packages")
+    parser.add_argument("--noise", type=int, default=5, help="unrelated files per directory")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated latency per request in seconds")
+    parser.add_argument("--touch", type=int, default=5, help="projects to change for the incremental refresh")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the incremental changes")
+    parser.add_argument("--engine", nargs="+", choices=["threads", "asyncio"], default=["threads"], help="crawler engines to compare")
+    args = parser.parse_args()
+    results = []
+    for engine in args.engine:
+        random.seed(args.seed)
+        wsdir = mkdtemp()
+        server = FakeGitlabServer(make_fixture(projects=args.projects, packages=args.packages, depth=args.depth, noise=args.noise), latency=args.latency).start()
+        devnull = open(os.devnull, "w")
+        stdout, sys.stdout = sys.stdout, devnull
+        stderr, sys.stderr = sys.stderr, devnull
+        try:
+            results.append((engine, "cold") + measure(server, wsdir, args.depth, engine=engine))
+            results.append((engine, "warm") + measure(server, wsdir, args.depth, engine=engine))
+            for project in random.sample(server.projects, min(args.touch, len(server.projects))):
+                server.touch(project.id, "README.md")
+            results.append((engine, "incremental") + measure(server, wsdir, args.depth, engine=engine))
+            results.append((engine, "forced") + measure(server, wsdir, args.depth, force_update=True, engine=engine))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            devnull.close()
+            server.stop()
+            shutil.rmtree(wsdir, ignore_errors=True)
+    sys.stdout.write("%-8s %-12s %10s %10s %12s %10s %10s\n" % ("engine", "refresh", "requests", "time [s]", "memory [kB]", "projects", "packages"))
+    for engine, name, requests, elapsed, peak, projects, packages in results:
+        sys.stdout.write("%-8s %-12s %10d %10.3f %12d %10d %10d\n" % (engine, name, requests, elapsed, peak // 1024, projects, packages))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+import json
+import hashlib
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+try:
+    from urlparse import urlsplit, parse_qs
+    from urllib import unquote, urlencode
+except ImportError:
+    from urllib.parse import urlsplit, parse_qs, unquote, urlencode
+
+
+PRIVATE_TOKEN = "secret"
+
+
+def git_hash(kind, data):
+    if not isinstance(data, bytes):
+        data = data.encode("UTF-8")
+    return hashlib.sha1(("%s %d\0" % (kind, len(data))).encode("UTF-8") + data).hexdigest()
+
+
+def package_xml(name, depends=[]):
+    return (
+        '<package format="2"><name>%s</name><version>1.0.0</version>'
+        '<description>Fake package</description>'
+        '<maintainer email="fake@example.com">Mister Fake</maintainer>'
+        '<license>none</license>%s</package>\n'
+        % (name, "".join("<depend>%s</depend>" % d for d in depends))
+    )
+
+
+class FakeProject(object):
+
+    def __init__(self, id, namespace, name, files, last_activity_at, topics=[], archived=False, member=True):
+        self.id = id
+        self.namespace = namespace
+        self.name = name
+        self.files = files
+        self.last_activity_at = last_activity_at
+        self.topics = list(topics)
+        self.archived = archived
+        self.member = member
+        self._trees = None
+
+    def as_json(self, base_url):
+        path = "%s/%s" % (self.namespace, self.name)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "name_with_namespace": "%s / %s" % (self.namespace, self.name),
+            "path_with_namespace": path,
+            "web_url": "%s/%s" % (base_url, path),
+            "ssh_url_to_repo": "git@fake:%s.git" % path,
+            "http_url_to_repo": "%s/%s.git" % (base_url, path),
+            "default_branch": "master",
+            "last_activity_at": self.last_activity_at.isoformat() + "Z",
+            "topics": self.topics,
+            "archived": self.archived,
+        }
+
+    def trees(self):
+        # Build the directory listings with Git-like content-addressed ids
+        if self._trees is not None:
+            return self._trees
+        dirs = {"": {}}
+        for path, content in self.files.items():
+            parts = path.split("/")
+            for i in range(len(parts) - 1):
+                parent = "/".join(parts[:i])
+                sub = "/".join(parts[:i + 1])
+                dirs.setdefault(sub, {})
+                dirs[parent][parts[i]] = ("tree", sub)
+            dirs["/".join(parts[:-1])][parts[-1]] = ("blob", git_hash("blob", content))
+        trees = {}
+
+        def build(path):
+            entries = []
+            for name in sorted(dirs[path]):
+                kind, ref = dirs[path][name]
+                if kind == "tree":
+                    build(ref)
+                    ref = trees[ref][0]
+                entries.append({"id": ref, "name": name, "type": kind, "path": "%s/%s" % (path, name) if path else name, "mode": "040000" if kind == "tree" else "100644"})
+            tree_id = git_hash("tree", json.dumps(entries, sort_keys=True))
+            trees[path] = (tree_id, entries)
+        build("")
+        self._trees = trees
+        return trees
+
+    def commit(self):
+        return git_hash("commit", "tree %s\n" % self.trees()[""][0])
+
+    def blobs(self):
+        return dict((git_hash("blob", content), content) for content in self.files.values())
+
+    def touch(self, path, content, when):
+        self.files[path] = content
+        self.last_activity_at = when
+        self._trees = None
+
+
+def make_fixture(projects=10, packages=2, depth=1, noise=3, namespace="group", start_id=1):
+    """Create fake projects with package manifests hidden at the given directory depth"""
+    result = []
+    now = datetime(2020, 1, 1)
+    for p in range(projects):
+        files = {"README.md": "Project %d\n" % p}
+        for k in range(packages):
+            prefix = "/".join(["dir%d" % d for d in range(depth - 1)] + ["pkg%d_%d" % (p, k)]) if depth > 0 else ""
+            name = "pkg%d_%d" % (p, k)
+            if depth == 0:
+                files["package.xml"] = package_xml(name)
+                break
+            files["%s/package.xml" % prefix] = package_xml(name)
+            files["%s/CMakeLists.txt" % prefix] = "project(%s)\n" % name
+            for n in range(noise):
+                files["%s/src/file%d.cpp" % (prefix, n)] = "// %s\n" % n
+        for n in range(noise):
+            files["doc/page%d.md" % n] = "Page %d\n" % n
+        result.append(FakeProject(start_id + p, namespace, "project%d" % p, files, now - timedelta(minutes=p)))
+    return result
+
+
+class FakeGitlabRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, headers={}):
+        body = json.dumps(data).encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_status(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def paginate(self, items, query, path):
+        server = self.server.gitlab
+        per_page = int(query.get("per_page", ["20"])[0])
+        params = dict((k, v[0]) for k, v in query.items() if k not in ["page", "cursor"])
+        if query.get("pagination", [None])[0] == "keyset":
+            # Opaque cursor and Link header only, like the real thing
+            start = int(query.get("cursor", ["0"])[0])
+            headers = {}
+            if start + per_page < len(items):
+                headers["Link"] = '<%s%s?%s>; rel="next"' % (server.url, path, urlencode(sorted(dict(params, cursor=start + per_page).items())))
+            return items[start:start + per_page], headers
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        headers = {"X-Page": str(page), "X-Per-Page": str(per_page)}
+        if len(items) <= server.total_limit:
+            headers["X-Total"] = str(len(items))
+            headers["X-Total-Pages"] = str(total_pages)
+        if page < total_pages:
+            headers["X-Next-Page"] = str(page + 1)
+            headers["Link"] = '<%s%s?%s>; rel="next"' % (server.url, path, urlencode(sorted(dict(params, page=page + 1).items())))
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    def filter_projects(self, projects, query):
+        if query.get("membership", [None])[0] == "true":
+            projects = [p for p in projects if p.member]
+        if query.get("archived", [None])[0] == "false":
+            projects = [p for p in projects if not p.archived]
+        if "topic" in query:
+            topics = query["topic"][0].split(",")
+            projects = [p for p in projects if all(t in p.topics for t in topics)]
+        return projects
+
+    def do_HEAD(self):
+        server = self.server.gitlab
+        server.count_request("HEAD " + self.path)
+        if self.headers.get("PRIVATE-TOKEN") != PRIVATE_TOKEN:
+            self.send_status(401)
+            return
+        parts = urlsplit(self.path)
+        m = re.match(r"^/api/v4/projects/(\d+)/repository/files/([^/]+)$", parts.path)
+        with server.lock:
+            project = next((p for p in server.projects if m and p.id == int(m.group(1))), None)
+        if project is None or project.id in server.failing:
+            self.send_status(404 if project is None else 500)
+            return
+        filename = unquote(m.group(2))
+        if filename not in project.files:
+            self.send_status(404)
+            return
+        self.send_response(200)
+        self.send_header("X-Gitlab-Blob-Id", git_hash("blob", project.files[filename]))
+        self.send_header("X-Gitlab-Commit-Id", project.commit())
+        self.send_header("X-Gitlab-File-Path", filename)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server.gitlab
+        server.count_request(self.path)
+        tree = "/repository/tree" in self.path
+        if tree:
+            server.enter_tree()
+        try:
+            self.handle_get(server)
+        finally:
+            if tree:
+                server.leave_tree()
+
+    def handle_get(self, server):
+        if server.latency:
+            time.sleep(server.latency)
+        if self.headers.get("PRIVATE-TOKEN") != PRIVATE_TOKEN:
+            self.send_status(401)
+            return
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        path = parts.path.rstrip("/")
+        with server.lock:
+            projects = list(server.projects)
+        m = re.match(r"^/api/v4/groups/([^/]+)/projects$", path)
+        if m:
+            group = unquote(m.group(1))
+            subgroups = query.get("include_subgroups", [None])[0] == "true"
+            projects = [p for p in projects if p.namespace == group or (subgroups and p.namespace.startswith(group + "/"))]
+            path = "/api/v4/projects"
+        if path == "/api/v4/projects":
+            projects = self.filter_projects(projects, query)
+            if query.get("order_by", [None])[0] == "last_activity_at":
+                projects.sort(key=lambda p: p.last_activity_at, reverse=query.get("sort", ["desc"])[0] == "desc")
+            else:
+                projects.sort(key=lambda p: p.id, reverse=query.get("sort", ["desc"])[0] == "desc")
+            items, headers = self.paginate([p.as_json(server.url) for p in projects], query, parts.path.rstrip("/"))
+            self.send_json(items, headers)
+            return
+        m = re.match(r"^/api/v4/projects/(\d+)$", path)
+        if m:
+            project = next((p for p in projects if p.id == int(m.group(1))), None)
+            if project is None:
+                self.send_status(404)
+                return
+            self.send_json(project.as_json(server.url))
+            return
+        m = re.match(r"^/api/v4/projects/(\d+)/repository/(tree|blobs/([0-9a-f]+)/raw)$", path)
+        if m:
+            project = next((p for p in projects if p.id == int(m.group(1))), None)
+            if project is None:
+                self.send_status(404)
+                return
+            if project.id in server.failing:
+                self.send_status(500)
+                return
+            if m.group(2) == "tree":
+                trees = project.trees()
+                tree_path = query.get("path", [""])[0]
+                if tree_path not in trees:
+                    self.send_status(404)
+                    return
+                items, headers = self.paginate(trees[tree_path][1], query, path)
+                self.send_json(items, headers)
+                return
+            blobs = project.blobs()
+            if m.group(3) not in blobs:
+                self.send_status(404)
+                return
+            body = blobs[m.group(3)].encode("UTF-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_status(404)
+
+
+def push_hook_payload(project, base_url):
+    """Canned payload of a Gitlab push webhook"""
+    return {
+        "object_kind": "push",
+        "event_name": "push",
+        "ref": "refs/heads/master",
+        "project_id": project.id,
+        "project": project.as_json(base_url),
+        "commits": [],
+        "total_commits_count": 1,
+    }
+
+
+def system_hook_payload(event_name, project):
+    """Canned payload of a Gitlab project system hook"""
+    return {
+        "event_name": event_name,
+        "name": project.name,
+        "path": project.name,
+        "path_with_namespace": "%s/%s" % (project.namespace, project.name),
+        "project_id": project.id,
+        "project_visibility": "internal",
+    }
+
+
+def post_webhook(hook_url, payload, event="Push Hook", instance=None, token=None):
+    import requests
+    headers = {"X-Gitlab-Event": event}
+    if instance is not None:
+        headers["X-Gitlab-Instance"] = instance
+    if token is not None:
+        headers["X-Gitlab-Token"] = token
+    return requests.post(hook_url, data=json.dumps(payload), headers=headers).status_code
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGitlabServer(object):
+    """Minimal stand-in for the Gitlab v4 API with request accounting"""
+
+    def __init__(self, projects=[], latency=0):
+        self.projects = list(projects)
+        self.latency = latency
+        self.failing = set()
+        self.total_limit = 10000
+        self.tree_requests = 0
+        self.max_tree_requests = 0
+        self.lock = threading.Lock()
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitlabRequestHandler)
+        self.httpd.gitlab = self
+        self.url = "http://127.0.0.1:%d" % self.httpd.server_address[1]
+        self.thread = None
+
+    def count_request(self, path):
+        with self.lock:
+            self.requests.append(path)
+
+    def reset_requests(self):
+        with self.lock:
+            self.requests = []
+            self.max_tree_requests = 0
+
+    def enter_tree(self):
+        with self.lock:
+            self.tree_requests += 1
+            self.max_tree_requests = max(self.max_tree_requests, self.tree_requests)
+
+    def leave_tree(self):
+        with self.lock:
+            self.tree_requests -= 1
+
+    def request_count(self, pattern=None):
+        with self.lock:
+            return len([r for r in self.requests if pattern is None or re.search(pattern, r)])
+
+    def touch(self, project_id, path, content=None):
+        with self.lock:
+            project = next(p for p in self.projects if p.id == project_id)
+            latest = max(p.last_activity_at for p in self.projects)
+            project.touch(path, content if content is not None else "%s\n" % latest.isoformat(), latest + timedelta(minutes=1))
+
+    def bump(self, project_id):
+        """Simulate project activity without a push to the default branch"""
+        with self.lock:
+            project = next(p for p in self.projects if p.id == project_id)
+            project.last_activity_at = max(p.last_activity_at for p in self.projects) + timedelta(minutes=1)
+
+    def remove(self, project_id):
+        with self.lock:
+            self.projects = [p for p in self.projects if p.id != project_id]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
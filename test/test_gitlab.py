@@ -0,0 +1,512 @@
+# coding=utf-8
+#
+# ROSREPO
+# Manage ROS workspaces with multiple Gitlab repositories
+#
+# Author: Timo Röhling
+#
+# Copyright 2016 Fraunhofer FKIE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+import unittest
+
+import sys
+sys.stderr = sys.stdout
+import os
+import pickle
+import shutil
+import threading
+import time
+from tempfile import mkdtemp
+try:
+    from mock import patch
+except ImportError:
+    from unittest.mock import patch
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+from catkin_pkg.package import parse_package_string, InvalidPackage
+
+import rosrepo.gitlab as gl
+from rosrepo.cache import Cache
+from rosrepo.util import is_deprecated_package
+from rosrepo.cmd_gitlab_hook import GitlabHookServer
+from test.gitlab_server import FakeGitlabServer, make_fixture, package_xml, PRIVATE_TOKEN, \
+    post_webhook, push_hook_payload, system_hook_payload
+
+
+class CountingBudget(gl.ConnectionBudget):
+
+    def __init__(self, limit):
+        gl.ConnectionBudget.__init__(self, limit)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.peak = 0
+
+    def count(self, delta):
+        with self.lock:
+            self.in_use += delta
+            self.peak = max(self.peak, self.in_use)
+
+    def __enter__(self):
+        gl.ConnectionBudget.__enter__(self)
+        self.count(1)
+        return self
+
+    def __exit__(self, *args):
+        self.count(-1)
+        gl.ConnectionBudget.__exit__(self, *args)
+
+    def try_acquire(self):
+        if not gl.ConnectionBudget.try_acquire(self):
+            return False
+        self.count(1)
+        return True
+
+    def release(self):
+        self.count(-1)
+        gl.ConnectionBudget.release(self)
+
+
+class GitlabTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wsdir = mkdtemp()
+        self.server = FakeGitlabServer(make_fixture(projects=4, packages=2, depth=2)).start()
+        self.updated_urls = patch("rosrepo.gitlab._updated_urls", set())
+        self.updated_urls.start()
+
+    def tearDown(self):
+        self.updated_urls.stop()
+        self.server.stop()
+        shutil.rmtree(self.wsdir, ignore_errors=True)
+
+    def refresh(self, server=None, **kwargs):
+        gl._updated_urls.clear()
+        server = server or self.server
+        server.reset_requests()
+        kwargs.setdefault("crawl_depth", 2)
+        return gl.find_available_gitlab_projects("fake", server.url + "/", private_token=PRIVATE_TOKEN, cache=Cache(self.wsdir), verbose=False, **kwargs)
+
+    def test_crawl(self):
+        """Test Gitlab project crawler"""
+        projects = self.refresh()
+        self.assertEqual(sorted(p.id for p in projects), [1, 2, 3, 4])
+        names = sorted(pkg.manifest.name for p in projects for pkg in p.packages)
+        self.assertEqual(names, sorted("pkg%d_%d" % (p, k) for p in range(4) for k in range(2)))
+        project = next(p for p in projects if p.id == 1)
+        pkg = next(pkg for pkg in project.packages if pkg.manifest.name == "pkg0_0")
+        self.assertEqual(pkg.project_path, "dir0/pkg0_0")
+        self.assertIs(pkg.project, project)
+        # Too shallow for the packages
+        projects = self.refresh(crawl_depth=1, force_update=True)
+        self.assertEqual([pkg for p in projects for pkg in p.packages], [])
+
+    def test_incremental_refresh(self):
+        """Test incremental updates of the Gitlab project cache"""
+        self.refresh()
+        cold = self.server.request_count()
+        projects = self.refresh()
+        self.assertEqual(self.server.request_count(), 1)
+        self.assertEqual(len(projects), 4)
+        # Changing a file outside the package directories costs one tree listing
+        self.server.touch(2, "README.md")
+        projects = self.refresh()
+        self.assertEqual(self.server.request_count("/repository/tree"), 1)
+        self.assertEqual(self.server.request_count("/blobs/"), 0)
+        self.assertLess(self.server.request_count(), cold)
+        self.assertEqual(len([pkg for p in projects for pkg in p.packages]), 8)
+        # Changing a manifest downloads exactly that manifest
+        self.server.touch(3, "dir0/pkg2_1/package.xml", package_xml("renamed"))
+        projects = self.refresh()
+        self.assertEqual(self.server.request_count("/blobs/"), 1)
+        names = set(pkg.manifest.name for p in projects for pkg in p.packages)
+        self.assertIn("renamed", names)
+        self.assertNotIn("pkg2_1", names)
+        # Activity elsewhere costs one probe of a known package manifest,
+        # once the branch commit has been recorded by an earlier probe
+        self.server.bump(1)
+        self.refresh()
+        self.server.bump(1)
+        projects = self.refresh()
+        self.assertEqual(self.server.request_count("/projects/1/"), 1)
+        self.assertEqual(self.server.request_count("HEAD /api/v4/projects/1/repository/files/dir0%2Fpkg0_"), 1)
+        self.assertEqual(len([pkg for p in projects for pkg in p.packages]), 8)
+        # A push after the probe falls back to the tree crawl
+        self.server.touch(1, "dir0/pkg0_0/src/new.cpp", "// new\n")
+        self.refresh()
+        self.assertEqual(self.server.request_count("/projects/1/repository/tree"), 3)
+        self.server.bump(1)
+        self.refresh()
+        self.assertEqual(self.server.request_count("/projects/1/"), 1)
+
+    def test_wide_project(self):
+        """Test parallel crawling of the directories of a single project"""
+        wide_server = FakeGitlabServer(make_fixture(projects=1, packages=12, depth=1, noise=0), latency=0.1).start()
+        try:
+            projects = self.refresh(server=wide_server, crawl_depth=1)
+            self.assertEqual(len(projects[0].packages), 12)
+            self.assertEqual([pkg.manifest.name for pkg in projects[0].packages], ["pkg0_%d" % k for k in [0, 1, 10, 11, 2, 3, 4, 5, 6, 7, 8, 9]])
+            self.assertGreater(wide_server.max_tree_requests, 1)
+            self.assertLessEqual(wide_server.max_tree_requests, gl.GITLAB_TREE_CONCURRENCY)
+            # Every directory is listed exactly once, on a single page
+            self.assertEqual(wide_server.request_count("/repository/tree"), 13)
+            self.assertEqual(wide_server.request_count("/repository/tree.*cursor="), 0)
+        finally:
+            wide_server.stop()
+
+    @unittest.skipIf(sys.version_info[:2] < (3, 5), "asyncio engine requires Python 3.5")
+    def test_async_engine(self):
+        """Test the asyncio engine of the Gitlab crawler"""
+        expected = sorted("pkg%d_%d" % (p, k) for p in range(4) for k in range(2))
+        projects = self.refresh(engine="asyncio")
+        self.assertEqual([p.id for p in projects], [4, 3, 2, 1])
+        self.assertEqual(sorted(pkg.manifest.name for p in projects for pkg in p.packages), expected)
+        project = next(p for p in projects if p.id == 1)
+        self.assertTrue(all(pkg.project is project for pkg in project.packages))
+        # Incremental updates work the same as with threads
+        self.server.touch(3, "dir0/pkg2_1/package.xml", package_xml("renamed"))
+        projects = self.refresh(engine="asyncio")
+        self.assertEqual(self.server.request_count("/blobs/"), 1)
+        self.assertIn("renamed", [pkg.manifest.name for p in projects for pkg in p.packages])
+        # Failed projects are reported and retried
+        self.server.failing = set([2])
+        projects = self.refresh(engine="asyncio", force_update=True)
+        self.assertEqual(len(projects), 4)
+        server_cache = Cache(self.wsdir).get_object(gl.url_to_cache_name("fake", self.server.url + "/"), gl.GITLAB_PACKAGE_CACHE_VERSION)
+        self.assertEqual(list(server_cache.failures.keys()), [2])
+        # The connection budget applies to the event loop as well
+        self.server.failing = set()
+        budget = CountingBudget(2)
+        projects = self.refresh(engine="asyncio", force_update=True, connection_budget=budget)
+        self.assertEqual(len(projects), 4)
+        self.assertEqual(budget.peak, 2)
+        self.assertEqual(budget.in_use, 0)
+
+    def test_shared_manifests(self):
+        """Test manifest reuse across forks and servers"""
+        self.refresh()
+        fork_server = FakeGitlabServer(make_fixture(projects=4, packages=2, depth=2, namespace="fork")).start()
+        try:
+            manifest_cache = gl.ManifestBlobCache()
+            manifest_cache.add_projects(self.refresh())
+            projects = self.refresh(server=fork_server, manifest_cache=manifest_cache)
+            self.assertEqual(len([pkg for p in projects for pkg in p.packages]), 8)
+            self.assertEqual(fork_server.request_count("/blobs/"), 0)
+            self.assertEqual(manifest_cache.reused, 8)
+        finally:
+            fork_server.stop()
+
+    def test_lazy_manifest(self):
+        """Test lazy parsing of remote package manifests"""
+        xml = package_xml("lazy", depends=["roscpp", "std_msgs"]).replace("</package>", "<test_depend>gtest</test_depend><export><metapackage/></export></package>")
+        manifest = gl.LazyManifest.from_xml(xml, "package.xml")
+        package = parse_package_string(xml)
+        for dep_type in ["buildtool_depends", "build_depends", "run_depends", "test_depends"]:
+            self.assertEqual(sorted(d.name for d in getattr(manifest, dep_type)), sorted(set(d.name for d in getattr(package, dep_type))))
+        self.assertTrue(manifest.is_metapackage())
+        # The package from validation is not parsed again
+        self.assertIsNotNone(manifest._package)
+        with patch("rosrepo.gitlab.parse_package_string") as parse:
+            self.assertEqual(manifest.maintainers[0].name, "Mister Fake")
+            self.assertFalse(parse.called)
+        manifest = pickle.loads(pickle.dumps(manifest, pickle.HIGHEST_PROTOCOL))
+        self.assertIsNone(manifest._package)
+        self.assertEqual(manifest.maintainers[0].name, "Mister Fake")
+        self.assertIsNotNone(manifest._package)
+        self.assertRaises(InvalidPackage, gl.LazyManifest.from_xml, "<package/>", "package.xml")
+        self.refresh()
+        projects = self.refresh()
+        pkg = projects[0].packages[0]
+        self.assertIsNone(pkg.manifest._package)
+        self.assertEqual(pkg.manifest.version, "1.0.0")
+        self.assertEqual(pkg.manifest.exports, [])
+        self.assertEqual(parse_package_string(pkg.manifest_xml).name, pkg.manifest.name)
+
+    def test_invalid_manifest(self):
+        """Test that invalid remote manifests are rejected at refresh"""
+        xml = '<package format="2"><name>broken</name><version>1.0</version><description>Broken</description></package>'
+        self.assertRaises(InvalidPackage, gl.LazyManifest.from_xml, xml, "package.xml")
+        self.refresh()
+        self.server.touch(1, "broken/package.xml", xml)
+        projects = self.refresh()
+        names = [pkg.manifest.name for p in projects for pkg in p.packages]
+        self.assertNotIn("broken", names)
+        self.assertEqual(len(names), 8)
+        for p in projects:
+            for pkg in p.packages:
+                self.assertFalse(is_deprecated_package(pkg.manifest))
+
+    def test_multiple_servers(self):
+        """Test concurrent update of multiple Gitlab servers"""
+        other_server = FakeGitlabServer(make_fixture(projects=3, packages=1, depth=1, start_id=10), latency=0.05).start()
+        try:
+            config = {"gitlab_servers": [
+                {"label": "slow", "url": other_server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": 1},
+                {"label": "fast", "url": self.server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": 2},
+            ], "gitlab_connection_limit": 2}
+            projects = gl.get_gitlab_projects(self.wsdir, config, cache=Cache(self.wsdir), verbose=False)
+            self.assertEqual([p.id for p in projects], [12, 11, 10, 4, 3, 2, 1])
+            packages = gl.find_catkin_packages_from_gitlab_projects(projects)
+            self.assertEqual(len(packages), 8)
+            self.assertEqual([pkg.project.id for pkg in packages["pkg0_0"]], [10, 1])
+        finally:
+            other_server.stop()
+
+    def test_server_failure(self):
+        """Test fallback to the cache if the Gitlab server fails"""
+        projects = self.refresh()
+        projects = gl.find_available_gitlab_projects("fake", self.server.url + "/", private_token="wrong", cache=Cache(self.wsdir), verbose=False)
+        self.assertEqual(len(projects), 4)
+
+    def test_pagination(self):
+        """Test keyset and offset pagination without page counts"""
+        self.server.projects += make_fixture(projects=3, packages=1, depth=1, namespace="ros", start_id=10)
+        self.server.total_limit = 0
+        with patch("rosrepo.gitlab.GITLAB_PAGE_SIZE", 2):
+            projects = self.refresh()
+            self.assertEqual([p.id for p in projects], [12, 11, 10, 4, 3, 2, 1])
+            self.assertEqual(self.server.request_count(r"^/api/v4/projects/?\?.*pagination=keyset"), 4)
+            # Group listings use offset pagination with Link headers
+            projects = self.refresh(project_filter={"groups": ["ros"]})
+            self.assertEqual([p.id for p in projects], [12, 11, 10])
+            self.assertEqual(self.server.request_count("/groups/ros/projects.*page="), 1 + 2)
+
+    def test_project_filter(self):
+        """Test filtering of Gitlab projects before crawling"""
+        self.server.projects += make_fixture(projects=3, packages=1, depth=1, namespace="ros/drivers", start_id=10)
+        self.server.projects += make_fixture(projects=2, packages=1, depth=1, namespace="ros/sandbox", start_id=20)
+        self.server.projects[1].archived = True
+        self.server.projects[2].member = False
+        self.server.projects[3].topics = ["ros"]
+        self.server.projects[4].topics = ["ros", "driver"]
+        projects = self.refresh(project_filter={"groups": ["ros"], "exclude_groups": ["ros/sandbox"]})
+        self.assertEqual([p.id for p in projects], [12, 11, 10])
+        self.assertEqual(self.server.request_count("/projects/2[0-9]/"), 0)
+        projects = self.refresh(project_filter={"exclude_archived": True, "membership": True})
+        self.assertEqual(sorted(p.id for p in projects), [1, 4, 10, 11, 12, 20, 21])
+        self.assertEqual(self.server.request_count("/projects/[23]/"), 0)
+        projects = self.refresh(project_filter={"topics": ["ros", "driver"]})
+        self.assertEqual([p.id for p in projects], [10])
+        # Without a filter, everything is back
+        projects = self.refresh()
+        self.assertEqual(len(projects), 9)
+
+    def test_index(self):
+        """Test export and import of Gitlab project indexes"""
+        self.refresh()
+        index = os.path.join(self.wsdir, "gitlab.idx")
+        config = {"gitlab_servers": [{"label": "fake", "url": self.server.url + "/"}]}
+        servers = gl.export_gitlab_index(index, config, Cache(self.wsdir))
+        self.assertEqual(len(servers), 1)
+        with open(index, "rb") as f:
+            self.assertTrue(f.read().startswith(gl.GITLAB_INDEX_MAGIC))
+        # Loading the index does not parse any manifest
+        with patch("rosrepo.gitlab.parse_package_string") as parse:
+            (_, _, server_cache), = gl.read_gitlab_index(index)
+            self.assertFalse(parse.called)
+        cached = Cache(self.wsdir).get_object(gl.url_to_cache_name("fake", self.server.url + "/"), gl.GITLAB_PACKAGE_CACHE_VERSION)
+        for p, q in zip(server_cache.projects, cached.projects):
+            for pkg, cached_pkg in zip(p.packages, q.packages):
+                self.assertEqual((pkg.manifest.name, pkg.manifest.version, pkg.manifest.depends), (cached_pkg.manifest.name, cached_pkg.manifest.version, cached_pkg.manifest.depends))
+                self.assertEqual(pkg.manifest_xml, cached_pkg.manifest_xml)
+        wsdir = mkdtemp()
+        try:
+            with patch("rosrepo.gitlab._seed_indexes", {}):
+                projects = gl.find_available_gitlab_projects("fake", self.server.url + "/", cache=Cache(wsdir), cache_only=True, seed_index=index, verbose=False)
+                self.assertEqual([p.id for p in projects], [4, 3, 2, 1])
+                names = sorted(pkg.manifest.name for p in projects for pkg in p.packages)
+                self.assertEqual(names, sorted("pkg%d_%d" % (p, k) for p in range(4) for k in range(2)))
+                # The seeded cache is up to date, so the server is only probed
+                self.server.reset_requests()
+                gl._updated_urls.clear()
+                projects = gl.find_available_gitlab_projects("fake", self.server.url + "/", private_token=PRIVATE_TOKEN, cache=Cache(wsdir), crawl_depth=2, verbose=False)
+                self.assertEqual(len(projects), 4)
+                self.assertEqual(self.server.request_count(), 1)
+        finally:
+            shutil.rmtree(wsdir, ignore_errors=True)
+        with open(index, "wb") as f:
+            f.write(b"garbage")
+        self.assertRaises(ValueError, gl.read_gitlab_index, index)
+
+    def test_partial_failure(self):
+        """Test resumption of interrupted Gitlab updates"""
+        self.server.failing = set([2])
+        projects = self.refresh()
+        self.assertEqual([p.id for p in projects], [4, 3, 1])
+        # Only the failed project is crawled again
+        self.server.failing = set()
+        projects = self.refresh()
+        self.assertEqual([p.id for p in projects], [4, 3, 2, 1])
+        self.assertEqual(self.server.request_count("/repository/"), self.server.request_count("/projects/2/"))
+        self.assertGreater(self.server.request_count("/projects/2/"), 0)
+        self.assertEqual([p.id for p in self.refresh()], [4, 3, 2, 1])
+        self.assertEqual(self.server.request_count(), 1)
+        # Projects that keep failing are given up for a while
+        self.server.failing = set([3])
+        self.server.touch(3, "README.md")
+        for _ in range(gl.GITLAB_MAX_RETRIES):
+            projects = self.refresh()
+            self.assertEqual(len(projects), 4)
+            self.assertGreater(self.server.request_count("/projects/3/"), 0)
+        projects = self.refresh()
+        self.assertEqual(self.server.request_count(), 1)
+        self.assertEqual(len([pkg for p in projects for pkg in p.packages]), 8)
+        # ... unless they change
+        self.server.failing = set()
+        self.server.touch(3, "README.md")
+        self.refresh()
+        self.assertGreater(self.server.request_count("/projects/3/"), 0)
+        server_cache = Cache(self.wsdir).get_object(gl.url_to_cache_name("fake", self.server.url + "/"), gl.GITLAB_PACKAGE_CACHE_VERSION)
+        self.assertEqual(server_cache.failures, {})
+
+    def test_checkpoints(self):
+        """Test that interrupted Gitlab updates are checkpointed by time"""
+        name = gl.url_to_cache_name("fake", self.server.url + "/")
+        for interval, expected in [(3600, 1), (0, 5)]:
+            with patch("rosrepo.gitlab.GITLAB_CHECKPOINT_INTERVAL", interval), patch.object(Cache, "set_object", autospec=True, side_effect=Cache.set_object) as set_object:
+                self.assertEqual(len(self.refresh(force_update=True)), 4)
+            # Without an interval, each crawled project is checkpointed before the final update
+            self.assertEqual(len([c for c in set_object.call_args_list if c[0][1] == name]), expected)
+
+    def test_network_budget(self):
+        """Test the global network budget for Gitlab updates"""
+        self.refresh()
+        slow_server = FakeGitlabServer(make_fixture(projects=3, packages=1, depth=1, start_id=10), latency=0.4).start()
+        try:
+            config = {"gitlab_servers": [
+                {"label": "slow", "url": slow_server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": 1},
+                {"label": "fake", "url": self.server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": 2},
+            ], "gitlab_network_budget": 1.0}
+            self.server.touch(1, "README.md")
+            with patch("rosrepo.gitlab.warning") as warning:
+                start = time.time()
+                projects = gl.get_gitlab_projects(self.wsdir, config, cache=Cache(self.wsdir), verbose=False)
+                self.assertLess(time.time() - start, 2.0)
+                self.assertIn("slow", warning.call_args[0][0])
+                self.assertNotIn("fake", warning.call_args[0][0])
+            self.assertEqual(sorted(p.id for p in projects), [1, 2, 3, 4])
+            deadline = gl.Deadline(0)
+            self.assertTrue(deadline.expired())
+            self.assertRaises(gl.DeadlineExceeded, deadline.timeout, 10)
+            self.assertEqual(gl.Deadline(None).timeout(10), 10)
+        finally:
+            slow_server.stop()
+
+    def test_stale_while_revalidate(self):
+        """Test answering from a stale Gitlab cache while it is refreshed in the background"""
+        config = {"gitlab_servers": [{"label": "fake", "url": self.server.url + "/", "private_token": PRIVATE_TOKEN, "crawl_depth": 2}], "gitlab_max_staleness": 60}
+        checked = gl.url_to_cache_name("fake", self.server.url + "/") + "_checked"
+
+        def get_projects(**kwargs):
+            gl._updated_urls.clear()
+            self.server.reset_requests()
+            with patch("rosrepo.gitlab.start_background_refresh") as start_background_refresh:
+                projects = gl.get_gitlab_projects(self.wsdir, config, cache=Cache(self.wsdir), verbose=False, **kwargs)
+            self.assertEqual(len(projects), 4)
+            return start_background_refresh.called
+
+        # Without a cache, the command has to wait for the crawl
+        self.assertIsNone(gl.get_gitlab_cache_age("fake", self.server.url + "/", Cache(self.wsdir)))
+        self.assertFalse(get_projects())
+        self.assertGreater(self.server.request_count(), 0)
+        self.assertLess(gl.get_gitlab_cache_age("fake", self.server.url + "/", Cache(self.wsdir)), 60)
+        # A cache within the maximum staleness is used as is and refreshed in the background
+        self.server.touch(1, "README.md")
+        self.assertTrue(get_projects())
+        self.assertEqual(self.server.request_count(), 0)
+        # ... unless the caller asks for up-to-date data
+        self.assertFalse(get_projects(allow_stale=False))
+        self.assertGreater(self.server.request_count(), 0)
+        # A cache beyond the maximum staleness is updated synchronously
+        Cache(self.wsdir).set_object(checked, gl.GITLAB_PACKAGE_CACHE_VERSION, time.time() - 3600)
+        self.assertFalse(get_projects())
+        self.assertEqual(self.server.request_count("order_by=last_activity_at"), 1)
+        self.assertLess(gl.get_gitlab_cache_age("fake", self.server.url + "/", Cache(self.wsdir)), 60)
+        # Without a maximum staleness, every command waits for the update
+        del config["gitlab_max_staleness"]
+        self.assertFalse(get_projects())
+        self.assertEqual(self.server.request_count("order_by=last_activity_at"), 1)
+        # The background refresh is a detached process
+        with patch("subprocess.Popen") as popen:
+            gl.start_background_refresh(self.wsdir)
+        self.assertEqual(popen.call_count, 1)
+        self.assertIn("refresh_gitlab_cache", popen.call_args[0][0][2])
+        self.assertEqual(popen.call_args[0][0][3], self.wsdir)
+
+    def test_webhooks(self):
+        """Test cache invalidation by Gitlab webhooks"""
+        self.refresh()
+        servers = [{"label": "fake", "url": self.server.url + "/", "webhooks": True}]
+        httpd = GitlabHookServer(self.wsdir, servers, secret="hooksecret", verbose=False)
+        hook_url = "http://127.0.0.1:%d/" % httpd.server_address[1]
+        # A push while no listener is running
+        self.server.touch(1, "dir0/pkg0_0/package.xml", package_xml("missed"))
+        with gl.gitlab_hook_lock(Cache(self.wsdir)) as acquired:
+            self.assertTrue(acquired)
+            self.assertIsNotNone(gl.get_gitlab_hook_start_time(Cache(self.wsdir)))
+            thread = threading.Thread(target=httpd.serve_forever)
+            thread.start()
+            try:
+                # The first refresh after the listener has started still polls
+                projects = self.refresh(use_webhooks=True)
+                self.assertEqual(self.server.request_count("order_by=last_activity_at"), 1)
+                self.assertIn("missed", [pkg.manifest.name for p in projects for pkg in p.packages])
+                # Without changes, the server is not contacted at all
+                projects = self.refresh(use_webhooks=True)
+                self.assertEqual(self.server.request_count(), 0)
+                self.assertEqual(len(projects), 4)
+                # A push event updates only the pushed project
+                self.server.touch(2, "dir0/pkg1_0/package.xml", package_xml("pushed"))
+                project = next(p for p in self.server.projects if p.id == 2)
+                self.assertEqual(post_webhook(hook_url, push_hook_payload(project, self.server.url), token="wrong"), 403)
+                self.assertEqual(post_webhook(hook_url, push_hook_payload(project, self.server.url), token=u"h\u00f6\u00f6ksecret"), 403)
+                # Oversized payloads are rejected before they are read
+                conn = HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+                try:
+                    conn.putrequest("POST", "/")
+                    conn.putheader("Content-Length", str(10 ** 12))
+                    conn.putheader("X-Gitlab-Token", "hooksecret")
+                    conn.endheaders()
+                    self.assertEqual(conn.getresponse().status, 413)
+                finally:
+                    conn.close()
+                self.assertEqual(post_webhook(hook_url, push_hook_payload(project, self.server.url), token="hooksecret"), 200)
+                self.assertEqual(gl.get_dirty_gitlab_projects(Cache(self.wsdir), "fake", self.server.url + "/"), set([2]))
+                projects = self.refresh(use_webhooks=True)
+                self.assertEqual(self.server.request_count("order_by=last_activity_at"), 0)
+                self.assertEqual(self.server.request_count("/projects/2/"), self.server.request_count("/repository/"))
+                self.assertEqual(self.server.request_count("/blobs/"), 1)
+                self.assertIn("pushed", [pkg.manifest.name for p in projects for pkg in p.packages])
+                self.assertEqual(gl.get_dirty_gitlab_projects(Cache(self.wsdir), "fake", self.server.url + "/"), set())
+                # A system hook reports a deleted project
+                project = next(p for p in self.server.projects if p.id == 3)
+                self.server.remove(3)
+                self.assertEqual(post_webhook(hook_url, system_hook_payload("project_destroy", project), event="System Hook", instance=self.server.url, token="hooksecret"), 200)
+                projects = self.refresh(use_webhooks=True)
+                self.assertEqual(sorted(p.id for p in projects), [1, 2, 4])
+                # Payloads from unknown servers are ignored
+                project.id = 4
+                self.assertEqual(post_webhook(hook_url, system_hook_payload("project_update", project), event="System Hook", instance="http://elsewhere", token="hooksecret"), 202)
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+                thread.join()
+        # Without a running listener, the server is polled as usual
+        self.assertIsNone(gl.get_gitlab_hook_start_time(Cache(self.wsdir)))
+        self.refresh(use_webhooks=True)
+        self.assertEqual(self.server.request_count("order_by=last_activity_at"), 1)
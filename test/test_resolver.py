@@ -26,6 +26,8 @@ import sys
 sys.stderr = sys.stdout
 import re
 import os
+import shutil
+from tempfile import mkdtemp
 
 try:
     from mock import patch
@@ -33,9 +35,12 @@ except ImportError:
     from unittest.mock import patch
 
 import rosrepo.resolver as resolver
+import rosrepo.depgraph as depgraph
 import rosrepo.workspace as ws
 import rosrepo.gitlab as gl
+import rosrepo.cmd_depend as cmd_depend
 import test.helper as helper
+from test.gitlab_server import package_xml
 from catkin_pkg.package import Package as Manifest, Dependency
 
 
@@ -74,6 +79,128 @@ class ResolverTest(unittest.TestCase):
                     self.assertEqual(pkg_list, pkg_list_2)
                 self.assertRaises(KeyError, rosdep.resolve, "nonsense%%")
 
+    def test_rosdep_index(self):
+        """Test the compiled rosdep index"""
+        cache_dir = mkdtemp()
+        try:
+            with patch.dict(os.environ, {"XDG_CACHE_HOME": cache_dir, "ROS_HOME": cache_dir}):
+                key = resolver.get_rosdep_index_key()
+                resolver.save_rosdep_index(key, frozenset(["catkin", "nowhere", "later"]), {"catkin": ("apt", ("ros-fake-catkin",)), "nowhere": None})
+                with patch("rosrepo.resolver.Rosdep.load_rosdep") as load_rosdep:
+                    rosdep = resolver.Rosdep()
+                    self.assertTrue(rosdep.ok())
+                    self.assertIn("catkin", rosdep)
+                    self.assertIn("later", rosdep)
+                    self.assertNotIn("nonsense%%", rosdep)
+                    self.assertEqual(rosdep.resolve("catkin"), ("apt", ("ros-fake-catkin",)))
+                    self.assertRaises(resolver.ResolutionError, rosdep.resolve, "nowhere")
+                    self.assertRaises(KeyError, rosdep.resolve, "nonsense%%")
+                    self.assertFalse(load_rosdep.called)
+                    # Keys which have not been resolved yet need rosdep
+                    self.assertRaises(resolver.ResolutionError, rosdep.resolve, "later")
+                    self.assertTrue(load_rosdep.called)
+                os.makedirs(os.path.join(resolver.get_rosdep_sources_cache_dir()))
+                with open(os.path.join(resolver.get_rosdep_sources_cache_dir(), "index"), "w") as f:
+                    f.write("updated")
+                with patch("rosrepo.resolver.Rosdep.load_rosdep") as load_rosdep:
+                    rosdep = resolver.Rosdep()
+                    self.assertTrue(load_rosdep.called)
+                self.assertFalse(rosdep.ok())
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_rosdep_compile(self):
+        """Test compiling and batch resolving rosdep rules"""
+        class FakeDefinition(object):
+            def __init__(self, rule):
+                self.rule = rule
+
+            def get_rule_for_platform(self, os_name, os_version, installer_keys, default_key):
+                if self.rule is None:
+                    raise ValueError("no rule")
+                return self.rule
+
+        class FakeView(object):
+            definitions = {
+                "alpha": FakeDefinition(("apt", ["alpha-dev"])),
+                "beta": FakeDefinition(("pip", ["beta"])),
+                "gamma": FakeDefinition(None),
+                "delta": FakeDefinition(("apt", ["delta-dev"])),
+            }
+
+            def keys(self):
+                return self.definitions.keys()
+
+            def lookup(self, dep):
+                return self.definitions[dep]
+
+        class FakeInstaller(object):
+            def resolve(self, rule):
+                return rule
+
+        class FakeInstallerContext(object):
+            def get_installer(self, key):
+                return FakeInstaller()
+
+        def load_rosdep(self):
+            self.view = FakeView()
+            self.installer_ctx = FakeInstallerContext()
+            self.os_name, self.os_version, self.installer_keys, self.default_key = "ubuntu", "focal", ["apt"], "apt"
+
+        with patch("rosrepo.resolver.load_rosdep_index", lambda key: None), patch("rosrepo.resolver.save_rosdep_index") as save_rosdep_index:
+            with patch("rosrepo.resolver.Rosdep.load_rosdep", load_rosdep):
+                rosdep = resolver.Rosdep()
+            self.assertEqual(rosdep.keys, frozenset(["alpha", "beta", "gamma", "delta"]))
+            self.assertEqual(rosdep.rules, {})
+            with patch("rosrepo.resolver.msg") as msg:
+                rules, unresolved = rosdep.resolve_many(["alpha", "beta", "alpha", "gamma", "nonsense%%"])
+                self.assertIn("apt: 1", msg.call_args[0][0])
+            self.assertEqual(rules, {"alpha": ("apt", ("alpha-dev",)), "beta": ("pip", ("beta",))})
+            self.assertEqual(unresolved, set(["gamma", "nonsense%%"]))
+            # Only the requested keys are resolved
+            self.assertEqual(rosdep.rules, {"alpha": ("apt", ("alpha-dev",)), "beta": ("pip", ("beta",)), "gamma": None})
+            self.assertEqual(sorted(rosdep.timings.keys()), ["apt", "pip"])
+            self.assertEqual(save_rosdep_index.call_args[0][2], rosdep.rules)
+            # ... and never twice
+            with patch.object(rosdep, "compile_rules") as compile_rules:
+                rules, unresolved = rosdep.resolve_many(["alpha", "gamma"])
+                self.assertFalse(compile_rules.called)
+            self.assertEqual(rules, {"alpha": ("apt", ("alpha-dev",))})
+            self.assertEqual(rosdep.resolve("delta"), ("apt", ("delta-dev",)))
+        ws_state = ws.WorkspaceState()
+        ws_state.ros_root_packages = {}
+        with patch("rosrepo.resolver._rosdep_instance", rosdep):
+            with patch("rosrepo.resolver.get_system_package_manager") as get_system_package_manager:
+                get_system_package_manager().installer = "apt"
+                with patch("rosrepo.resolver.warning") as warning:
+                    self.assertEqual(resolver.resolve_system_depends(ws_state, ["alpha", "beta", "gamma"]), set(["alpha-dev"]))
+                    self.assertEqual(warning.call_count, 2)
+
+    def test_dpkg_status(self):
+        """Test the dpkg status reader for installed system packages"""
+        tmp_dir = mkdtemp()
+        try:
+            status_file = os.path.join(tmp_dir, "status")
+            with open(status_file, "w") as f:
+                f.write(
+                    "Package: alpha\nStatus: install ok installed\nDescription: first line\n Package: fake\n\n"
+                    "Package: beta\nStatus: deinstall ok config-files\n\n"
+                    "Package: gamma\nStatus: install ok installed\nArchitecture: amd64\n\n"
+                    "Package: gamma\nStatus: install ok installed\nArchitecture: i386\n"
+                )
+            self.assertEqual(resolver.read_dpkg_status(status_file), set(["alpha", "gamma"]))
+            with patch.dict(os.environ, {"XDG_CACHE_HOME": tmp_dir}):
+                with patch("rosrepo.resolver.DPKG_STATUS_FILE", status_file):
+                    self.assertEqual(resolver.get_dpkg_installed_packages(), set(["alpha", "gamma"]))
+                    with patch("rosrepo.resolver.read_dpkg_status") as read_dpkg_status:
+                        self.assertEqual(resolver.get_dpkg_installed_packages(), set(["alpha", "gamma"]))
+                        self.assertFalse(read_dpkg_status.called)
+                    with open(status_file, "a") as f:
+                        f.write("\nPackage: delta\nStatus: install ok installed\n")
+                    self.assertEqual(resolver.get_dpkg_installed_packages(), set(["alpha", "gamma", "delta"]))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
     def test_find_dependees(self):
         """Test dependee resolution from workspace state"""
         ws_state = ws.WorkspaceState()
@@ -171,3 +298,199 @@ class ResolverTest(unittest.TestCase):
         depends, system_depends, conflicts = resolver.find_dependees(["alpha"], ws_state, auto_resolve=True, recursive=False, force_workspace=False)
         self.assertEqual(sorted(list(depends)), ["alpha", "beta"])
 
+    def test_dependency_graph(self):
+        """Test the integer-indexed dependency graph"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        p2 = fake_gitlab_project(2, "project_2", "http://fake/project_2")
+        ws_state.ws_packages["alpha"] = [fake_ws_package(None, "alpha", depends=["beta", "gamma"])]
+        ws_state.ros_root_packages["beta"] = [fake_ws_package(None, "beta", version="1.0.0")]
+        ws_state.remote_packages["alpha"] = [fake_gitlab_package(p1, "alpha")]
+        ws_state.remote_packages["beta"] = [fake_gitlab_package(p1, "beta", version="0.9.0"), fake_gitlab_package(p2, "beta", version="1.1.0")]
+        graph = depgraph.get_dependency_graph(ws_state)
+        self.assertIs(depgraph.get_dependency_graph(ws_state), graph)
+        alpha, beta = graph.ids["alpha"], graph.ids["beta"]
+        # Workspace packages shadow everything else
+        self.assertEqual([graph.sources[slot] for slot in graph.get_candidates(alpha)], [depgraph.P_WS])
+        # Candidates are sorted by version, best first
+        self.assertEqual([(graph.packages[slot].manifest.version, graph.sources[slot]) for slot in graph.get_candidates(beta)], [("1.1.0", depgraph.P_REMOTE), ("1.0.0", depgraph.P_ROS_ROOT), ("0.9.0", depgraph.P_REMOTE)])
+        slot = graph.get_candidates(alpha)[0]
+        self.assertEqual([graph.names[n] for n in graph.depends(slot)], ["beta", "gamma", "beta", "gamma"])
+        self.assertEqual([graph.names[n] for n in graph.depends(slot, ["build_depends"])], ["beta", "gamma"])
+        self.assertEqual(graph.get_candidates(graph.ids["gamma"]), [])
+        # Any change to the workspace state discards the graph
+        ws_state.ws_packages = {}
+        self.assertIsNot(depgraph.get_dependency_graph(ws_state), graph)
+        self.assertEqual(len(depgraph.get_dependency_graph(ws_state).get_candidates(depgraph.get_dependency_graph(ws_state).ids["alpha"])), 1)
+
+    def test_depend_profiles(self):
+        """Test dependency resolution profiles"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        m = Manifest("alpha", name="alpha", version="0.0.0", package_format=2, build_depends=[Dependency("beta")], exec_depends=[Dependency("gamma")], test_depends=[Dependency("delta")])
+        ws_state.ws_packages["alpha"] = [ws.Package(manifest=m, workspace_path="alpha", project=None)]
+        ws_state.remote_packages["beta"] = [fake_gitlab_package(p1, "beta")]
+        ws_state.remote_packages["gamma"] = [fake_gitlab_package(p1, "gamma")]
+        ws_state.remote_packages["delta"] = [fake_gitlab_package(p1, "delta", depends=["epsilon"])]
+        ws_state.remote_packages["epsilon"] = [fake_gitlab_package(p1, "epsilon")]
+        depends, _, _ = resolver.find_dependees(["alpha"], ws_state, profile="build")
+        self.assertEqual(sorted(depends), ["alpha", "beta"])
+        depends, _, _ = resolver.find_dependees(["alpha"], ws_state, profile="run")
+        self.assertEqual(sorted(depends), ["alpha", "beta", "gamma"])
+        depends, _, _ = resolver.find_dependees(["alpha"], ws_state)
+        self.assertEqual(sorted(depends), ["alpha", "beta", "delta", "epsilon", "gamma"])
+        closures, _, _ = resolver.find_dependee_closures(["alpha"], ws_state, profile="run")
+        self.assertEqual(closures.get_names(closures.closure(["alpha"])), set(["alpha", "beta", "gamma"]))
+
+    def test_build_profile_exports(self):
+        """Test that the build profile follows build export dependencies"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        m = Manifest("alpha", name="alpha", version="0.0.0", package_format=2, build_depends=[Dependency("beta")])
+        ws_state.ws_packages["alpha"] = [ws.Package(manifest=m, workspace_path="alpha", project=None)]
+        m = Manifest("beta", name="beta", version="0.0.0", package_format=2, build_export_depends=[Dependency("gamma")], exec_depends=[Dependency("delta")])
+        ws_state.ws_packages["beta"] = [ws.Package(manifest=m, workspace_path="beta", project=None)]
+        xml = package_xml("gamma").replace("</package>", "<buildtool_export_depend>epsilon</buildtool_export_depend><exec_depend>zeta</exec_depend></package>")
+        gamma = gl.GitlabPackage(manifest=gl.LazyManifest.from_xml(xml, "package.xml"), project=p1)
+        p1.packages.append(gamma)
+        ws_state.remote_packages["gamma"] = [gamma]
+        for name in ["delta", "epsilon", "zeta"]:
+            ws_state.remote_packages[name] = [fake_gitlab_package(p1, name)]
+        # Remote manifests are resolved without parsing them again
+        with patch("rosrepo.gitlab.parse_package_string") as parse:
+            depends, _, _ = resolver.find_dependees(["alpha"], ws_state, profile="build")
+            self.assertFalse(parse.called)
+        self.assertEqual(sorted(depends), ["alpha", "beta", "epsilon", "gamma"])
+        closures, _, _ = resolver.find_dependee_closures(["alpha"], ws_state, profile="build")
+        self.assertEqual(closures.get_names(closures.closure(["alpha"])), set(["alpha", "beta", "epsilon", "gamma"]))
+
+    def test_closure_engine(self):
+        """Test bitset closures with collapsed dependency cycles"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        ws_state.ws_packages["alpha"] = [fake_ws_package(None, "alpha", depends=["beta"])]
+        ws_state.ws_packages["beta"] = [fake_ws_package(None, "beta", depends=["gamma", "rho"])]
+        ws_state.ws_packages["gamma"] = [fake_ws_package(None, "gamma", depends=["beta", "delta"])]
+        ws_state.ws_packages["delta"] = [fake_ws_package(None, "delta")]
+        ws_state.ws_packages["epsilon"] = [fake_ws_package(None, "epsilon", depends=["delta", "zeta"])]
+        ws_state.ws_packages["unused"] = [fake_ws_package(None, "unused")]
+        ws_state.ros_root_packages["rho"] = [fake_ws_package(None, "rho")]
+        ws_state.remote_packages["zeta"] = [fake_gitlab_package(p1, "zeta", depends=["epsilon"])]
+        closures, system_depends, conflicts = resolver.find_dependee_closures(["alpha", "epsilon"], ws_state)
+        self.assertEqual(system_depends, set(["rho"]))
+        self.assertEqual(conflicts, {})
+        for seeds in [["alpha"], ["gamma"], ["epsilon"], ["zeta"], ["delta"], ["alpha", "epsilon"]]:
+            depends, _, _ = resolver.find_dependees(seeds, ws_state)
+            self.assertEqual(closures.get_packages(closures.closure(seeds)), depends)
+        self.assertEqual(closures.closure(["beta"]), closures.closure(["gamma"]))
+        self.assertEqual(closures.get_names(closures.closure(["alpha"]) & closures.closure(["epsilon"])), set(["delta"]))
+        used = closures.closure(["alpha", "epsilon"])
+        self.assertEqual(set(ws_state.ws_packages) - closures.get_names(used), set(["unused"]))
+        self.assertEqual(closures.mask(["unused", "rho"]), 0)
+
+    def test_build_schedule(self):
+        """Test build order, levels and critical path"""
+        packages = {
+            "alpha": fake_ws_package(None, "alpha", depends=["beta", "gamma", "rho"]),
+            "beta": fake_ws_package(None, "beta", depends=["delta"]),
+            "gamma": fake_ws_package(None, "gamma", depends=["delta"]),
+            "delta": fake_ws_package(None, "delta"),
+            "epsilon": fake_ws_package(None, "epsilon", depends=["zeta"]),
+            "zeta": fake_ws_package(None, "zeta", depends=["epsilon", "delta"]),
+        }
+        schedule = depgraph.get_build_schedule(packages)
+        for name, pkg in packages.items():
+            for dep in pkg.manifest.build_depends:
+                if dep.name in packages and set([name, dep.name]) != set(["epsilon", "zeta"]):
+                    self.assertLess(schedule.order.index(dep.name), schedule.order.index(name))
+        self.assertEqual(schedule.levels, [["delta"], ["beta", "epsilon", "gamma", "zeta"], ["alpha"]])
+        self.assertEqual(schedule.critical_time, 3.0)
+        self.assertEqual(schedule.total_time, 6.0)
+        schedule = depgraph.get_build_schedule(packages, durations={"gamma": 10.0, "delta": 2.0, "zeta": 1.0, "epsilon": 1.0})
+        self.assertEqual(schedule.critical_path, ["delta", "gamma", "alpha"])
+        self.assertEqual(schedule.durations["alpha"], 2.0)
+        self.assertEqual(schedule.critical_time, 14.0)
+        self.assertEqual(depgraph.get_build_schedule({}).order, [])
+        tmp_dir = mkdtemp()
+        try:
+            for name, stages in [("alpha", [("build.cmake.log", 100), ("build.make.log", 160)]), ("beta", [("build.cmake.log", 100)])]:
+                os.makedirs(os.path.join(tmp_dir, "logs", name))
+                for filename, mtime in stages:
+                    with open(os.path.join(tmp_dir, "logs", name, filename), "w"):
+                        pass
+                    os.utime(os.path.join(tmp_dir, "logs", name, filename), (mtime, mtime))
+            self.assertEqual(ws.get_build_durations(tmp_dir), {"alpha": 60.0})
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def test_build_plan_without_durations(self):
+        """Test build plan for packages which took no measurable time to build"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        ws_state.ws_packages["alpha"] = [fake_ws_package(None, "alpha", depends=["beta"])]
+        ws_state.ws_packages["beta"] = [fake_ws_package(None, "beta")]
+        tmp_dir = mkdtemp()
+        try:
+            for name in ["alpha", "beta"]:
+                os.makedirs(os.path.join(tmp_dir, "logs", name))
+                for filename in ["build.cmake.log", "build.make.log"]:
+                    with open(os.path.join(tmp_dir, "logs", name, filename), "w"):
+                        pass
+                    os.utime(os.path.join(tmp_dir, "logs", name, filename), (100, 100))
+            with patch("sys.stdout", helper.StringIO()), patch("rosrepo.cmd_depend.TableView") as table:
+                cmd_depend.show_plan(tmp_dir, {}, ws_state, ["alpha"])
+            self.assertIn(("@{cf}Average Parallelism:", "n/a"), [c[0] for c in table.return_value.add_row.call_args_list])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def test_find_dependers(self):
+        """Test dependers lookup in the reverse dependency index"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        ws_state.ws_packages["alpha"] = [fake_ws_package(None, "alpha", depends=["beta"])]
+        ws_state.ws_packages["beta"] = [fake_ws_package(None, "beta", depends=["gamma"])]
+        ws_state.ros_root_packages["rho"] = [fake_ws_package(None, "rho", depends=["gamma"])]
+        ws_state.remote_packages["gamma"] = [fake_gitlab_package(p1, "gamma", depends=["system"])]
+        ws_state.remote_packages["delta"] = [fake_gitlab_package(p1, "delta", depends=["beta"])]
+        depends, system_depends = resolver.find_dependers(["gamma"], ws_state)
+        self.assertEqual(depends, set(["beta"]))
+        self.assertEqual(system_depends, set())
+        depends, _ = resolver.find_dependers(["beta"], ws_state)
+        self.assertEqual(depends, set(["alpha", "delta"]))
+        depends, _ = resolver.find_dependers(["system"], ws_state, recursive=True)
+        self.assertEqual(depends, set(["alpha", "beta", "gamma", "delta"]))
+        depends, _ = resolver.find_dependers(["unknown"], ws_state, recursive=True)
+        self.assertEqual(depends, set())
+
+    def test_resolution_cache(self):
+        """Test memoized dependee resolution"""
+        ws_state = ws.WorkspaceState(ws_packages={}, ros_root_packages={}, remote_packages={}, ws_projects=[], remote_projects=[])
+        p1 = fake_gitlab_project(1, "project_1", "http://fake/project_1")
+        p2 = fake_gitlab_project(2, "project_2", "http://fake/project_2")
+        ws_state.ws_packages["alpha"] = [fake_ws_package(None, "alpha", depends=["beta"])]
+        ws_state.ws_packages["delta"] = [fake_ws_package(None, "delta", depends=["epsilon"])]
+        ws_state.remote_packages["beta"] = [fake_gitlab_package(p1, "beta", depends=["gamma"])]
+        ws_state.remote_packages["gamma"] = [fake_gitlab_package(p1, "gamma")]
+        ws_state.remote_packages["epsilon"] = [fake_gitlab_package(p2, "epsilon")]
+        with patch("rosrepo.resolver.resolve_dependees", wraps=resolver.resolve_dependees) as resolve:
+            depends, _, _ = resolver.find_dependees(["alpha"], ws_state)
+            self.assertEqual(sorted(depends), ["alpha", "beta", "gamma"])
+            depends["bogus"] = None
+            depends, _, _ = resolver.find_dependees(["alpha"], ws_state)
+            self.assertEqual(sorted(depends), ["alpha", "beta", "gamma"])
+            resolver.find_dependees(["delta"], ws_state)
+            self.assertEqual(resolve.call_count, 2)
+            # Cloning beta only invalidates the closure which contains it
+            ws_packages = dict(ws_state.ws_packages)
+            ws_packages["beta"] = [fake_ws_package(p1, "beta", depends=["gamma"])]
+            ws_packages["delta"] = [fake_ws_package(None, "delta", depends=["epsilon"])]
+            ws_state.ws_packages = ws_packages
+            depends, _, _ = resolver.find_dependees(["delta"], ws_state)
+            self.assertIs(depends["delta"], ws_packages["delta"][0])
+            self.assertEqual(resolve.call_count, 2)
+            depends, _, _ = resolver.find_dependees(["alpha"], ws_state)
+            self.assertIs(depends["beta"], ws_packages["beta"][0])
+            self.assertEqual(resolve.call_count, 3)
+            # Other changes discard the whole cache
+            ws_state.remote_packages = dict(ws_state.remote_packages)
+            resolver.find_dependees(["delta"], ws_state)
+            self.assertEqual(resolve.call_count, 4)
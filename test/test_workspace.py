@@ -35,6 +35,9 @@ import sys
 sys.stderr = sys.stdout
 
 from rosrepo.config import Config
+from rosrepo.cache import Cache
+import rosrepo.workspace as ws
+import rosrepo.resolver as resolver
 import test.helper as helper
 
 class WorkspaceTest(unittest.TestCase):
@@ -300,6 +303,72 @@ class WorkspaceTest(unittest.TestCase):
         self.assertEqual(exitcode, 0)
         exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "--clean", "--dry-run", "--offline", "--verbose", "--no-status", "--keep-going", "-j2")
         self.assertEqual(exitcode, 0)
+        # Unchanged workspace: reuse the build plan from the last build
+        with patch("rosrepo.cmd_build.get_workspace_state", wraps=ws.get_workspace_state) as get_workspace_state:
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir)
+            self.assertEqual(exitcode, 0)
+            self.assertIn("delta", stdout)
+            self.assertFalse(get_workspace_state.called)
+            helper.create_package(self.wsdir, "beta", ["delta", "gamma"])
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir)
+            self.assertEqual(exitcode, 0)
+            self.assertIn("gamma", stdout)
+            self.assertTrue(get_workspace_state.called)
+
+    def test_build_plan(self):
+        """Test reuse and invalidation of cached build plans"""
+        os.makedirs(os.path.join(self.ros_root_dir, "share", "rho"))
+        ros_manifest = os.path.join(self.ros_root_dir, "share", "rho", "package.xml")
+        with open(ros_manifest, "w") as f:
+            f.write('<package><name>rho</name><version>0.0.0</version><description>Mock</description><maintainer email="mock@example.com">Mister Mock</maintainer><license>none</license></package>\n')
+        exitcode, stdout = helper.run_rosrepo("init", "-r", self.ros_root_dir, self.wsdir)
+        self.assertEqual(exitcode, 0)
+        with patch("rosrepo.cmd_build.find_dependees", wraps=resolver.find_dependees) as find_dependees:
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "alpha")
+            self.assertEqual(exitcode, 0)
+            self.assertTrue(find_dependees.called)
+            # Nothing has changed, so the plan is reused
+            find_dependees.reset_mock()
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "alpha")
+            self.assertEqual(exitcode, 0)
+            self.assertIn("delta", stdout)
+            self.assertFalse(find_dependees.called)
+            # A different build set needs a different plan
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "beta")
+            self.assertEqual(exitcode, 0)
+            self.assertTrue(find_dependees.called)
+            # A ROS root package updated in place invalidates the plan
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "beta")
+            self.assertEqual(exitcode, 0)
+            find_dependees.reset_mock()
+            mtime = os.path.getmtime(ros_manifest) + 10
+            os.utime(ros_manifest, (mtime, mtime))
+            exitcode, stdout = helper.run_rosrepo("build", "-w", self.wsdir, "beta")
+            self.assertEqual(exitcode, 0)
+            self.assertTrue(find_dependees.called)
+
+    def test_workspace_fingerprint(self):
+        """Test the workspace fingerprint for cached build plans"""
+        os.makedirs(os.path.join(self.ros_root_dir, "share", "rho"))
+        ros_manifest = os.path.join(self.ros_root_dir, "share", "rho", "package.xml")
+        with open(ros_manifest, "w") as f:
+            f.write('<package><name>rho</name><version>0.0.0</version><description>Mock</description><maintainer email="mock@example.com">Mister Mock</maintainer><license>none</license></package>\n')
+        cache = Cache(self.wsdir)
+        ws.find_catkin_packages(self.ros_root_dir, cache=cache, cache_id="ros_root_packages")
+        config = {}
+        fingerprint = ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "plan")
+        self.assertEqual(ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "plan"), fingerprint)
+        self.assertNotEqual(ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "other plan"), fingerprint)
+        # A ROS root manifest edited in place leaves the share directory as it is
+        share_mtime = os.path.getmtime(os.path.join(self.ros_root_dir, "share"))
+        os.utime(ros_manifest, (share_mtime + 10, share_mtime + 10))
+        self.assertEqual(os.path.getmtime(os.path.join(self.ros_root_dir, "share")), share_mtime)
+        changed = ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "plan")
+        self.assertNotEqual(changed, fingerprint)
+        # Workspace manifests are tracked as well
+        changed = ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "plan")
+        helper.create_package(self.wsdir, "beta", ["delta", "gamma"])
+        self.assertNotEqual(ws.get_workspace_fingerprint(self.wsdir, config, cache, self.ros_root_dir, "plan"), changed)
 
     def test_list(self):
         """Test proper behavior of 'rosrepo list'"""